@@ -0,0 +1,272 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that applies the pipeline.py operations to all images (.jpg, .png, .tif, .npy) and videos (.avi)
+within a selected directory using several processes at once
+--Each file is handled by one worker process, files are processed in parallel
+
+Input variables
+--workers: number of worker processes, None uses one per CPU core
+--stages, start_frame, end_frame: operations applied to each file, see pipeline.py
+--resume: skip files already processed with the same stages by batch.py or pipeline.py, see manifest.py
+
+Output files
+--All images or videos with all operations applied, provided within a "Batch" folder within the original directory
+----Videos default to .avi save
+----iCLOTS analyzes only .avi files
+--A summary of files processed successfully and files that failed is printed at the end of the batch
+
+Some tips from the iCLOTS team:
+--Largest files are started first so one long video does not finish alone at the end of the batch
+----Video size is estimated as number of frames x width x height
+----Image size is estimated from file size, images are processed after most videos
+--A file that fails (e.g. a corrupted video) does not stop the batch, check the summary for errors
+----With resume, running the batch again only processes the files that failed or were never finished
+--Each worker uses a single OpenCV thread, using more workers than CPU cores won't speed processing
+
+"""
+
+# Import
+import cv2
+import os
+import glob
+import datetime
+import time
+import concurrent.futures
+
+import frame_cache
+import image_io
+import instrument
+import manifest
+import pipeline
+import tiff_stack
+import tiles
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Number of worker processes
+workers = None  # (None: one per CPU core)
+# Operations applied to each frame, in order, see pipeline.py
+stages = pipeline.stages
+# First and last frame to be retained (videos only)
+start_frame = pipeline.start_frame
+end_frame = pipeline.end_frame
+# Skip files already processed
+resume = manifest.resume
+
+
+def filesize(path):
+    """Function to estimate the amount of work a file represents
+    --Videos: frame count x width x height, images: size on disk"""
+
+    if path.lower().endswith(('.avi', '.mp4')):
+        capture = cv2.VideoCapture(path)
+        n = capture.get(cv2.CAP_PROP_FRAME_COUNT) * capture.get(3) * capture.get(4)
+        capture.release()
+        return n
+
+    return os.path.getsize(path)
+
+def mainsettings():
+    """Function to collect the settings at the top of helper modules, as set in this process (e.g. by cli.py)
+    --Returns a dictionary of {module name: {setting: value}}, passed to initworker"""
+
+    return {'video_writer': {'codec': video_writer.codec},
+            'image_io': {'color_mode': image_io.color_mode},
+            'tiles': {'tile_mode': tiles.tile_mode},
+            'frame_cache': {'use_cache': frame_cache.use_cache, 'cache_dir': frame_cache.cache_dir,
+                            'max_size_gb': frame_cache.max_size_gb},
+            'instrument': {'enabled': instrument.enabled}}
+
+def initworker(settings=None):
+    """Function run once in each worker process, keeps OpenCV from competing with other workers for cores
+    --settings: mainsettings() of the main process, worker processes started without copying its memory
+    (e.g. on Windows and Mac OS) otherwise use the values at the top of each helper module"""
+
+    cv2.setNumThreads(1)
+    modules = {'video_writer': video_writer, 'image_io': image_io, 'tiles': tiles, 'frame_cache': frame_cache,
+               'instrument': instrument}
+    for module, values in (settings or {}).items():
+        for setting, value in values.items():
+            setattr(modules[module], setting, value)
+
+def runtask(path, function, args, timing=False):
+    """Function run within a worker process, applies function to args and times it
+    --timing: also time each stage, function must accept a timer keyword (see instrument.py)"""
+
+    start = time.perf_counter()
+    if timing:
+        timer = instrument.FileTimer(path)
+        result = function(*args, timer=timer)
+        stage_seconds, frames = timer.seconds, timer.frames
+    else:
+        result = function(*args)
+        stage_seconds, frames = None, None
+
+    return result, time.perf_counter() - start, stage_seconds, frames
+
+def runbatch(tasks, workers=None, timing=False, callback=None):
+    """Function to run (path, function, args) tasks across a pool of worker processes
+    --Tasks are submitted largest first
+    --timing: also time each stage of each file, see instrument.py
+    --callback: optional function called with the index and summary dictionary of each task as it finishes
+    --Returns one summary dictionary per task, in the order tasks were given"""
+
+    sizes = {path: filesize(path) for path, function, args in tasks}
+    order = sorted(range(len(tasks)), key=lambda i: sizes[tasks[i][0]], reverse=True)
+
+    summary = [None] * len(tasks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initworker,
+                                                initargs=(mainsettings(),)) as executor:
+        futures = {}
+        for i in order:
+            path, function, args = tasks[i]
+            futures[executor.submit(runtask, path, function, args, timing)] = i
+
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            path = tasks[i][0]
+            try:
+                result, seconds, stage_seconds, frames = future.result()
+                summary[i] = {'file': path, 'success': True, 'result': result, 'seconds': seconds,
+                              'stage_seconds': stage_seconds, 'frames': frames, 'error': None}
+            except Exception as e:  # A failed file is reported, the rest of the batch continues
+                summary[i] = {'file': path, 'success': False, 'result': None, 'seconds': None,
+                              'stage_seconds': None, 'frames': None, 'error': type(e).__name__ + ': ' + str(e)}
+            if callback is not None:
+                callback(i, summary[i])
+
+    return summary
+
+def printsummary(summary):
+    """Function to print a per-file success/failure summary of a batch"""
+
+    n_failed = 0
+    for entry in summary:
+        if entry.get('reused') and entry.get('same_as'):
+            print('REUSED ' + os.path.basename(entry['file']) + ' (identical to ' +
+                  os.path.basename(entry['same_as']) + ')')
+        elif entry.get('reused'):
+            print('REUSED ' + os.path.basename(entry['file']) + ' (processed by an earlier run)')
+        elif entry['success']:
+            print('OK     ' + os.path.basename(entry['file']) + ' (' + '%.1f' % entry['seconds'] + ' s)')
+        else:
+            n_failed += 1
+            print('FAILED ' + os.path.basename(entry['file']) + ': ' + entry['error'])
+    print(str(len(summary) - n_failed) + ' of ' + str(len(summary)) + ' files processed successfully')
+
+
+def run(dirpath, workers=workers, stages=stages, start_frame=start_frame, end_frame=end_frame, imglist=None,
+        videolist=None, resume=resume):
+    """Function to apply all stages to all images and videos in parallel, saved in a new "Batch" folder within dirpath
+    --imglist, videolist: files to process, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --resume: skip files already processed with the same stages, see manifest.py
+    --Returns the path of the new folder and the summary of the batch"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create a string to indicate operations performed
+    str_stages = pipeline.stagestring(stages)
+    output_folder = os.path.join(dirpath, 'Batch, ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    # Files processed by earlier runs, if resuming, recorded the same way as by pipeline.py
+    previous = manifest.Manifest(dirpath) if resume else None
+    image_parameters = {'stages': stages, 'color_mode': image_io.color_mode}
+    video_parameters = {'stages': stages, 'start_frame': start_frame, 'end_frame': end_frame,
+                        'codec': video_writer.codec, 'color_mode': image_io.color_mode}
+
+    # One task per file, output paths are absolute as workers do not share a working directory
+    tasks = []
+    keys = []
+    reused = []
+    first = {}  # Task of the first file with each key, identical files reuse its output rather than race it
+    duplicates = []  # (task, path, output) of identical files
+    for img in imglist:
+        name = os.path.join(output_folder, os.path.basename(img).split(".")[0] + '_' + str_stages + '.png')
+        if previous is not None:
+            key = previous.key(img, 'pipeline', image_parameters)
+            if previous.reuseoutput(key, name):
+                reused.append(img)
+                continue
+            if key in first:
+                duplicates.append((first[key], img, name))
+                continue
+            first[key] = len(tasks)
+            keys.append((key, image_parameters))
+        tasks.append((img, pipeline.processimage, (img, name, stages)))
+    for video in videolist:
+        name = os.path.join(output_folder, os.path.basename(video).split(".")[0] + '_' + str_stages +
+                            video_writer.videoextension())
+        checkpoint_dir = None
+        if previous is not None:
+            key = previous.key(video, 'pipeline', video_parameters)
+            if previous.reuseoutput(key, name):
+                reused.append(video)
+                continue
+            if key in first:
+                duplicates.append((first[key], video, name))  # Would share a checkpoint folder
+                continue
+            first[key] = len(tasks)
+            keys.append((key, video_parameters))
+            checkpoint_dir = previous.checkpointdir(key)
+        tasks.append((video, pipeline.processvideo, (video, name, stages, start_frame, end_frame, checkpoint_dir)))
+
+    def finished(i, entry):
+        # Record each file as soon as it is finished, so a stopped batch loses at most the files in progress
+        path, function, args = tasks[i]
+        if previous is not None and entry['success'] and os.path.exists(args[1]):
+            key, parameters = keys[i]
+            previous.record(key, path, 'pipeline', parameters, args[1])
+            for task, duplicate, name in duplicates:
+                if task == i:
+                    manifest.reuse(args[1], name)
+
+    # Time each file if instrument.py is enabled, the run is timed from before the first task is submitted
+    report = instrument.RunReport(output_folder, 'batch', {'stages': stages, 'start_frame': start_frame,
+                                                           'end_frame': end_frame, 'workers': workers})
+
+    summary = runbatch(tasks, workers, timing=instrument.enabled, callback=finished)
+    summary += [{'file': path, 'success': True, 'result': None, 'seconds': 0., 'stage_seconds': None,
+                 'frames': None, 'error': None, 'reused': True} for path in reused]
+    summary += [{'file': path, 'success': summary[task]['success'], 'result': None, 'seconds': 0.,
+                 'stage_seconds': None, 'frames': None, 'reused': summary[task]['success'], 'same_as': tasks[task][0],
+                 'error': None if summary[task]['success'] else 'identical to ' + tasks[task][0] + ', which failed'}
+                for task, path, name in duplicates]
+    printsummary(summary)
+
+    # Save timing of each file
+    for (path, function, args), entry in zip(tasks, summary):
+        if entry['success']:
+            report.record(path, args[1], entry['frames'], entry['seconds'], entry['stage_seconds'])
+    report.save()
+
+    return output_folder, summary
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
@@ -0,0 +1,309 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that measures how fast each operation in this repository runs
+--Synthetic microscopy videos and image folders are generated, no data files are needed
+----Bright blobs (cells) move along horizontal bands (channels) on a dark, noisy background
+--Each operation is run on each synthetic file in its own process
+
+Input variables
+--resolutions: list of (width, height) frame dimensions tested
+--frame_counts: list of video lengths tested, in frames
+--operations: list of operations tested, see OPERATIONS below
+--threshold: fractional slowdown (or increase in memory) relative to the baseline reported as a regression
+----e.g. 0.1 reports operations more than 10% slower than the baseline
+--baseline_file: results of an earlier run to compare against, None or a missing file skips the comparison
+--codecs: list of codecs compared on a synthetic clip of each resolution, see video_writer.py
+----None skips the comparison
+
+Output files
+--results_file: a .json file with frames/s, MB/s and peak memory (RSS) for each operation and file
+----Also lists the OpenCV and numpy versions tested
+----And, if codecs are compared, frames/s saved, file size and largest pixel error of each codec
+--Regressions are printed, the script exits with an error if there are any
+
+Some tips from the iCLOTS team:
+--Save the results of a run as the baseline before upgrading OpenCV or changing code, then run again
+--MB/s is computed from the size of the decoded frames, not the compressed video
+--Timings vary from run to run, a threshold of 0.1-0.2 avoids reporting noise as a regression
+--Peak memory includes Python, OpenCV and numpy themselves, roughly 100 MB
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import datetime
+import functools
+import concurrent.futures
+
+import crop_video
+import drop_static
+import edit_contrast
+import frame_engine
+import imgseq_to_video
+import normalize_intrange
+import pipeline
+import resize
+import rotate
+import subtract_background
+import video_to_imgseq
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Synthetic files generated
+resolutions = [(640, 480), (1280, 1024)]
+frame_counts = [100, 500]
+# Operations measured, None measures all
+operations = None
+# Regression threshold and files
+threshold = 0.15
+results_file = 'benchmark_results.json'
+baseline_file = 'benchmark_baseline.json'
+# Codecs compared
+codecs = None  # (None: no comparison, e.g. ['XVID', 'MJPG', 'FFV1', 'HFYU', 'raw'])
+# Frames in the clip codecs are compared on
+codec_frames = 100
+
+
+def syntheticframe(w, h, i, seed=0):
+    """Function to create frame i of a synthetic microscopy video
+    --Dark noisy background, brighter horizontal channels, bright blobs moving left to right in channels"""
+
+    rng = np.random.default_rng(seed + i)
+    frame = rng.integers(10, 30, (h, w), dtype=np.uint8)  # Background with noise
+
+    n_channels = 3
+    channel_h = h // (2 * n_channels + 1)
+    blob_r = max(channel_h // 4, 2)
+    for c in range(n_channels):
+        y0 = (2 * c + 1) * channel_h
+        frame[y0:y0 + channel_h] += 40  # Channel
+        for b in range(4):
+            # Each blob moves at its own velocity, wrapping around at the end of the channel
+            x = int((b * w / 4 + i * (3 + b + c)) % w)
+            y = y0 + channel_h // 2 + (b % 3 - 1) * blob_r
+            cv2.circle(frame, (x, y), blob_r, 200, -1)
+
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+def makevideo(name, w, h, n):
+    """Function to write an n frame synthetic video"""
+
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
+    out = cv2.VideoWriter(name, fourcc, 30, (w, h))
+    for i in range(n):
+        out.write(syntheticframe(w, h, i))
+    out.release()
+
+def makeimages(folder, w, h, n):
+    """Function to write n synthetic frames as .png images"""
+
+    os.makedirs(folder, exist_ok=True)
+    for i in range(n):
+        cv2.imwrite(os.path.join(folder, 'frame_' + str(i).zfill(5) + '.png'), syntheticframe(w, h, i))
+
+def transformvideo(video, name, function):
+    """Function to apply a per-frame function to a video the way rotate.py, edit_contrast.py and resize.py do"""
+
+    capture = cv2.VideoCapture(video)
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+    ret, frame = capture.read()
+    h, w = function(frame).shape[:2]  # Output dimensions
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    out = video_writer.VideoWriter(name, fps, (w, h))
+    frame_engine.processframes(capture, out, function)
+    capture.release()
+    out.release()
+
+def oprotate(video, folder, output_folder, w, h, n):
+    transformvideo(video, os.path.join(output_folder, 'rotate.avi'),
+                   functools.partial(rotate.rotateframe, w=w, h=h, angle=5))
+
+def opresize(video, folder, output_folder, w, h, n):
+    transformvideo(video, os.path.join(output_folder, 'resize.avi'),
+                   functools.partial(resize.resizeframe, w_n=w // 2, h_n=h // 2))
+
+def opresizescales(video, folder, output_folder, w, h, n):
+    resize.run(output_folder, scales=[1, 0.5, 0.25], imglist=[], videolist=[video])
+
+def opcontrast(video, folder, output_folder, w, h, n):
+    transformvideo(video, os.path.join(output_folder, 'contrast.avi'),
+                   functools.partial(edit_contrast.editcontrast, w=w, h=h, alpha=1.5, beta=-10, inplace=True))
+
+def oproi(video, folder, output_folder, w, h, n):
+    stages = [('roi', {'ROI_x': w // 4, 'ROI_y': h // 4, 'ROI_w': w // 2, 'ROI_h': h // 2})]
+    pipeline.processvideo(video, os.path.join(output_folder, 'roi.avi'), stages)
+
+def opcropframes(video, folder, output_folder, w, h, n):
+    crop_video.cropvideo(video, os.path.join(output_folder, 'crop.avi'), n // 4, 3 * n // 4)
+
+def opdropstatic(video, folder, output_folder, w, h, n):
+    drop_static.dropstatic(video, os.path.join(output_folder, 'drop_static.avi'))
+
+def opnormalize(video, folder, output_folder, w, h, n):
+    normalize_intrange.normalizevideo(video, os.path.join(output_folder, 'normalize.avi'), 'global', (1, 99))
+
+def opbackground(video, folder, output_folder, w, h, n):
+    subtract_background.backgroundvideo(video, os.path.join(output_folder, 'background.avi'))
+
+def opimgseqtovideo(video, folder, output_folder, w, h, n):
+    imglist = sorted(os.path.join(folder, f) for f in os.listdir(folder))
+    imgseq_to_video.imgseqtovideo(imglist, os.path.join(output_folder, 'imgseq.avi'), 30)
+
+def opvideotoimgseq(video, folder, output_folder, w, h, n):
+    export_folder = os.path.join(output_folder, 'frames')
+    os.makedirs(export_folder, exist_ok=True)
+    video_to_imgseq.videotoimgseq(video, os.path.join(export_folder, 'frames'))
+
+# Operations available to benchmark
+OPERATIONS = {
+    'rotate': oprotate,
+    'resize': opresize,
+    'resize_scales': opresizescales,
+    'contrast': opcontrast,
+    'roi': oproi,
+    'crop_frames': opcropframes,
+    'drop_static': opdropstatic,
+    'normalize': opnormalize,
+    'background': opbackground,
+    'imgseq_to_video': opimgseqtovideo,
+    'video_to_imgseq': opvideotoimgseq,
+}
+
+def comparecodecs(resolutions=resolutions, codecs=None, n=codec_frames):
+    """Function to compare how fast each codec saves a synthetic clip of each resolution, and how large it is
+    --Returns a dictionary of results by "codec widthxheight" """
+
+    results = {}
+    for w, h in resolutions:
+        frames = [syntheticframe(w, h, i) for i in range(n)]
+        size = str(w) + 'x' + str(h)
+        for codec, result in video_writer.benchmarkcodecs(frames, 30, codecs).items():
+            results[codec + ' ' + size] = result
+            if result is None:
+                print(codec + ' ' + size + ': not supported by this OpenCV')
+            else:
+                print(codec + ' ' + size + ': ' + '%.1f' % result['fps'] + ' frames/s, ' + '%.1f' % result['mb'] +
+                      ' MB, largest error ' + str(result['max_error']))
+
+    return results
+
+def peakrss():
+    """Function to find the peak memory (resident set size) of this process, in MB
+    --Returns None where unavailable (Windows)"""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1024 ** 2  # bytes
+    return rss / 1024  # kilobytes
+
+def runoperation(op, video, folder, output_folder, w, h, n):
+    """Function run in a fresh process, times one operation and measures peak memory"""
+
+    os.makedirs(output_folder, exist_ok=True)
+    start = time.perf_counter()
+    OPERATIONS[op](video, folder, output_folder, w, h, n)
+    seconds = time.perf_counter() - start
+
+    return seconds, peakrss()
+
+def benchmark(resolutions=resolutions, frame_counts=frame_counts, operations=None):
+    """Function to run each operation on each synthetic file
+    --Returns a dictionary of results by "operation widthxheight nframes" """
+
+    if operations is None:
+        operations = list(OPERATIONS)
+
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='iclots_benchmark_')
+    try:
+        for w, h in resolutions:
+            for n in frame_counts:
+                size = str(w) + 'x' + str(h) + ' ' + str(n) + 'f'
+                video = os.path.join(work_dir, size + '.avi')
+                folder = os.path.join(work_dir, size + ' images')
+                makevideo(video, w, h, n)
+                makeimages(folder, w, h, n)
+
+                for op in operations:
+                    # A new process for each operation, so peak memory belongs to that operation only
+                    output_folder = os.path.join(work_dir, size + ' ' + op)
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                        seconds, rss = executor.submit(runoperation, op, video, folder, output_folder,
+                                                       w, h, n).result()
+                    shutil.rmtree(output_folder, ignore_errors=True)
+
+                    results[op + ' ' + size] = {
+                        'seconds': seconds,
+                        'fps': n / seconds,
+                        'mb_s': n * w * h * 3 / seconds / 1024 ** 2,
+                        'peak_rss_mb': rss,
+                    }
+                    print(op + ' ' + size + ': ' + '%.1f' % (n / seconds) + ' frames/s')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+def compare(results, baseline, threshold=threshold):
+    """Function to find results slower, or using more memory, than the baseline by more than threshold
+    --Returns a list of strings describing each regression"""
+
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if result['fps'] < base['fps'] * (1 - threshold):
+            regressions.append(key + ': ' + '%.1f' % result['fps'] + ' frames/s, baseline ' +
+                               '%.1f' % base['fps'])
+        if result['peak_rss_mb'] is not None and base['peak_rss_mb'] is not None and \
+                result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append(key + ': ' + '%.0f' % result['peak_rss_mb'] + ' MB peak memory, baseline ' +
+                               '%.0f' % base['peak_rss_mb'])
+
+    return regressions
+
+
+if __name__ == '__main__':
+    results = benchmark(resolutions, frame_counts, operations)
+
+    # Save results with the versions tested
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'results': results,
+    }
+    if codecs is not None:
+        report['codecs'] = comparecodecs(resolutions, codecs, codec_frames)
+    with open(results_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    # Compare to baseline
+    if baseline_file is not None and os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions relative to ' + baseline_file)
@@ -5,12 +5,18 @@ Last updated: 2022-06-30
 This script corresponds to tools available in version 1.0b1, more recent implementations of tools
 may be available within the iCLOTS software and in source code at github.com/iCLOTS
 
-Script function that crops images (.jpg, .png, .tif) or videos (.avi) to a chosen region of interest (ROI)
+Script function that crops images (.jpg, .png, .tif, .npy) or videos (.avi) to a chosen region of interest (ROI)
 --This script designed to crop each file to a different ROI, could edit to crop each file to a consistent ROI
 
 Input variables
---None, a window of your image or first video frame from which you can choose your ROI with a draggable rectangle from
----will open automatically
+--roi_mode: how the ROI of each file is found
+----'choose': a window of your image or first video frame from which you can choose your ROI with a draggable
+-----rectangle from will open automatically
+----'first': choose an ROI from the first file only, the same ROI is applied to all files
+----'auto': the ROI is set to the bounds of the microfluidic channels, found without opening a window
+--use_sidecar: True saves the ROI of each file next to it, and uses a saved ROI instead of choosing again
+--auto_bright: True if channels are brighter than the background, False if darker ('auto' only)
+--auto_samples: number of frames sampled from each video to find channel bounds ('auto' only)
 
 Output files
 --All images or videos cropped to an ROI, provided within a "ROI" folder within the original directory
@@ -23,35 +29,44 @@ Some tips from the iCLOTS team:
 ---be mistaken for cells
 ----In all applications except for deformability and microchannel analysis, try to crop images to the channels only
 --The same ROI will be applied to all frames within an individual video
+--Saved ROIs are .json files named like the file they belong to, e.g. "video.avi.roi.json" for "video.avi"
+----Edit or delete a saved ROI to change it, files with a saved ROI never open a window
+--'auto' finds the first and last rows and columns that are brighter (or darker) than the background
+----Rows or columns with no clear difference in brightness are not cropped
+----Check a few outputs, debris or uneven illumination can move the bounds found
 
 """
 
 # Import
 import cv2
-from tkinter import filedialog
 import os
 import glob
+import json
 import datetime
+import functools
 import numpy as np
 
-# Select directory of files
-dirpath = filedialog.askdirectory()
+import crop_video
+import frame_cache
+import image_io
+import instrument
+import tiff_stack
+import video_writer
 
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-output_folder = os.path.join(dirpath, 'ROI, ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
+# IMPORTANT: PARAMETERS TO EDIT
+# How the ROI of each file is found
+roi_mode = 'choose'  # ('choose': window for each file, 'first': window for first file only, 'auto': no window)
+# Save and reuse the ROI of each file
+use_sidecar = True
+# Automatic channel detection
+auto_bright = True  # (True: channels brighter than background, False: channels darker than background)
+auto_samples = 5  # Frames sampled from each video
 
-# Create a list of all image files
-imglist_png = sorted(glob.glob(dirpath + "/*.png"))
-imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
-imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
-imglist = imglist_png + imglist_jpg + imglist_tif
+# Fraction of the range of a profile rows or columns must exceed to be part of a channel
+auto_threshold = 0.5
+# Smallest difference in pixel value between channel and background rows or columns
+auto_contrast = 10
 
-# Create a list of all video files
-videolist = glob.glob(dirpath + '/*.avi')  # .avi
-# videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
 
 def chooseROI(frame):
     """Function to resize a frame - can be an image file or a video frame"""
@@ -68,43 +83,206 @@ def chooseROI(frame):
 
     return ROI_x, ROI_y, ROI_w, ROI_h
 
-# Resize all images, save
-for img in imglist:
+def roiframe(frame, ROI_x, ROI_y, ROI_w, ROI_h):
+    """Function to crop a frame to a chosen ROI - can be an image file or a video frame"""
 
-    frame = cv2.imread(img)
-    ROI_x, ROI_y, ROI_w, ROI_h = chooseROI(frame) # Find ROI by applying function
+    out_frame = frame[ROI_y: (ROI_y + ROI_h), ROI_x: (ROI_x + ROI_w)]  # Crop, a view of frame, nothing is copied
 
-    out_frame = frame[ROI_y: (ROI_y + ROI_h), ROI_x: (ROI_x + ROI_w)]  # Crop
-    name = os.path.basename(img).split(".")[0] + '_ROI.png'  # String to save image as
-    cv2.imwrite(name, out_frame)
+    return out_frame
 
-# Resize all videos, save
-for video in videolist:
-    capture = cv2.VideoCapture(video)
-    # Dimensions, must be exact for videos
-    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+def sidecarname(path):
+    """Function to find the name of the file the ROI of path is saved in"""
 
-    name = os.path.basename(video).split(".")[0] + '_ROI.avi'  # String to save image as, .avi
-    # name = os.path.basename(video).split(".")[0] + '_ROI.mp4'  # String to save image as, .mp4
+    return path + '.roi.json'
 
-    ret, frame_0 = capture.read()
-    ROI_x, ROI_y, ROI_w, ROI_h = chooseROI(frame_0) # Find ROI by applying function
+def loadroi(path):
+    """Function to load the ROI saved for path, None if there is none"""
 
-    # Set up video writer object
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
-    # fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
-    out = cv2.VideoWriter(name, fourcc, fps, (ROI_w, ROI_h))
+    sidecar = sidecarname(path)
+    if not os.path.exists(sidecar):
+        return None
+    with open(sidecar) as f:
+        roi = json.load(f)
 
-    # Resize each frame
-    while True:
+    return roi['ROI_x'], roi['ROI_y'], roi['ROI_w'], roi['ROI_h']
+
+def saveroi(path, ROI_x, ROI_y, ROI_w, ROI_h):
+    """Function to save the ROI of path next to it"""
+
+    with open(sidecarname(path), 'w') as f:
+        json.dump({'ROI_x': ROI_x, 'ROI_y': ROI_y, 'ROI_w': ROI_w, 'ROI_h': ROI_h}, f, indent=2)
+
+def sampleframes(video, n):
+    """Function to read n frames evenly spaced through a video"""
+
+    capture = frame_cache.VideoCapture(video)
+    length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for frame_n in np.unique(np.linspace(0, max(length - 1, 0), n).astype(int)):
+        if not crop_video.seekframe(capture, frame_n):
+            break
         ret, frame = capture.read()
-        if ret == True:
-            out_frame = frame[ROI_y: (ROI_y + ROI_h), ROI_x: (ROI_x + ROI_w)]  # Crop
-            out.write(out_frame)
-        else:
+        if ret == False:
             break
-
-    # Finish
+        frames.append(frame.copy())
     capture.release()
-    out.release()
-    cv2.destroyAllWindows()
+
+    return frames
+
+def profilebounds(profile, bright=auto_bright):
+    """Function to find the first and last position of a row or column intensity profile within channels
+    --Returns the full range if the profile has too little contrast to tell channels from background"""
+
+    # Smooth out noise and single cells
+    profile = np.convolve(np.pad(profile, 2, mode='edge'), np.ones(5) / 5, mode='valid')
+    low = profile.min()
+    high = profile.max()
+    if high - low < auto_contrast:
+        return 0, len(profile)
+
+    scaled = (profile - low) / (high - low)
+    if not bright:
+        scaled = 1 - scaled
+    inside = np.flatnonzero(scaled >= auto_threshold)
+
+    return int(inside[0]), int(inside[-1]) + 1
+
+def detectchannel(frames, bright=auto_bright):
+    """Function to find the ROI containing all microfluidic channels from row and column intensity profiles
+    --frames: one image or a few frames sampled from a video, averaged to remove moving cells"""
+
+    mean = np.zeros(frames[0].shape[:2])
+    for frame in frames:
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        mean += frame
+    mean /= len(frames)
+    if frames[0].dtype == np.uint16:
+        mean /= 257  # Same intensity scale as 8-bit frames, auto_contrast is given for 8-bit frames
+
+    # Median of each row and column, cells cover too little of a row or column to change it
+    ROI_y, y_end = profilebounds(np.median(mean, axis=1), bright)
+    ROI_x, x_end = profilebounds(np.median(mean, axis=0), bright)
+
+    return ROI_x, ROI_y, x_end - ROI_x, y_end - ROI_y
+
+def fileroi(path, frame=None, roi_mode=roi_mode, use_sidecar=use_sidecar):
+    """Function to find the ROI of an image or video: loaded from its sidecar file, detected, or chosen in a window
+    --frame: the image itself, None for videos"""
+
+    if use_sidecar:
+        roi = loadroi(path)
+        if roi is not None:
+            return roi
+
+    if frame is None:
+        frames = sampleframes(path, auto_samples if roi_mode == 'auto' else 1)
+    else:
+        frames = [frame]
+    if roi_mode == 'auto':
+        roi = detectchannel(frames)
+    else:
+        roi = chooseROI(frames[0])
+
+    if use_sidecar:
+        saveroi(path, *roi)
+
+    return roi
+
+def run(dirpath, roi=None, roi_mode=roi_mode, use_sidecar=use_sidecar, imglist=None, videolist=None):
+    """Function to crop all images and videos to an ROI, saved in a new "ROI" folder within dirpath
+    --roi: (ROI_x, ROI_y, ROI_w, ROI_h) applied to all files, None finds an ROI for each file as set by roi_mode
+    --imglist, videolist: files to crop, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    output_folder = os.path.join(dirpath, 'ROI, ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    # Time each file if instrument.py is enabled, time spent choosing an ROI is included
+    report = instrument.RunReport(output_folder, 'roi', {'roi': roi, 'roi_mode': roi_mode})
+
+    # Resize all images, save
+    # Images are read ahead and saved in the background while an ROI is chosen, see image_io.py
+    timers = {img: report.file(img) for img in imglist}
+    with image_io.ImageWriter() as writer:
+        for img, frame in image_io.readimages(imglist, timer=timers):
+            timer = timers[img]
+
+            if roi is None:
+                ROI_x, ROI_y, ROI_w, ROI_h = fileroi(img, frame, roi_mode, use_sidecar)  # Find ROI
+                if roi_mode == 'first':
+                    roi = ROI_x, ROI_y, ROI_w, ROI_h
+            else:
+                ROI_x, ROI_y, ROI_w, ROI_h = roi
+
+            out_frame = roiframe(frame, ROI_x, ROI_y, ROI_w, ROI_h)  # Crop
+            name = os.path.basename(img).split(".")[0] + '_ROI.png'  # String to save image as
+            writer.write(os.path.join(output_folder, name), out_frame, timer=timer,
+                         callback=functools.partial(report.done, timer, name, frames=1))
+
+    # Resize all videos, save
+    for video in videolist:
+        timer = report.file(video)
+        if roi is None:
+            ROI_x, ROI_y, ROI_w, ROI_h = fileroi(video, None, roi_mode, use_sidecar)  # Find ROI by applying function
+            if roi_mode == 'first':
+                roi = ROI_x, ROI_y, ROI_w, ROI_h
+        else:
+            ROI_x, ROI_y, ROI_w, ROI_h = roi
+
+        capture = instrument.wrapcapture(timer, frame_cache.VideoCapture(video))
+        # Dimensions, must be exact for videos
+        fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+        # String to save video as, .avi (or .tif, see video_writer.py)
+        name = os.path.basename(video).split(".")[0] + '_ROI' + video_writer.videoextension()
+        # name = os.path.basename(video).split(".")[0] + '_ROI.mp4'  # String to save image as, .mp4
+
+        # Set up video writer object
+        out = instrument.wrapwriter(timer, video_writer.VideoWriter(os.path.join(output_folder, name), fps,
+                                                                    (ROI_w, ROI_h), is_color=image_io.iscolor(capture)))
+
+        # Resize each frame
+        while True:
+            ret, frame = capture.read()
+            if ret == True:
+                out_frame = roiframe(frame, ROI_x, ROI_y, ROI_w, ROI_h)  # Crop
+                out.write(np.ascontiguousarray(out_frame))  # Only copied here, as the encoder needs it
+            else:
+                break
+
+        # Finish
+        capture.release()
+        out.release()
+        report.done(timer, name)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
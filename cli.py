@@ -0,0 +1,269 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that runs any operation in this repository from the command line, without a file dialog window
+--Useful on computers without a display (e.g. cluster nodes) and to launch many short jobs
+--Only the script of the chosen operation is imported, tkinter is never imported
+
+Input variables
+--operation: rotate, resize, contrast, roi, crop, drop_static, normalize, background, pipeline, batch, queue,
+imgseq_to_video or video_to_imgseq
+--inputs: files, directories and/or glob patterns, e.g. "data/*.avi"
+----queue takes a single directory, its subfolders are included and --output is not used, see work_queue.py
+----Directories include all .png, .jpg, .tif, .npy, .avi and .mp4 files within them
+----Multi-page .tif files (stacks) are processed as videos, except by imgseq_to_video, see tiff_stack.py
+--Parameters of each operation, see "python cli.py <operation> --help"
+----Parameters not given use the values at the top of each script
+--output: directory the new output folder is created in, the directory of the first input if not given
+--timing: measure time spent in each stage and save a report, see instrument.py
+--cache: read videos through the frame cache, see frame_cache.py
+--codec: codec videos are saved with, 'tiff' saves .tif stacks, see video_writer.py
+--color_mode: 'preserve' keeps grayscale and 16-bit images and grayscale videos as they are, see image_io.py
+--tile_mode: 'always' processes every image in tiles, 'off' none, see tiles.py
+
+Output files
+--The same outputs as the script of each operation, within a new folder inside the output directory
+----The path of the new folder is printed
+
+Some tips from the iCLOTS team:
+--e.g. python cli.py rotate --angle 2 "experiment 1/*.avi" --output results
+--Quote glob patterns so they are expanded the same way on every operating system
+--Stages for pipeline and batch are given as JSON, e.g. '[["rotate", {"angle": 2}], ["resize", {"r_f": 0.5}]]'
+----A path to a .json file containing the same list can be given instead
+--The exit status is non-zero if any file failed, useful for job schedulers
+--To share a directory between computers, run the same queue command on each, e.g. as one job per cluster node
+
+"""
+
+# Import
+import os
+import sys
+import glob
+import json
+import argparse
+import importlib
+
+# File types each operation accepts
+image_extensions = ('.png', '.jpg', '.tif', '.npy')
+video_extensions = ('.avi', '.mp4')
+
+
+def expandinputs(inputs):
+    """Function to expand files, directories and glob patterns into sorted lists of images and videos"""
+
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, f) for f in os.listdir(pattern))
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError('No files match ' + pattern)
+        paths += [p for p in matches if os.path.isfile(p) and p not in paths]
+
+    imglist = [p for p in paths if p.lower().endswith(image_extensions)]
+    videolist = [p for p in paths if p.lower().endswith(video_extensions)]
+
+    return imglist, videolist
+
+def readstages(stages):
+    """Function to read pipeline stages from a JSON string or .json file as (operation, parameters) tuples"""
+
+    if os.path.isfile(stages):
+        with open(stages) as f:
+            stages = f.read()
+
+    return [(op, params) for op, params in json.loads(stages)]
+
+def parser():
+    """Function to build the command line parser, one subcommand per operation"""
+
+    main = argparse.ArgumentParser(description='Run iCLOTS video processing operations without a file dialog')
+    subparsers = main.add_subparsers(dest='operation', required=True)
+
+    def add(operation, help):
+        sub = subparsers.add_parser(operation, help=help)
+        sub.add_argument('inputs', nargs='+', help='files, directories and/or glob patterns')
+        sub.add_argument('--output', help='directory the output folder is created in')
+        sub.add_argument('--timing', action='store_true', help='save a timing report, see instrument.py')
+        sub.add_argument('--cache', action='store_true', help='read videos through frame_cache.py')
+        sub.add_argument('--codec', choices=['XVID', 'MJPG', 'FFV1', 'HFYU', 'raw', 'mp4v', 'tiff'],
+                         help='codec videos are saved with, see video_writer.py')
+        sub.add_argument('--color_mode', choices=['color', 'preserve'],
+                         help="'preserve' keeps grayscale and 16-bit data, see image_io.py")
+        sub.add_argument('--tile_mode', choices=['auto', 'always', 'off'],
+                         help='process very large images in tiles, see tiles.py')
+        return sub
+
+    # Parameters default to None, meaning the value at the top of the script is used
+    sub = add('rotate', 'rotate images and videos')
+    sub.add_argument('--angle', type=float)
+
+    sub = add('resize', 'resize images and videos')
+    sub.add_argument('--r_f', type=float)
+    sub.add_argument('--scales', type=float, nargs='+', help='save every resize factor from one read, e.g. 1 0.5 0.25')
+
+    sub = add('contrast', 'edit contrast of images and videos')
+    sub.add_argument('--alpha', type=float)
+    sub.add_argument('--beta', type=float)
+    sub.add_argument('--auto', choices=['file', 'batch'], help='choose alpha and beta from intensity percentiles')
+    sub.add_argument('--auto_percentiles', type=float, nargs=2, metavar=('LOW', 'HIGH'))
+
+    sub = add('roi', 'crop images and videos to a region of interest')
+    sub.add_argument('--roi', type=int, nargs=4, metavar=('X', 'Y', 'W', 'H'), help='same ROI for all files')
+    sub.add_argument('--roi_mode', choices=['choose', 'first', 'auto'], help="'auto' detects channels, no window")
+    sub.add_argument('--no_sidecar', dest='use_sidecar', action='store_false', default=None,
+                     help="don't save or reuse the ROI of each file")
+
+    sub = add('crop', 'shorten videos to a start and end frame')
+    sub.add_argument('--start_frame', type=int)
+    sub.add_argument('--end_frame', type=int)
+    sub.add_argument('--stream_copy', action='store_true', default=None)
+
+    sub = add('drop_static', 'drop frames where nothing moves from videos, with an index of frames kept')
+    sub.add_argument('--downsample', type=int)
+    sub.add_argument('--difference_threshold', type=float)
+    sub.add_argument('--min_changed', type=int)
+    sub.add_argument('--pad', type=int)
+    sub.add_argument('--keep_every', type=int)
+
+    sub = add('normalize', 'normalize images and videos to [0, 255]')
+    sub.add_argument('--mode', choices=['global', 'frame'])
+    sub.add_argument('--percentiles', type=float, nargs=2, metavar=('LOW', 'HIGH'))
+    sub.add_argument('--sample_stride', type=int)
+
+    sub = add('background', 'subtract a running background estimate from videos')
+    sub.add_argument('--method', choices=['mean', 'median'])
+    sub.add_argument('--learning_rate', type=float)
+    sub.add_argument('--median_step', type=int)
+    sub.add_argument('--polarity', choices=['absolute', 'brighter', 'darker'])
+
+    for operation, help in [('pipeline', 'apply several operations, in order'),
+                            ('batch', 'apply several operations, several files at once'),
+                            ('queue', 'apply several operations, files shared between computers')]:
+        sub = add(operation, help)
+        sub.add_argument('--stages', type=readstages, help='JSON list of [operation, parameters] or a .json file')
+        sub.add_argument('--start_frame', type=int)
+        sub.add_argument('--end_frame', type=int)
+        if operation != 'queue':  # Queues always resume, see work_queue.py
+            sub.add_argument('--resume', action='store_true', default=None,
+                             help='skip files already processed with the same stages, see manifest.py')
+        if operation != 'pipeline':
+            sub.add_argument('--workers', type=int)
+
+    sub = add('imgseq_to_video', 'convert a sequence of images to a single video')
+    sub.add_argument('--fps', type=float)
+    sub.add_argument('--mismatch', choices=['resize', 'reject'])
+
+    sub = add('video_to_imgseq', 'convert videos to sequences of images')
+    sub.add_argument('--image_format', choices=['png', 'tif', 'npy'])
+    sub.add_argument('--png_compression', type=int)
+    sub.add_argument('--start_frame', type=int)
+    sub.add_argument('--end_frame', type=int)
+    sub.add_argument('--frame_stride', type=int)
+    sub.add_argument('--workers', type=int)
+
+    return main
+
+# Script each operation is run by
+MODULES = {
+    'rotate': 'rotate',
+    'resize': 'resize',
+    'contrast': 'edit_contrast',
+    'roi': 'choose_roi',
+    'crop': 'crop_video',
+    'drop_static': 'drop_static',
+    'normalize': 'normalize_intrange',
+    'background': 'subtract_background',
+    'pipeline': 'pipeline',
+    'batch': 'batch',
+    'queue': 'work_queue',
+    'imgseq_to_video': 'imgseq_to_video',
+    'video_to_imgseq': 'video_to_imgseq',
+}
+
+def main(argv=None):
+    """Function to run the operation given on the command line, returns the exit status"""
+
+    command_parser = parser()
+    args = vars(command_parser.parse_args(argv))
+    operation = args.pop('operation')
+    inputs = args.pop('inputs')
+    if operation == 'queue':
+        # Files within the directory and its subfolders are listed by the computer creating the queue
+        if len(inputs) != 1 or not os.path.isdir(inputs[0]):
+            command_parser.error('queue takes a single directory')
+        imglist, videolist = None, None
+    else:
+        try:
+            imglist, videolist = expandinputs(inputs)
+        except FileNotFoundError as e:
+            command_parser.error(str(e))
+    output = args.pop('output')
+    timing = args.pop('timing')
+    cache = args.pop('cache')
+    codec = args.pop('codec')
+    color_mode = args.pop('color_mode')
+    tile_mode = args.pop('tile_mode')
+    params = {k: v for k, v in args.items() if v is not None}  # Parameters given
+    for key in ['percentiles', 'auto_percentiles']:
+        if key in params:
+            params[key] = tuple(params[key])
+    if 'roi' in params:
+        params['roi'] = tuple(params['roi'])
+
+    if operation == 'queue':
+        dirpath = inputs[0]  # Outputs are saved within the directory, every computer uses the same folder
+    else:
+        if operation != 'imgseq_to_video':
+            # Stacks are processed frame by frame, as videos, imgseq_to_video adds their pages to the sequence
+            import tiff_stack
+            imglist, stacklist = tiff_stack.splitstacks(imglist)
+            videolist += stacklist
+
+        if not imglist and not videolist:
+            command_parser.error('no .png, .jpg, .tif, .npy, .avi or .mp4 files found')
+        dirpath = output if output is not None else os.path.dirname(os.path.abspath((imglist + videolist)[0]))
+        os.makedirs(dirpath, exist_ok=True)
+
+    # Import only what this operation needs
+    import instrument
+    instrument.enabled = timing
+    if cache:
+        import frame_cache
+        frame_cache.use_cache = True
+    if codec is not None:
+        import video_writer
+        video_writer.codec = codec
+    if color_mode is not None:
+        import image_io
+        image_io.color_mode = color_mode
+    if tile_mode is not None:
+        import tiles
+        tiles.tile_mode = tile_mode
+    module = importlib.import_module(MODULES[operation])
+
+    if operation == 'video_to_imgseq':
+        for video in videolist:
+            print(module.run(video, output_dir=output, **params))
+    elif operation == 'imgseq_to_video':
+        print(module.run(dirpath, imglist=imglist, **params))
+    elif operation in ('crop', 'drop_static', 'background'):
+        print(module.run(dirpath, videolist=videolist, **params))
+    elif operation in ('batch', 'queue'):
+        output_folder, summary = module.run(dirpath, imglist=imglist, videolist=videolist, **params)
+        print(output_folder)
+        if not all(entry['success'] for entry in summary):
+            return 1
+    else:
+        print(module.run(dirpath, imglist=imglist, videolist=videolist, **params))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
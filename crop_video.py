@@ -11,6 +11,8 @@ Script function that crops videos (.avi) within a selected directory
 Input variables
 --start_frame: first frame you would like to retain
 --end_frame: last frame you would like to retain
+--stream_copy: True copies compressed frames directly into the new video instead of re-encoding them
+----Only used if start_frame is a keyframe, otherwise frames are re-encoded as usual
 
 Output files
 --All videos with frames cropped to same range
@@ -30,73 +32,202 @@ Some tips from the iCLOTS team:
 ----FPS = frames per second, a microscope acquisition setting
 --If end_frame is greater than n frames in the video, it will stop writing at the end of the video
 ----The strings labeling the directory and frame will be the original value you provided
+--Only frames within the range are read, cropping a short range from a long video is fast
+--Stream copy is fastest and adds no compression artifacts, but requires start_frame to be a keyframe
+----Keyframes are often every 12 frames or so, depending on the software that saved the video
+----keyframes(video) lists them, e.g. crop_video.keyframes('video.avi')
 
 """
 
 # Import
 import cv2
 import numpy as np
-from tkinter import filedialog
 import os
 import glob
 import datetime
 
+import frame_cache
+import image_io
+import instrument
+import tiff_stack
+import video_writer
+
 # IMPORTANT: PARAMETERS TO EDIT
 # First and last frame to be retained
 start_frame = 100
 end_frame = 300
+# Copy compressed frames without re-encoding when possible (see tips)
+stream_copy = False
 
-# Select directory of files
-dirpath = filedialog.askdirectory()
 
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-# Create strings to indicate operations performed
-str_start = str(start_frame)
-str_end = str(end_frame)
-output_folder = os.path.join(dirpath, 'Cropped i' + str_start + ', f' + \
-                str_end + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
+def seekframe(capture, frame_n):
+    """Function to position a capture so the next frame read is frame number frame_n
+    --Seeking jumps to the nearest keyframe and decodes forward to the exact frame
+    --Falls back to reading forward from the current position if the backend can't seek"""
 
+    if frame_n <= 0:
+        return True
 
-# Create a list of all video files
-videolist = glob.glob(dirpath + '/*.avi')  # Script only applies to video files, .avi
-# videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, frame_n)
+    pos = int(capture.get(cv2.CAP_PROP_POS_FRAMES))
+    if pos > frame_n:  # Landed past the frame, start over from the beginning
+        capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        pos = int(capture.get(cv2.CAP_PROP_POS_FRAMES))
 
+    # Decode forward to the exact frame
+    while pos < frame_n:
+        if capture.grab() == False:
+            return False
+        pos += 1
 
-# Crop all videos, save
-for video in videolist:
-    capture = cv2.VideoCapture(video)
+    return True
 
-    # Dimensions, must be exact for videos
-    w = int(np.floor(capture.get(3))) # float
-    h = int(np.floor(capture.get(4))) # float
-    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+def keyframes(video):
+    """Function to list the frame numbers of the keyframes of a video, stream copy can start at any of them
+    --Only compressed packets are read, nothing is decoded
+    --Returns an empty list if OpenCV can't read compressed packets"""
 
-    name = os.path.basename(video).split(".")[0] + '_i' + str_start + '_f' + \
-           str_end + '.avi'  # String to save image as, .avi
-    # name = os.path.basename(video).split(".")[0] + '_i' + str_start + '_f' + \
-    #        str_end + '.mp4'  # String to save image as, .mp4
-
-    # Set up video writer object
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
-    # fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
-    out = cv2.VideoWriter(name, fourcc, fps, (w, h))
-
-    # Only write frames within range
+    capture = cv2.VideoCapture(video, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])  # Compressed packets
+    found = []
     count = 0  # Count gives frame number
-    while True:
-        ret, frame = capture.read()
-        if ret == True:
-            if (count > start_frame) and (count < end_frame):
-                out.write(frame)
-        else:
+    while capture.isOpened():
+        ret, packet = capture.read()
+        if ret == False:
             break
+        if capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            found.append(count)
+        count += 1
+    capture.release()
+
+    return found
+
+def streamcopy(video, name, start_frame, end_frame, timer=None):
+    """Function to copy frames [start_frame, end_frame] of a video without decoding or re-encoding
+    --Only possible if start_frame is a keyframe, returns None without writing anything otherwise
+    --Returns the number of frames written"""
+
+    capture = cv2.VideoCapture(video, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])  # Compressed packets
+    if not capture.isOpened():
+        return None
+    capture = instrument.wrapcapture(timer, capture)
+
+    # Seeking compressed packets lands on a keyframe at or before start_frame
+    # Position is checked before reading, some backends don't advance it after reading a packet
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    pos = int(capture.get(cv2.CAP_PROP_POS_FRAMES))
+    ret, packet = capture.read()
+    if ret == False or pos != start_frame or not capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+        capture.release()
+        return None
+
+    # Set up video writer object with the original codec
+    w = int(np.floor(capture.get(3)))  # float
+    h = int(np.floor(capture.get(4)))  # float
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+    fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+    out = cv2.VideoWriter(name, cv2.CAP_FFMPEG, fourcc, fps, (w, h), [cv2.VIDEOWRITER_PROP_RAW_VIDEO, 1])
+    if not out.isOpened():
+        capture.release()
+        return None
+    out = instrument.wrapwriter(timer, out)
+
+    count = start_frame
+    while ret == True and count <= end_frame:
+        out.write(packet)
         count += 1
+        ret, packet = capture.read()
+
+    # Finish
+    capture.release()
+    out.release()
+
+    return count - start_frame
+
+def cropvideo(video, name, start_frame, end_frame, stream_copy=False, timer=None):
+    """Function to save frames [start_frame, end_frame] of a video as name
+    --Seeks to start_frame and stops reading at end_frame, time depends on the range, not the video
+    --timer: optional instrument.FileTimer, time spent reading and writing is added to it
+    --Returns the number of frames written"""
+
+    # Stacks have no compressed frames to copy, see tiff_stack.py
+    stack = video.lower().endswith(tiff_stack.stack_extensions) or name.lower().endswith(tiff_stack.stack_extensions)
+    if stream_copy and not stack:
+        written = streamcopy(video, name, start_frame, end_frame, timer)
+        if written is not None:
+            return written
 
+    capture = instrument.wrapcapture(timer, frame_cache.VideoCapture(video))
+
+    # Dimensions, must be exact for videos
+    w = int(np.floor(capture.get(3)))  # float
+    h = int(np.floor(capture.get(4)))  # float
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+    # Set up video writer object
+    out = instrument.wrapwriter(timer, video_writer.VideoWriter(name, fps, (w, h),
+                                                                 is_color=image_io.iscolor(capture)))
+
+    # Only read and write frames within range
+    count = start_frame  # Count gives frame number
+    if seekframe(capture, start_frame):
+        while count <= end_frame:
+            ret, frame = capture.read()
+            if ret == True:
+                out.write(frame)
+            else:
+                break
+            count += 1
 
     # Finish
     capture.release()
     out.release()
-    cv2.destroyAllWindows()
+
+    return count - start_frame
+
+def run(dirpath, start_frame=start_frame, end_frame=end_frame, stream_copy=stream_copy, videolist=None):
+    """Function to crop all videos, saved in a new "Cropped" folder within dirpath
+    --videolist: videos to crop, all .avi files within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create strings to indicate operations performed
+    str_start = str(start_frame)
+    str_end = str(end_frame)
+    output_folder = os.path.join(dirpath, 'Cropped i' + str_start + ', f' + \
+                    str_end + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # Script only applies to video files, .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+        # Multi-page .tif files (stacks) are cropped as videos, see tiff_stack.py
+        videolist += tiff_stack.splitstacks(sorted(glob.glob(dirpath + '/*.tif')))[1]
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'crop_video', {'start_frame': start_frame, 'end_frame': end_frame,
+                                                                'stream_copy': stream_copy})
+
+    # Crop all videos, save
+    for video in videolist:
+        name = os.path.basename(video).split(".")[0] + '_i' + str_start + '_f' + \
+               str_end + video_writer.videoextension()  # String to save image as, .avi
+        # name = os.path.basename(video).split(".")[0] + '_i' + str_start + '_f' + \
+        #        str_end + '.mp4'  # String to save image as, .mp4
+
+        timer = report.file(video)
+        cropvideo(video, os.path.join(output_folder, name), start_frame, end_frame, stream_copy, timer)
+        report.done(timer, name)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
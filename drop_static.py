@@ -0,0 +1,202 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that removes frames where nothing moves from videos (.avi) within a selected directory
+--Each frame is compared to the last frame kept, frames with too few changed pixels are dropped
+--Frames are compared at reduced resolution, in grayscale, measuring motion costs little compared to decoding
+--No other changes are made to the frames kept
+
+Input variables
+--downsample: frames are shrunk by this factor before being compared, reducing noise and work
+--difference_threshold: change in intensity (8-bit values) for a pixel of the shrunk frame to count as changed
+--min_changed: number of changed pixels needed for a frame to count as moving
+--pad: number of frames kept before and after each moving frame, so cells are seen entering and leaving
+--keep_every: a static frame is still kept every keep_every frames, None drops every static frame
+----e.g. 30 keeps one frame per second of a 30 fps video through long static periods
+
+Output files
+--All videos with static frames removed, provided within a "Static dropped" folder within the original directory
+----Videos default to .avi save, but option for .mp4 is contained in commented code
+----iCLOTS analyzes only .avi files
+--A .csv index next to each video, with the same name followed by ".frames.csv"
+----One row per frame kept: frame number in the new video, frame number in the original video, time in seconds
+----Time is frame number / frames per second of the original video, the new video keeps the same frame rate
+
+Some tips from the iCLOTS team:
+--Most useful for recordings of rare events, e.g. occasional cells passing through a channel
+----Long periods with no cells shrink to a few frames, analysis of the new video is much quicker
+--Analyses measuring time (e.g. velocity) must use the times in the index, not the frame rate
+----Consecutive frames in the new video may be far apart in the original video
+--Increase difference_threshold if noise or flicker keeps static frames, decrease it if faint cells are dropped
+----For 16-bit frames from 12-bit cameras, values use only 1/16 of the range, e.g. try a threshold below 1
+----Frames are compared to the last frame kept, slow changes (e.g. drifting focus) still add a frame now and then
+--Check the number of frames kept, printed for each video, on a few videos before processing many
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import csv
+import glob
+import datetime
+import collections
+
+import frame_cache
+import image_io
+import instrument
+import tiff_stack
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Factor frames are shrunk by before being compared
+downsample = 4
+# Change in intensity for a pixel to count as changed, and changed pixels for a frame to count as moving
+difference_threshold = 12
+min_changed = 2
+# Frames kept before and after each moving frame
+pad = 2
+# Static frames kept, at most this many frames apart
+keep_every = None  # (None: drop every static frame)
+
+
+def motionframe(frame, downsample=downsample):
+    """Function to shrink a frame to the grayscale image motion is measured on
+    --16-bit frames are scaled to 8-bit values without rounding, small differences still count"""
+
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if frame.dtype == np.uint16:
+        frame = frame.astype(np.float32) / 257
+    h, w = frame.shape[:2]
+
+    return cv2.resize(frame, (max(w // downsample, 1), max(h // downsample, 1)), interpolation=cv2.INTER_AREA)
+
+def changedpixels(small, reference, difference_threshold=difference_threshold):
+    """Function to count the pixels of two shrunk frames that differ by more than difference_threshold"""
+
+    difference = cv2.absdiff(small, reference)
+
+    return cv2.countNonZero(cv2.threshold(difference, difference_threshold, 255, cv2.THRESH_BINARY)[1])
+
+def dropstatic(video, name, downsample=downsample, difference_threshold=difference_threshold,
+               min_changed=min_changed, pad=pad, keep_every=keep_every, timer=None):
+    """Function to save the moving frames of a video as name, and their original frame numbers and times
+    --Only the last pad frames dropped are held, in case motion starts, memory use doesn't depend on video length
+    --timer: optional instrument.FileTimer, time spent reading, comparing and writing is added to it
+    --Returns the number of frames kept and the number of frames in the original video"""
+
+    capture = instrument.wrapcapture(timer, frame_cache.VideoCapture(video))
+    if not capture.isOpened():
+        raise IOError('Could not open video ' + video)
+
+    # Dimensions, must be exact for videos
+    w = int(np.floor(capture.get(3)))  # float
+    h = int(np.floor(capture.get(4)))  # float
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+    # Set up video writer object
+    out = instrument.wrapwriter(timer, video_writer.VideoWriter(name, fps, (w, h),
+                                                                 is_color=image_io.iscolor(capture)))
+
+    with open(name + '.frames.csv', 'w', newline='') as f:
+        index = csv.writer(f)
+        index.writerow(['output_frame', 'original_frame', 'time_s'])
+        kept = [0]
+
+        def keep(n, frame):
+            out.write(frame)
+            index.writerow([kept[0], n, round(n / fps, 6) if fps > 0 else ''])
+            kept[0] += 1
+
+        reference = None  # Shrunk copy of the last frame kept
+        last_kept = None
+        dropped = collections.deque(maxlen=pad)  # Last frames dropped, kept if motion starts
+        after = 0  # Frames still kept after the last moving frame
+        count = 0  # Count gives frame number
+        while True:
+            ret, frame = capture.read()
+            if ret == False:
+                break
+
+            small = instrument.timed(timer, 'transform', motionframe, frame, downsample)
+            moving = reference is None or instrument.timed(timer, 'transform', changedpixels, small, reference,
+                                                           difference_threshold) >= min_changed
+            if moving:
+                while dropped:
+                    keep(*dropped.popleft())  # Frames just before motion
+                after = pad
+            elif after > 0:
+                after -= 1
+            elif keep_every is None or count - last_kept < keep_every:
+                dropped.append((count, frame))
+                count += 1
+                continue
+
+            keep(count, frame)
+            reference = small
+            last_kept = count
+            dropped.clear()
+            count += 1
+
+    # Finish
+    capture.release()
+    out.release()
+
+    return kept[0], count
+
+def run(dirpath, downsample=downsample, difference_threshold=difference_threshold, min_changed=min_changed, pad=pad,
+        keep_every=keep_every, videolist=None):
+    """Function to drop static frames from all videos, saved in a new "Static dropped" folder within dirpath
+    --videolist: videos to process, all .avi files and stacks within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create a string to indicate operations performed
+    str_gate = 'd' + str(difference_threshold).replace('.', 'p') + '_c' + str(min_changed)
+    output_folder = os.path.join(dirpath, 'Static dropped ' + str_gate.replace('_', ' ') + ', ' + \
+                    now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # Script only applies to video files, .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+        # Multi-page .tif files (stacks) are processed as videos, see tiff_stack.py
+        videolist += tiff_stack.splitstacks(sorted(glob.glob(dirpath + '/*.tif')))[1]
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'drop_static', {'downsample': downsample,
+                                                                 'difference_threshold': difference_threshold,
+                                                                 'min_changed': min_changed, 'pad': pad,
+                                                                 'keep_every': keep_every})
+
+    # Drop static frames from all videos, save
+    for video in videolist:
+        # String to save video as, .avi (or .tif, see video_writer.py)
+        name = os.path.basename(video).split(".")[0] + '_moving_' + str_gate + video_writer.videoextension()
+        # name = os.path.basename(video).split(".")[0] + '_moving_' + str_gate + '.mp4'  # .mp4
+
+        timer = report.file(video)
+        kept, total = dropstatic(video, os.path.join(output_folder, name), downsample, difference_threshold,
+                                 min_changed, pad, keep_every, timer)
+        print(os.path.basename(video) + ': ' + str(kept) + ' of ' + str(total) + ' frames kept')
+        report.done(timer, [name, name + '.frames.csv'])
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
@@ -19,6 +19,10 @@ Input variables
 ----Oftentimes called bias
 ---- <1 decreases overall brightness of image, >1 increases overall brightness of image
 ----Final pixel intensity values <0 will be saved as black (value 0)
+--auto: choose alpha and beta automatically instead, from the intensities of each file or of all files
+----None: use alpha and beta above
+----'file': each file gets its own alpha, beta, 'batch': one alpha, beta pair computed from all files
+--auto_percentiles: lower and upper intensity percentile stretched to black and white in auto mode
 
 Output files
 --All images or videos with contrast edited
@@ -26,12 +30,20 @@ Output files
 ----iCLOTS analyzes only .avi files
 ----.mp4 is better suited for viewing on Mac OS
 --Provided within a "Contrast" folder within the original directory
+----In auto mode, the alpha and beta chosen for each file are part of its name
 
 Some tips from the iCLOTS team:
 --Editing contrast can be useful in applications detecting movement
 ----Features of interest, like a cell, are more easily distinguished from background, like channels
 --Take care interpreting pixel intensity values after editing contrast
 ----Editing contrast may lead to bias in fluoresence-based results
+--Auto mode replaces trial and error with a percentile stretch, e.g. auto_percentiles (1, 99)
+----Videos are measured from a random sample of frames, see frame_stats.py
+----'batch' keeps intensities comparable between files, all files must have the same bit depth and color
+--Contrast is applied with a lookup table computed once per alpha, beta pair
+----8-bit and 16-bit frames are supported
+--Very large images (e.g. stitched tile scans) are processed in tiles, memory use doesn't depend on image size
+----See tiles.py, .npy images are read from disk one tile at a time
 --See OpenCV tutorial on editing contrast for more information:
 ----https://docs.opencv.org/3.4/d3/dc1/tutorial_basic_linear_transform.html
 
@@ -40,93 +52,209 @@ Some tips from the iCLOTS team:
 # Import
 import cv2
 import numpy as np
-from tkinter import filedialog
 import os
 import glob
 import datetime
+import functools
+
+import frame_cache
+import frame_engine
+import frame_stats
+import image_io
+import instrument
+import tiff_stack
+import tiles
+import video_writer
 
 # IMPORTANT: PARAMETERS TO EDIT
 # Multiplication and addition
 alpha = 1  # (<1 decrease contrast, >1 increase contrast)
 beta = 0  # (<0 darken image, >0 brighten image)
+# Choose alpha and beta automatically from intensity percentiles, see frame_stats.py
+auto = None  # (None: alpha and beta above, 'file': each file, 'batch': one pair for all files)
+auto_percentiles = (1, 99)
+
+# Lookup tables kept for reuse, least recently used tables are dropped beyond this many
+max_luts = 8
+
+
+def contrastlut(alpha, beta, dtype=np.uint8):
+    """Function to compute the intensity lookup table for a pair of alpha, beta values
+    --One entry per possible intensity: 256 for 8-bit frames, 65536 for 16-bit frames
+    --Computed once per alpha, beta and bit depth, then reused for every frame"""
+
+    return _contrastlut(alpha, beta, np.dtype(dtype).str)
+
+@functools.lru_cache(maxsize=max_luts)
+def _contrastlut(alpha, beta, dtype):
+    """Function to compute a lookup table, the last max_luts tables are kept, e.g. auto = 'file' adds one per file"""
+
+    dtype = np.dtype(dtype)
+    max_value = np.iinfo(dtype).max
+    lut = np.arange(max_value + 1) * alpha + beta
+    lut[lut < 0] = 0
+    lut[lut > max_value] = max_value  # Prevents high values from 'looping' to 0
+    lut = lut.astype(dtype)  # Prevents video errors
+    lut.flags.writeable = False  # Shared by every frame using it
+
+    return lut
+
+def editcontrast(frame, w, h, alpha=alpha, beta=beta, inplace=False):
+    """Function to edit contrast of a frame - can be an image file or a video frame
+    --alpha and beta default to the parameters above, pipelines may pass their own
+    --inplace: write the result into frame rather than a new array
+    --8-bit and 16-bit frames are supported"""
 
-# Select directory of files
-dirpath = filedialog.askdirectory()
-
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-# Create strings to indicate operations performed
-str_alpha = str(alpha).replace('.', 'p').replace('-', 'n')
-str_beta = str(beta).replace('.', 'p').replace('-', 'n')
-output_folder = os.path.join(dirpath, 'Contrast a' + str_alpha + ', b' + \
-                str_beta + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
-
-# Create a list of all image files
-imglist_png = sorted(glob.glob(dirpath + "/*.png"))
-imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
-imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
-imglist = imglist_png + imglist_jpg + imglist_tif
-
-# Create a list of all video files
-videolist = glob.glob(dirpath + '/*.avi')  # .avi
-# videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
-
-def editcontrast(frame, w, h):
-    """Function to edit contrast of a frame - can be an image file or a video frame"""
-
-    # Apply changes in contrast
-    out_frame = frame * alpha + beta
-    out_frame[out_frame < 0] = 0
-    out_frame[out_frame > 255] = 255  # Prevents high values from 'looping' to 0 as uint8
-    out_frame = np.uint8(out_frame)  # Prevents video errors
+    # Apply changes in contrast with a lookup table, one lookup per pixel instead of float arithmetic
+    lut = contrastlut(alpha, beta, frame.dtype)
+    dst = frame if inplace else None
+    if frame.dtype == np.uint8:
+        out_frame = cv2.LUT(frame, lut, dst=dst)
+    else:
+        out_frame = np.take(lut, frame, out=dst)
 
     # Ensure dimensions are correct, important for videos
-    out_frame = cv2.resize(out_frame, (w, h), fx=0, fy=0, interpolation=cv2.INTER_CUBIC)
+    if out_frame.shape[:2] != (h, w):
+        out_frame = cv2.resize(out_frame, (w, h), fx=0, fy=0, interpolation=cv2.INTER_CUBIC)
 
     return out_frame
 
-# Edit contrast of all images, save
-for img in imglist:
-    frame = cv2.imread(img)
-
-    h, w, l = frame.shape  # Dimensions of frame
-
-    out_frame = editcontrast(frame, w, h)  # Apply function
-    name = os.path.basename(img).split(".")[0] + '_a' + str_alpha + '_b' +\
-           str_beta + '.png'  # String to save image as
-    cv2.imwrite(name, out_frame)
-
-# Edit contrast of all videos, save
-for video in videolist:
-    capture = cv2.VideoCapture(video)
-
-    # Dimensions, must be exact for videos
-    w = int(np.floor(capture.get(3))) # float
-    h = int(np.floor(capture.get(4))) # float
-    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
-
-    name = os.path.basename(video).split(".")[0] + '_a' + str_alpha + '_b' + \
-           str_beta + '.avi'  # String to save image as, .avi
-    # name = os.path.basename(video).split(".")[0] + '_a' + str_alpha + '_b' + \
-    #        str_beta + '.mp4'  # String to save image as, .mp4
-
-    # Set up video writer object
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
-    # fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
-    out = cv2.VideoWriter(name, fourcc, fps, (w, h))
-
-    # Edit contrast of each frame
-    while True:
-        ret, frame = capture.read()
-        if ret == True:
-            out_frame = editcontrast(frame, w, h)
-            out.write(out_frame)
-        else:
-            break
-
-    # Finish
-    capture.release()
-    out.release()
-    cv2.destroyAllWindows()
+def editcontrasttiled(src, dst, alpha=alpha, beta=beta):
+    """Function to edit contrast of a very large image tile by tile, written into dst, see tiles.py"""
+
+    for y0, y1, x0, x1 in tiles.blocks(*src.shape[:2]):
+        tile = np.array(src[y0:y1, x0:x1])  # Copy of one tile, edited in place
+        dst[y0:y1, x0:x1] = editcontrast(tile, x1 - x0, y1 - y0, alpha, beta, inplace=True)
+
+def contraststrings(alpha, beta):
+    """Function to create strings indicating alpha and beta, used in file names"""
+
+    return str(alpha).replace('.', 'p').replace('-', 'n'), str(beta).replace('.', 'p').replace('-', 'n')
+
+def run(dirpath, alpha=alpha, beta=beta, imglist=None, videolist=None, auto=auto, auto_percentiles=auto_percentiles):
+    """Function to edit contrast of all images and videos, saved in a new "Contrast" folder within dirpath
+    --imglist, videolist: files to edit, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --auto: 'file' or 'batch' chooses alpha and beta from auto_percentiles instead, see frame_stats.py
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create strings to indicate operations performed
+    str_alpha, str_beta = contraststrings(alpha, beta)
+    if auto is None:
+        output_folder = os.path.join(dirpath, 'Contrast a' + str_alpha + ', b' + \
+                        str_beta + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    else:
+        str_percentiles = '-'.join(str(p).replace('.', 'p') for p in auto_percentiles)
+        output_folder = os.path.join(dirpath, 'Contrast auto ' + auto + ' ' + str_percentiles + ', ' + \
+                        now.strftime("%m_%d_%Y, %H_%M_%S"))
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    if auto == 'batch':
+        # One alpha, beta pair for every file, from the intensities of all files
+        # Measured before the output folder is created, files with different bit depths raise an error here
+        alpha, beta = frame_stats.batchstats(imglist + videolist).autocontrast(auto_percentiles)
+        str_alpha, str_beta = contraststrings(alpha, beta)
+    os.mkdir(output_folder)
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'contrast', {'alpha': alpha, 'beta': beta, 'auto': auto,
+                                                              'auto_percentiles': auto_percentiles})
+
+    # Very large images are edited tile by tile instead, see tiles.py
+    tiledlist = [img for img in imglist if tiles.istiled(img)]
+    imglist = [img for img in imglist if img not in tiledlist]
+
+    # Edit contrast of all images, save
+    # Images are read ahead and saved in the background, see image_io.py
+    timers = {img: report.file(img) for img in imglist}
+    with image_io.ImageWriter() as writer:
+        for img, frame in image_io.readimages(imglist, timer=timers):
+            timer = timers[img]
+
+            h, w = frame.shape[:2]  # Dimensions of frame, grayscale images have no third dimension
+
+            if auto == 'file':
+                # alpha, beta from the image already read
+                stats = frame_stats.FrameStats()
+                instrument.timed(timer, 'transform', stats.add, frame)
+                alpha, beta = stats.autocontrast(auto_percentiles)
+                str_alpha, str_beta = contraststrings(alpha, beta)
+
+            out_frame = instrument.timed(timer, 'transform', editcontrast, frame, w, h, alpha, beta,
+                                         inplace=True)  # Apply function
+            name = os.path.basename(img).split(".")[0] + '_a' + str_alpha + '_b' +\
+                   str_beta + '.png'  # String to save image as
+            writer.write(os.path.join(output_folder, name), out_frame, timer=timer,
+                         callback=functools.partial(report.done, timer, name, frames=1))
+
+    for img in tiledlist:
+        timer = report.file(img)
+        if auto == 'file':
+            alpha, beta = frame_stats.imagestats(img, timer).autocontrast(auto_percentiles)
+            str_alpha, str_beta = contraststrings(alpha, beta)
+        name = os.path.basename(img).split(".")[0] + '_a' + str_alpha + '_b' + \
+               str_beta + '.png'  # String to save image as
+        name = tiles.processimage(img, os.path.join(output_folder, name),
+                                  functools.partial(editcontrasttiled, alpha=alpha, beta=beta), timer=timer)
+        report.done(timer, os.path.basename(name), frames=1)
+
+    # Edit contrast of all videos, save
+    for video in videolist:
+        timer = report.file(video)
+        if auto == 'file':
+            # alpha, beta from a sample of frames, see frame_stats.py
+            alpha, beta = frame_stats.videostats(video, timer=timer).autocontrast(auto_percentiles)
+            str_alpha, str_beta = contraststrings(alpha, beta)
+        capture = frame_cache.VideoCapture(video)
+
+        # Dimensions, must be exact for videos
+        w = int(np.floor(capture.get(3))) # float
+        h = int(np.floor(capture.get(4))) # float
+        fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+        name = os.path.basename(video).split(".")[0] + '_a' + str_alpha + '_b' + \
+               str_beta + video_writer.videoextension()  # String to save image as, .avi
+        # name = os.path.basename(video).split(".")[0] + '_a' + str_alpha + '_b' + \
+        #        str_beta + '.mp4'  # String to save image as, .mp4
+
+        # Set up video writer object
+        out = video_writer.VideoWriter(os.path.join(output_folder, name), fps, (w, h),
+                                       is_color=image_io.iscolor(capture))
+
+        # Edit contrast of each frame, reading and writing in parallel with the transform
+        frame_engine.processframes(capture, out, functools.partial(editcontrast, w=w, h=h, alpha=alpha, beta=beta,
+                                                                    inplace=True), timer=timer)
+
+        # Finish
+        capture.release()
+        out.release()
+        report.done(timer, name)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
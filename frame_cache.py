@@ -0,0 +1,217 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that keep decoded video frames on local disk, so a video is only decoded once
+--Not a standalone script, used by all scripts that read videos
+--Frames are stored uncompressed and read back from memory-mapped arrays, without decoding
+--Turned off by default, set use_cache below to True to use
+
+Input variables
+--use_cache: True reads videos through the cache, False reads videos directly
+--cache_dir: directory decoded frames are stored in, should be on a fast local disk
+--max_size_gb: maximum size of the cache, least recently used videos are removed to stay below it
+
+Some tips from the iCLOTS team:
+--Most useful when trying several parameter values (alpha, angle, r_f, ...) on the same videos
+----The first run decodes each video into the cache, later runs skip decoding entirely
+--Decoded frames are much larger than compressed videos, e.g. 1,000 frames of 1024x1024 take ~3 GB
+--A cached video is recognized by a hash of its contents and its modification time
+----Editing or replacing a video means it is decoded again
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import glob
+import json
+import hashlib
+
+import image_io
+import tiff_stack
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Read videos through the cache
+use_cache = False
+# Location and maximum size of the cache
+cache_dir = os.path.join(os.path.expanduser('~'), '.iclots_frame_cache')
+max_size_gb = 20
+
+# Bytes hashed at the start and end of a video to recognize it
+hash_bytes = 1024 * 1024
+
+
+def videokey(video):
+    """Function to compute the key a video is cached under
+    --Hashes the file size, modification time and the first and last hash_bytes of its contents"""
+
+    stat = os.stat(video)
+    sha = hashlib.sha1()
+    sha.update((str(stat.st_size) + '_' + str(stat.st_mtime_ns)).encode())
+    with open(video, 'rb') as f:
+        sha.update(f.read(hash_bytes))
+        if stat.st_size > hash_bytes:
+            f.seek(max(stat.st_size - hash_bytes, hash_bytes))
+            sha.update(f.read(hash_bytes))
+
+    return sha.hexdigest()
+
+def cachesize():
+    """Function to find the total size of all cached frames, in bytes"""
+
+    return sum(os.path.getsize(f) for f in glob.glob(os.path.join(cache_dir, '*.raw')))
+
+def evict(keep=None, needed=0):
+    """Function to remove least recently used videos until the cache has room for needed more bytes
+    --keep: key of a video that must not be removed"""
+
+    max_size = max_size_gb * 1024 ** 3
+    size = cachesize()
+    metas = sorted(glob.glob(os.path.join(cache_dir, '*.json')), key=os.path.getmtime)  # Oldest use first
+    for meta in metas:
+        if size + needed <= max_size:
+            break
+        key = os.path.basename(meta)[:-len('.json')]
+        if key == keep:
+            continue
+        raw = os.path.join(cache_dir, key + '.raw')
+        if os.path.exists(raw):
+            size -= os.path.getsize(raw)
+            os.remove(raw)
+        os.remove(meta)
+
+def decodevideo(video, key):
+    """Function to decode every frame of a video into the cache, returns its metadata"""
+
+    capture = cv2.VideoCapture(video)
+    meta = {'source': os.path.abspath(video),
+            'fps': capture.get(cv2.CAP_PROP_FPS),
+            'fourcc': capture.get(cv2.CAP_PROP_FOURCC)}
+
+    # Make room for the expected size, the frame count reported by some videos is approximate
+    w = int(np.floor(capture.get(3)))  # float
+    h = int(np.floor(capture.get(4)))  # float
+    evict(keep=key, needed=int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) * w * h * 3)
+
+    # Write to a temporary file first, other processes never see a partly written video
+    raw = os.path.join(cache_dir, key + '.raw')
+    tmp = raw + '.' + str(os.getpid()) + '.tmp'
+    count = 0
+    shape = None
+    dtype = None
+    with open(tmp, 'wb') as f:
+        while True:
+            ret, frame = capture.read()
+            if ret == False:
+                break
+            shape = frame.shape
+            dtype = frame.dtype.str
+            f.write(np.ascontiguousarray(frame).data)
+            count += 1
+    capture.release()
+
+    meta['shape'] = [count] + list(shape if shape is not None else (h, w, 3))
+    meta['dtype'] = dtype if dtype is not None else np.dtype(np.uint8).str
+    os.replace(tmp, raw)
+    with open(os.path.join(cache_dir, key + '.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return meta
+
+def cachedframes(video):
+    """Function to get all frames of a video as a memory-mapped (n frames, height, width, layers) array
+    --Decodes the video into the cache first if it isn't already cached
+    --Returns the array and the video metadata (fps, ...)
+    --The array is read-only, the cache itself is never modified"""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = videokey(video)
+    meta_path = os.path.join(cache_dir, key + '.json')
+    raw = os.path.join(cache_dir, key + '.raw')
+
+    if os.path.exists(meta_path) and os.path.exists(raw):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        os.utime(meta_path)  # Mark as recently used
+    else:
+        meta = decodevideo(video, key)
+
+    if meta['shape'][0] == 0:
+        frames = np.zeros(meta['shape'], np.dtype(meta['dtype']))
+    else:
+        frames = np.memmap(raw, dtype=np.dtype(meta['dtype']), mode='r', shape=tuple(meta['shape']))
+
+    return frames, meta
+
+class CachedCapture:
+    """Reads frames from the cache, used the same way as cv2.VideoCapture"""
+
+    def __init__(self, video):
+        self.frames, self.meta = cachedframes(video)
+        self.pos = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        """Returns a copy of the next frame, no decoding
+        --A copy, as frames are often edited in place, edits to a view of the cache would be kept until release"""
+
+        if self.pos >= len(self.frames):
+            return False, None
+        frame = self.frames[self.pos].copy()
+        self.pos += 1
+
+        return True, frame
+
+    def grab(self):
+        if self.pos >= len(self.frames):
+            return False
+        self.pos += 1
+
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.frames.shape[2])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.frames.shape[1])
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.frames))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.pos)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.meta['fps']
+        if prop == cv2.CAP_PROP_FOURCC:
+            return self.meta['fourcc']
+
+        return 0.
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.pos = min(max(int(value), 0), len(self.frames))
+            return True
+
+        return False
+
+    def release(self):
+        self.frames = None
+
+def VideoCapture(video):
+    """Function to open a video for reading, through the cache if use_cache is True
+    --Grayscale videos are read single-channel if image_io.color_mode is 'preserve'
+    --Stacks (multi-page .tif files) are read page by page, never through the cache, see tiff_stack.py
+    --Returns an object used the same way as cv2.VideoCapture"""
+
+    if video.lower().endswith(tiff_stack.stack_extensions):
+        return tiff_stack.StackCapture(video)  # Uncompressed pages are already quick to read
+
+    if use_cache and os.path.isfile(video):
+        return image_io.graycapture(CachedCapture(video), video)
+
+    return image_io.graycapture(cv2.VideoCapture(video), video)
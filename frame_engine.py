@@ -0,0 +1,131 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that read, transform and write the frames of a single video at the same time
+--Not a standalone script, used by rotate.py, edit_contrast.py and resize.py
+--One thread reads frames, a pool of threads applies the per-frame function, one thread writes frames
+----OpenCV releases the Python GIL while reading, transforming and writing, so all three overlap
+----Frames are written in their original order
+
+Some tips from the iCLOTS team:
+--Most useful for single long videos, where processing several files in parallel (batch.py) doesn't help
+--Memory use is bounded by queue_size, not by the length of the video
+
+"""
+
+# Import
+import os
+import queue
+import threading
+import concurrent.futures
+
+import instrument
+
+# Frames held waiting between reading, transforming and writing
+queue_size = 16
+
+
+class WriterList:
+    """Several opened cv2.VideoWriter used as one, write takes a list with one frame for each writer"""
+
+    def __init__(self, outs):
+        self.outs = outs
+
+    def write(self, frames):
+        for out, frame in zip(self.outs, frames):
+            out.write(frame)
+
+    def release(self):
+        for out in self.outs:
+            out.release()
+
+def _put(q, item, stop):
+    """Put an item on a bounded queue, giving up if another thread has failed"""
+
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+def processframes(capture, out, function, workers=None, queue_size=queue_size, timer=None):
+    """Function to apply function to each frame read from capture and write the result to out
+    --capture: opened cv2.VideoCapture, out: opened cv2.VideoWriter, or a WriterList to save several videos
+    --function: takes a frame, returns the frame to write, or a list of frames for a WriterList
+    --workers: number of transform threads, None uses one per CPU core
+    --timer: optional instrument.FileTimer, time spent reading, transforming and writing is added to it
+    --Returns the number of frames written, errors in any thread are raised here"""
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    capture = instrument.wrapcapture(timer, capture)
+    out = instrument.wrapwriter(timer, out)
+    function = instrument.wrapfunction(timer, function)
+
+    frames = queue.Queue(maxsize=queue_size)  # Frames read, waiting for a transform thread
+    results = queue.Queue(maxsize=queue_size)  # Transforms in progress, in frame order
+    stop = threading.Event()
+    errors = []
+    written = [0]
+
+    def read():
+        try:
+            while True:
+                ret, frame = capture.read()
+                if ret == False:
+                    break
+                if not _put(frames, frame, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        _put(frames, None, stop)  # End of video
+
+    def write():
+        try:
+            while not stop.is_set():
+                try:
+                    future = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if future is None:
+                    break
+                out.write(future.result())
+                written[0] += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    reader = threading.Thread(target=read, daemon=True)
+    writer = threading.Thread(target=write, daemon=True)
+    reader.start()
+    writer.start()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while not stop.is_set():
+            try:
+                frame = frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            if not _put(results, executor.submit(function, frame), stop):
+                break
+        _put(results, None, stop)  # Writer stops once all transforms are written
+
+    writer.join()
+    stop.set()  # Releases the reader if the writer failed
+    reader.join()
+
+    if errors:
+        raise errors[0]
+
+    return written[0]
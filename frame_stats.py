@@ -0,0 +1,209 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that measure the intensities of images and videos: histograms, minimum, maximum and percentiles
+--Not a standalone script, used by edit_contrast.py to choose alpha and beta automatically
+--Only an intensity histogram is kept for each layer (channel), memory use doesn't depend on video length
+--Long videos are measured from a random sample of frames rather than every frame
+
+Input variables
+--sample_frames: number of frames measured in each video, None measures every frame
+--seek_frames: sampled frames further apart than this are reached by seeking, closer ones by decoding forward
+--seed: random seed, the same frames are sampled on every run
+
+Some tips from the iCLOTS team:
+--A few hundred frames give percentiles within an intensity value or two of those of every frame
+----Sampling takes a fraction of the time of reading the whole video, sampled frames are spread over the video
+--Videos that don't report their number of frames are read to the end, a reservoir of sampled frames is kept
+--Automatic contrast maps the lower and upper percentile to black and white, as normalize_intrange.py
+----Unlike normalization, the result is expressed as alpha and beta, and all layers share one alpha, beta pair
+----Colors keep their balance, and 16-bit images stay 16-bit
+--e.g. percentiles (1, 99) ignore a few very dark or very bright pixels, such as dead or saturated pixels
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import random
+
+import crop_video
+import frame_cache
+import image_io
+import instrument
+import normalize_intrange
+import tiff_stack
+import tiles
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Frames measured in each video
+sample_frames = 300  # (None: every frame)
+# Distance between sampled frames, in frames, above which the video is seeked rather than decoded
+seek_frames = 50
+# Random seed for choosing sampled frames
+seed = 0
+
+
+class FrameStats:
+    """Intensity histogram of each layer, counted over any number of frames or files"""
+
+    def __init__(self):
+        self.hist = None  # (n intensity values, n layers), see normalize_intrange.histogram
+        self.frames = 0
+
+    def add(self, frame):
+        """Count the pixels of a frame"""
+
+        self.addhistogram(normalize_intrange.histogram(frame))
+
+    def addhistogram(self, hist, frames=1):
+        """Count the pixels of frames already counted as a histogram"""
+
+        if self.hist is None:
+            self.hist = hist.copy()
+        elif self.hist.shape != hist.shape:
+            raise ValueError('Files with different bit depths or numbers of layers have different intensity ranges')
+        else:
+            self.hist += hist
+        self.frames += frames
+
+    def merge(self, other):
+        """Count the pixels counted by another FrameStats, e.g. of another file"""
+
+        if other.hist is not None:
+            self.addhistogram(other.hist, other.frames)
+
+        return self
+
+    def limits(self, percentiles=(0, 100)):
+        """Intensity values at the lower and upper percentile of each layer"""
+
+        return normalize_intrange.histlimits(self.hist, percentiles)
+
+    def minmax(self):
+        """Lowest and highest intensity value of each layer"""
+
+        counted = [np.flatnonzero(self.hist[:, i]) for i in range(self.hist.shape[1])]
+
+        return (np.array([c[0] if len(c) else 0 for c in counted]),
+                np.array([c[-1] if len(c) else 0 for c in counted]))
+
+    def mean(self):
+        """Mean intensity value of each layer"""
+
+        values = np.arange(self.hist.shape[0])[:, None]
+
+        return (self.hist * values).sum(axis=0) / np.maximum(self.hist.sum(axis=0), 1)
+
+    def autocontrast(self, percentiles=(1, 99)):
+        """alpha, beta mapping the lower percentile to 0 and the upper percentile to the highest intensity value
+        --One pair for all layers, lowest lower and highest upper percentile of any layer, see edit_contrast.py
+        --Rounded to 3 and 1 decimals, the values used are the values shown in file names"""
+
+        if self.hist is None:
+            return 1, 0  # Nothing counted, left unchanged
+        low, high = self.limits(percentiles)
+        low, high = low.min(), high.max()
+        max_value = self.hist.shape[0] - 1  # 255 for 8-bit frames, 65535 for 16-bit
+        if high <= low:
+            return 1, 0  # Single intensity value, left unchanged
+
+        alpha = round(float(max_value / (high - low)), 3)
+
+        return alpha, round(float(-low * alpha), 1)
+
+def sampleindices(n_frames, n_samples=sample_frames):
+    """Function to choose n_samples frame numbers at random out of n_frames, in order
+    --Every frame if n_samples is None or at least n_frames"""
+
+    if n_samples is None or n_samples >= n_frames:
+        return list(range(n_frames))
+
+    return sorted(random.Random(seed).sample(range(n_frames), n_samples))
+
+def videostats(video, n_samples=sample_frames, timer=None):
+    """Function to count the intensities of a random sample of n_samples frames of a video or stack
+    --Videos that don't report their number of frames are read to the end, keeping a reservoir of n_samples
+    histograms
+    --timer: optional instrument.FileTimer, time spent reading and counting is added to it"""
+
+    capture = instrument.wrapcapture(timer, frame_cache.VideoCapture(video))
+    if not capture.isOpened():
+        raise IOError('Could not open video ' + video)
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    stats = FrameStats()
+
+    if n_frames > 0:
+        pos = 0  # Number of the next frame read
+        for index in sampleindices(n_frames, n_samples):
+            # Seek past long gaps, decode forward through short ones
+            if index - pos > seek_frames:
+                if not crop_video.seekframe(capture, index):
+                    break
+            else:
+                while pos < index and capture.grab():
+                    pos += 1
+            ret, frame = capture.read()
+            if ret == False:
+                break
+            instrument.timed(timer, 'transform', stats.add, frame)
+            pos = index + 1
+    else:
+        # Number of frames unknown, each frame replaces a random histogram of the reservoir with falling probability
+        rng = random.Random(seed)
+        reservoir = []
+        count = 0
+        while True:
+            ret, frame = capture.read()
+            if ret == False:
+                break
+            count += 1
+            if n_samples is None:
+                instrument.timed(timer, 'transform', stats.add, frame)  # Every frame, nothing to keep
+            elif len(reservoir) < n_samples:
+                reservoir.append(instrument.timed(timer, 'transform', normalize_intrange.histogram, frame))
+            else:
+                i = rng.randrange(count)
+                if i < n_samples:
+                    reservoir[i] = instrument.timed(timer, 'transform', normalize_intrange.histogram, frame)
+        for hist in reservoir:
+            stats.addhistogram(hist)
+
+    capture.release()
+
+    return stats
+
+def imagestats(img, timer=None):
+    """Function to count the intensities of an image, very large images are read one tile at a time, see tiles.py"""
+
+    stats = FrameStats()
+    if tiles.istiled(img):
+        src = instrument.timed(timer, 'decode', tiles.readsource, img)
+        for y0, y1, x0, x1 in tiles.blocks(*src.shape[:2]):
+            instrument.timed(timer, 'transform', stats.add, np.ascontiguousarray(src[y0:y1, x0:x1]))
+    else:
+        stats.add(image_io.readimage(img, timer=timer))
+
+    return stats
+
+def filestats(path, n_samples=sample_frames, timer=None):
+    """Function to count the intensities of an image, or of sampled frames of a video or stack"""
+
+    if path.lower().endswith(('.avi', '.mp4')) or tiff_stack.isstack(path):
+        return videostats(path, n_samples, timer)
+
+    return imagestats(path, timer)
+
+def batchstats(paths, n_samples=sample_frames):
+    """Function to count the intensities of several files together, e.g. to edit a whole batch with one alpha, beta
+    --Every file must have the same bit depth and number of layers"""
+
+    stats = FrameStats()
+    for path in paths:
+        stats.merge(filestats(path, n_samples))
+
+    return stats
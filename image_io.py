@@ -0,0 +1,213 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that read and save images in the background, while other images are being processed
+--Not a standalone script, used by all scripts that process folders of images
+--The next few images are read by a pool of threads, in order, before they are needed
+--Images are saved by another pool of threads, so processing continues while earlier images are saved
+--Also sets how images and videos are read: as 8-bit color, or keeping grayscale and 16-bit data as they are
+
+Input variables
+--workers: number of threads reading images, and number of threads saving images
+--prefetch: number of images read ahead of the image being processed
+--color_mode: how images and videos are read
+----'color': every image is read as 8-bit color (3 channels), as in earlier versions
+----'preserve': grayscale images stay single-channel and 16-bit images keep their full intensity range
+------Grayscale videos are read single-channel and saved single-channel
+
+Some tips from the iCLOTS team:
+--Most useful for images on network drives or slow disks, where reading and saving take longer than processing
+--Memory use is bounded: at most prefetch images are read ahead, and at most 2 x workers images wait to be saved
+----Lower prefetch for very large images
+--Fluorescence and brightfield data are often grayscale, 16-bit .tif files, use color_mode 'preserve'
+----Grayscale frames are a third of the size of color frames, so reading, processing and saving are faster
+----Contrast and normalization use the full 16-bit range of the original image
+----.avi videos are always 8-bit, 16-bit frames saved to .avi videos keep their 8 most significant bits
+----.tif stacks keep all 16 bits, see tiff_stack.py
+--.npy images must hold 8-bit or 16-bit unsigned integers (uint8 or uint16), as .png and .tif files do
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import collections
+import concurrent.futures
+
+import instrument
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Threads reading and saving images
+workers = 4
+# Images read ahead of the image being processed
+prefetch = 8
+# How images and videos are read
+color_mode = 'color'  # ('color': 8-bit color, as in earlier versions, 'preserve': keep grayscale and 16-bit data)
+
+
+def imreadflags():
+    """Function to find the cv2.imread flags matching color_mode"""
+
+    if color_mode == 'preserve':
+        return cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR  # Channels and bit depth of the file
+
+    return cv2.IMREAD_COLOR
+
+def loadnpy(imgname, mmap_mode=None):
+    """Function to read a .npy image, raises an error unless it holds 8-bit or 16-bit unsigned integers
+    --Contrast and normalization need a fixed intensity range, float or signed arrays don't have one
+    --mmap_mode: 'r' reads the image from disk as it is used, see tiles.py"""
+
+    image = np.load(imgname, mmap_mode=mmap_mode)
+    if image.dtype not in (np.uint8, np.uint16):
+        raise ValueError('.npy image ' + imgname + ' holds ' + str(image.dtype) + ' values, only uint8 and uint16 '
+                         'are supported, e.g. save numpy.clip(image * 255, 0, 255).astype(numpy.uint8) for values '
+                         'between 0 and 1')
+
+    return image
+
+def readimage(imgname, flags=None, timer=None):
+    """Function to read an image, raises an error if it can't be read
+    --flags: cv2.imread flags, None uses color_mode, set at the top of this file
+    --.npy images (numpy arrays, e.g. from video_to_imgseq.py) are read as they were saved"""
+
+    if imgname.lower().endswith('.npy'):
+        return instrument.timed(timer, 'decode', loadnpy, imgname)
+
+    if flags is None:
+        flags = imreadflags()
+    image = instrument.timed(timer, 'decode', cv2.imread, imgname, flags)
+    if image is None:
+        raise IOError('Could not read image ' + imgname)
+
+    return image
+
+def readimages(imglist, workers=workers, prefetch=prefetch, flags=None, timer=None, errors='raise'):
+    """Function to read images in order, yielding (image name, image) pairs
+    --The next prefetch images are read in parallel while earlier images are being used
+    --At most prefetch images are held in memory at once
+    --timer: optional instrument.FileTimer for all images, or dictionary of a FileTimer for each image name
+    --errors: 'raise' raises an error for an image that can't be read, 'skip' yields None as the image instead
+    --flags: cv2.imread flags, None uses color_mode, set at the top of this file"""
+
+    def read(imgname):
+        image_timer = timer.get(imgname) if isinstance(timer, dict) else timer
+        try:
+            return readimage(imgname, flags, image_timer)
+        except (IOError, ValueError):  # Unreadable, or a .npy image with unsupported values, see loadnpy
+            if errors == 'skip':
+                return None
+            raise
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()  # Reads in progress, in order
+        for imgname in imglist:
+            pending.append((imgname, executor.submit(read, imgname)))
+            if len(pending) >= prefetch:
+                imgname_done, future = pending.popleft()
+                yield imgname_done, future.result()
+        while pending:
+            imgname_done, future = pending.popleft()
+            yield imgname_done, future.result()
+
+def isgrayframe(frame):
+    """Function to check whether a frame is grayscale, single-channel or with 3 identical channels"""
+
+    if frame.ndim == 2:
+        return True
+
+    return bool(np.array_equal(frame[:, :, 0], frame[:, :, 1]) and np.array_equal(frame[:, :, 1], frame[:, :, 2]))
+
+def isgrayvideo(video):
+    """Function to check whether a video is grayscale, from its first frame"""
+
+    capture = cv2.VideoCapture(video)
+    ret, frame = capture.read()
+    capture.release()
+
+    return ret and isgrayframe(frame)
+
+def iscolor(capture):
+    """Function to check whether frames read from capture are color, used to open matching video writers"""
+
+    return not getattr(capture, 'gray', False)
+
+def to8bit(frame):
+    """Function to convert a 16-bit frame to 8-bit, keeping the 8 most significant bits, e.g. before saving to video"""
+
+    if frame.dtype == np.uint16:
+        return (frame >> 8).astype(np.uint8)
+
+    return frame
+
+class GrayCapture:
+    """Reads a grayscale video as single-channel frames, used the same way as cv2.VideoCapture
+    --Videos are decoded as 3 identical channels, frames are converted right after decoding"""
+
+    gray = True
+
+    def __init__(self, capture):
+        self.capture = capture
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if ret and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return ret, frame
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)  # get, set, release, isOpened etc. of the underlying capture
+
+def graycapture(capture, video):
+    """Function to read capture as single-channel frames if color_mode is 'preserve' and video is grayscale"""
+
+    if color_mode == 'preserve' and isgrayvideo(video):
+        return GrayCapture(capture)
+
+    return capture
+
+class ImageWriter:
+    """Saves images on a pool of threads, used as a context manager
+    --write returns as soon as the image is handed to a thread, unless 2 x workers images are already waiting
+    --Leaving the with block waits for all images to be saved, errors from saving are raised there"""
+
+    def __init__(self, workers=workers, function=cv2.imwrite):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = 2 * workers
+        self.pending = collections.deque()  # Saves in progress, oldest first
+        self.function = function  # Called as function(name, image, *args)
+
+    def save(self, name, image, args, timer, callback):
+        result = instrument.timed(timer, 'encode', self.function, name, image, *args)
+        if result is False:  # cv2.imwrite reports failure rather than raising an error
+            raise IOError('Could not save image ' + name)
+        if callback is not None:
+            callback()
+
+    def write(self, name, image, *args, timer=None, callback=None):
+        """Save image as name in the background
+        --args: passed on to the save function, e.g. cv2.imwrite parameters
+        --timer: optional instrument.FileTimer, callback: optional function called once the image is saved"""
+
+        self.pending.append(self.executor.submit(self.save, name, image, args, timer, callback))
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft().result()
+
+    def close(self):
+        """Wait for all images to be saved"""
+
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -10,6 +10,9 @@ Script function that converts a sequence of images to a video
 
 Input variables
 --fps: frames per second, rate you would like new video to play at
+--mismatch: what to do with images whose dimensions differ from the first image
+----'resize': resize the image to the dimensions of the first image
+----'reject': leave the image out of the video, rejected images are listed when the script finishes
 
 Output files
 --One single video made from all images within the selected directory
@@ -27,57 +30,139 @@ Some tips from the iCLOTS team:
 ------If image names contain numbers, use preceding zeros to order properly
 --------i.e. 01, 02, .. 10 vs. 1, 2, .. 10
 ----Best practice is to use all the same image format, e.g. all .png, etc.
+--Stacks (multi-page .tif files) are added page by page, no need to save each page as an image first
+----See tiff_stack.py, set codec to 'tiff' in video_writer.py to save a stack rather than a video
+--Images are read a few at a time in parallel and written as they are read
+----Memory use doesn't depend on the number of images, very long sequences can be converted
 
 """
 
 # Import
 import cv2
-from tkinter import filedialog
 import os
 import glob
 import datetime
+import itertools
+
+import image_io
+import instrument
+import tiff_stack
+import video_writer
 
 # IMPORTANT: PARAMETERS TO EDIT
 # Frame rate of created video
 fps = 1
-
-# Select directory of files
-dirpath = filedialog.askdirectory()
-
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-# Create strings to indicate operations performed
-str_fps = str(fps).replace('.', 'p')
-output_folder = os.path.join(dirpath, 'Video, fps ' + str_fps + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
-
-# Create a list of all image files
-imglist_png = glob.glob(dirpath + "/*.png")
-imglist_jpg = glob.glob(dirpath + "/*.jpg")
-imglist_tif = glob.glob(dirpath + "/*.tif")
-imglist = sorted(imglist_png + imglist_jpg + imglist_tif)
-
-# Save all frames within an array
-img_array = []
-for imgname in imglist:
-    img = cv2.imread(imgname)
-    img_array.append(img)
-
-# Set up video writer
-h, w, l = img.shape  # Dimensions of frame, use last called
-
-name = os.path.basename(dirpath) + '_fps_' + str_fps + '.avi'  # String to save new video as, .avi
-# name = os.path.basename(dirpath) + '_fps_' + str_fps + '.mp4'  # String to save new video as, .mp4
-
-# Set up video writer object
-fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
-# fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
-out = cv2.VideoWriter(name, fourcc, fps, (w, h))
-
-# Add frames to videowriter
-for i in range(len(img_array)):
-    out.write(img_array[i])
-
-# Finish
-out.release()
+# Images with dimensions different from the first image
+mismatch = 'resize'  # ('resize': resize to first image, 'reject': leave out of video)
+
+# Threads reading images, and images read ahead of the video writer
+workers = 4
+prefetch = 8
+
+
+def readframes(imglist, workers=workers, prefetch=prefetch, timer=None):
+    """Function to read images in order, yielding (image name, image) pairs, None for images that can't be read
+    --Every page of a stack (multi-page .tif file) is yielded in turn, one page in memory at a time"""
+
+    for stack, group in itertools.groupby(imglist, tiff_stack.isstack):
+        if not stack:
+            yield from image_io.readimages(list(group), workers, prefetch, timer=timer, errors='skip')
+            continue
+        for imgname in group:
+            capture = tiff_stack.StackCapture(imgname)
+            while True:
+                ret, img = instrument.timed(timer, 'decode', capture.read)
+                if ret == False:
+                    break
+                yield imgname, img
+            capture.release()
+
+def imgseqtovideo(imglist, name, fps, mismatch='resize', workers=workers, prefetch=prefetch, timer=None):
+    """Function to write a list of images to a video as name, one image per frame
+    --Video dimensions are those of the first image
+    --timer: optional instrument.FileTimer, time spent reading, resizing and writing is added to it
+    --Returns the number of frames written and a list of rejected image names"""
+
+    out = None
+    written = 0
+    rejected = []
+    try:
+        for imgname, img in readframes(imglist, workers, prefetch, timer):
+            if img is None:  # Not readable as an image
+                rejected.append(imgname)
+                continue
+
+            if out is None:
+                # Set up video writer from the first image, single-channel if it is grayscale
+                h, w = img.shape[:2]  # Dimensions of frame
+                is_color = img.ndim == 3
+                out = instrument.wrapwriter(timer, video_writer.VideoWriter(name, fps, (w, h), is_color=is_color))
+
+            if is_color and img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            elif not is_color and img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+            if img.shape[:2] != (h, w):
+                if mismatch == 'reject':
+                    rejected.append(imgname)
+                    continue
+                img = instrument.timed(timer, 'transform', cv2.resize, img, (w, h), fx=0, fy=0,
+                                       interpolation=cv2.INTER_AREA)
+
+            out.write(img)
+            written += 1
+    finally:
+        # Finish, also if an image fails, so the frames written so far are saved
+        if out is not None:
+            out.release()
+
+    return written, rejected
+
+def run(dirpath, fps=fps, mismatch=mismatch, workers=workers, prefetch=prefetch, imglist=None):
+    """Function to convert all images into a single video, saved in a new "Video" folder within dirpath
+    --imglist: images to convert, in order, all .png, .jpg, .tif and .npy files within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create strings to indicate operations performed
+    str_fps = str(fps).replace('.', 'p')
+    output_folder = os.path.join(dirpath, 'Video, fps ' + str_fps + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = glob.glob(dirpath + "/*.png")
+        imglist_jpg = glob.glob(dirpath + "/*.jpg")
+        imglist_tif = glob.glob(dirpath + "/*.tif")
+        imglist_npy = glob.glob(dirpath + "/*.npy")
+        imglist = sorted(imglist_png + imglist_jpg + imglist_tif + imglist_npy)
+
+    # String to save new video as, .avi (or .tif, see video_writer.py)
+    name = os.path.basename(dirpath) + '_fps_' + str_fps + video_writer.videoextension()
+    # name = os.path.basename(dirpath) + '_fps_' + str_fps + '.mp4'  # String to save new video as, .mp4
+
+    # Time the conversion if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'imgseq_to_video', {'fps': fps, 'mismatch': mismatch})
+    timer = report.file(dirpath)
+
+    # Read and write frames as they are read
+    written, rejected = imgseqtovideo(imglist, os.path.join(output_folder, name), fps, mismatch, workers, prefetch,
+                                      timer=timer)
+
+    report.done(timer, name)
+    report.save()
+
+    for imgname in rejected:
+        print('Not included in video: ' + os.path.basename(imgname))
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
@@ -0,0 +1,252 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that measure where time goes while files are processed
+--Not a standalone script, used by all scripts
+--Time is measured separately for three stages of each frame:
+----decode: reading a frame from a video or image file
+----transform: the operation itself (rotating, editing contrast, ...)
+----encode: writing a frame to a video or image file
+--Turned off by default, set enabled below to True to use
+
+Input variables
+--enabled: True measures timing and saves a report, False does nothing
+--show_progress: True prints frames processed, frames/s and time remaining while each video is processed
+
+Output files
+--A "report.json" file next to the output folder of each run, with the same name as the folder
+----Operation and parameters used
+----For each file: frames processed, seconds spent in each stage, total seconds, bytes read and written
+
+Some tips from the iCLOTS team:
+--If decode or encode dominate, try a faster codec or the frame cache (frame_cache.py)
+--If transform dominates, try processing several files at once (batch.py)
+--Transform time is summed over all threads, so it can exceed the total time of a file
+--Measuring time adds one timer call per frame and stage, negligible compared to reading a frame
+
+"""
+
+# Import
+import os
+import json
+import time
+import datetime
+import threading
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Measure and report timing
+enabled = False
+show_progress = True
+
+# Seconds between progress updates
+progress_interval = 1.
+
+
+def printprogress(path, frames, total, fps, eta):
+    """Default progress callback, prints frames processed, frames/s and time remaining"""
+
+    line = os.path.basename(path) + ': ' + str(frames)
+    if total:
+        line += ' of ' + str(total)
+    line += ' frames, ' + '%.1f' % fps + ' frames/s'
+    if eta is not None:
+        line += ', ' + '%.0f' % eta + ' s remaining'
+    print(line)
+
+# Function called with (path, frames, total, fps, seconds remaining) while a file is processed
+# Can be replaced, e.g. to update a progress bar
+progress_callback = printprogress
+
+class FileTimer:
+    """Accumulates frames and seconds spent in each stage for a single file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = 0
+        self.total = None  # Expected number of frames, if known
+        self.seconds = {'decode': 0., 'transform': 0., 'encode': 0.}
+        self.start = time.perf_counter()
+        self.last_progress = self.start
+        self.lock = threading.Lock()  # Stages may run in several threads
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds[stage] += seconds
+
+    def frame(self):
+        """Count a frame as finished, reports progress every progress_interval seconds"""
+
+        self.frames += 1
+        now = time.perf_counter()
+        if show_progress and progress_callback is not None and now - self.last_progress >= progress_interval:
+            self.last_progress = now
+            fps = self.frames / (now - self.start)
+            eta = (self.total - self.frames) / fps if self.total else None
+            progress_callback(self.path, self.frames, self.total, fps, eta)
+
+    def capture(self, capture):
+        """Wrap a cv2.VideoCapture so reading frames is timed as decode"""
+
+        total = capture.get(7)  # cv2.CAP_PROP_FRAME_COUNT
+        if total > 0:
+            self.total = int(total)
+
+        return TimedCapture(capture, self)
+
+    def writer(self, out):
+        """Wrap a cv2.VideoWriter so writing frames is timed as encode"""
+
+        return TimedWriter(out, self)
+
+    def function(self, function):
+        """Wrap a per-frame function so it is timed as transform"""
+
+        def timedfunction(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            self.add('transform', time.perf_counter() - start)
+            return result
+
+        return timedfunction
+
+class TimedCapture:
+    """cv2.VideoCapture with reading frames timed"""
+
+    def __init__(self, capture, timer):
+        self.capture = capture
+        self.timer = timer
+
+    def read(self):
+        start = time.perf_counter()
+        result = self.capture.read()
+        self.timer.add('decode', time.perf_counter() - start)
+        return result
+
+    def grab(self):
+        start = time.perf_counter()
+        result = self.capture.grab()
+        self.timer.add('decode', time.perf_counter() - start)
+        return result
+
+    def __getattr__(self, attr):
+        return getattr(self.capture, attr)
+
+class TimedWriter:
+    """cv2.VideoWriter with writing frames timed and counted"""
+
+    def __init__(self, out, timer):
+        self.out = out
+        self.timer = timer
+
+    def write(self, frame):
+        start = time.perf_counter()
+        self.out.write(frame)
+        self.timer.add('encode', time.perf_counter() - start)
+        self.timer.frame()
+
+    def __getattr__(self, attr):
+        return getattr(self.out, attr)
+
+def timed(timer, stage, function, *args, **kwargs):
+    """Function to call function(*args, **kwargs), adding the time taken to stage if timer is not None"""
+
+    if timer is None:
+        return function(*args, **kwargs)
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timer.add(stage, time.perf_counter() - start)
+
+    return result
+
+def wrapcapture(timer, capture):
+    """Function to time reading from capture if timer is not None"""
+
+    return capture if timer is None else timer.capture(capture)
+
+def wrapwriter(timer, out):
+    """Function to time writing to out if timer is not None"""
+
+    return out if timer is None else timer.writer(out)
+
+def wrapfunction(timer, function):
+    """Function to time a per-frame function if timer is not None"""
+
+    return function if timer is None else timer.function(function)
+
+def filesize(paths):
+    """Function to find the total size of one or several files, in bytes, files that don't exist count as 0"""
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+class RunReport:
+    """Collects a FileTimer for each file processed during a run and saves them as a .json report
+    --Does nothing if enabled is False"""
+
+    def __init__(self, output_folder, operation, parameters):
+        self.output_folder = output_folder
+        self.operation = operation
+        self.parameters = parameters
+        self.files = []
+        self.start = time.perf_counter()
+
+    def file(self, path):
+        """Start timing a file, returns a FileTimer, or None if timing is turned off"""
+
+        if not enabled:
+            return None
+
+        return FileTimer(path)
+
+    def done(self, timer, outputs, frames=None):
+        """Record a finished file
+        --outputs: path or list of paths written, frames: frames processed if not counted by the timer"""
+
+        if timer is None:
+            return
+
+        self.record(timer.path, outputs, timer.frames if frames is None else frames,
+                    time.perf_counter() - timer.start, timer.seconds)
+
+    def record(self, path, outputs, frames, seconds, stage_seconds):
+        """Record a finished file timed elsewhere, e.g. in another process"""
+
+        if not enabled:
+            return
+
+        outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+        self.files.append({
+            'file': path,
+            'outputs': outputs,
+            'frames': frames,
+            'seconds': seconds,
+            'stage_seconds': dict(stage_seconds),
+            'bytes_read': filesize(path),
+            'bytes_written': filesize([os.path.join(self.output_folder, o) for o in outputs]),
+        })
+
+    def save(self):
+        """Save the report as a .json file next to the output folder, returns its path"""
+
+        if not enabled:
+            return None
+
+        report = {
+            'operation': self.operation,
+            'parameters': self.parameters,
+            'date': datetime.datetime.now().isoformat(),
+            'seconds': time.perf_counter() - self.start,
+            'files': self.files,
+        }
+        path = os.path.normpath(self.output_folder) + ' report.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        return path
@@ -0,0 +1,162 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that remember which files have already been processed, so an interrupted run can resume
+--Not a standalone script, used by pipeline.py and batch.py
+--A manifest file within the selected directory records, for each finished file:
+----A hash of the contents of the input file
+----The operation and parameters applied
+----The output file written
+--Turned off by default, set resume below to True to use
+
+Input variables
+--resume: True skips files already processed with the same parameters, False processes every file
+--checkpoint_frames: long videos are written in parts of this many frames
+----An interrupted video restarts from the last finished part rather than from the first frame
+
+Output files
+--"iclots_manifest.json" within the selected directory
+--Unfinished videos are kept in parts within a hidden ".iclots_checkpoints" folder in the selected directory
+----Parts are joined into a single video and removed once the video is finished
+
+Some tips from the iCLOTS team:
+--Each run still creates a new output folder, outputs of earlier runs are linked into it, not processed again
+----Links take no extra disk space, outputs are copied instead where links aren't possible (e.g. other drives)
+--Files are recognized by their contents, renaming or moving a file within the directory doesn't matter
+--Editing an input file or changing any parameter means the file is processed again
+--Deleting an earlier output folder means those files are processed again
+
+"""
+
+# Import
+import os
+import json
+import shutil
+import hashlib
+import datetime
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Skip files already processed with the same parameters
+resume = False
+# Frames written between checkpoints of long videos
+checkpoint_frames = 1000
+
+# Names of the manifest file and checkpoint folder kept within the selected directory
+manifest_name = 'iclots_manifest.json'
+checkpoint_name = '.iclots_checkpoints'
+# Bytes read at a time while hashing a file
+chunk_bytes = 1024 * 1024
+
+
+def filehash(path):
+    """Function to compute a hash of the full contents of a file"""
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def taskkey(input_hash, operation, parameters):
+    """Function to compute the key a finished file is recorded under
+    --Identical inputs processed with identical operations and parameters share a key"""
+
+    task = json.dumps([input_hash, operation, parameters], sort_keys=True, default=str)
+
+    return hashlib.sha1(task.encode()).hexdigest()
+
+def reuse(source, target):
+    """Function to make target a link to an existing output, or a copy where links aren't possible"""
+
+    if os.path.abspath(source) == os.path.abspath(target):
+        return
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+class Manifest:
+    """Record of files processed within a directory, saved after every file so nothing is lost if a run stops"""
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.path = os.path.join(dirpath, manifest_name)
+        self.entries = {}
+        self.hashes = {}  # Hashes of input files by path, with the size and modification time they were computed at
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.entries = saved['entries']
+            self.hashes = saved['hashes']
+
+    def hash(self, path):
+        """Hash of the contents of path, only recomputed if the file changed since it was last hashed"""
+
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        size, mtime, digest = self.hashes.get(path, (None, None, None))
+        if size != stat.st_size or mtime != stat.st_mtime_ns:
+            digest = filehash(path)
+            self.hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+
+        return digest
+
+    def key(self, path, operation, parameters):
+        """Key path is recorded under once processed with operation and parameters"""
+
+        return taskkey(self.hash(path), operation, parameters)
+
+    def output(self, key):
+        """Output previously written for key, None if there is none or it was deleted or changed since"""
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        output = os.path.join(self.dirpath, entry['output'])
+        if not os.path.isfile(output) or os.path.getsize(output) != entry['bytes']:
+            return None
+
+        return output
+
+    def reuseoutput(self, key, output):
+        """Link the output previously written for key as output, returns False if there is none"""
+
+        previous = self.output(key)
+        if previous is None:
+            return False
+        reuse(previous, output)
+
+        return True
+
+    def checkpointdir(self, key):
+        """Folder the parts of an unfinished video are kept in"""
+
+        return os.path.join(self.dirpath, checkpoint_name, key)
+
+    def record(self, key, path, operation, parameters, output):
+        """Record a finished file and save the manifest"""
+
+        self.entries[key] = {
+            'input': os.path.relpath(path, self.dirpath),
+            'operation': operation,
+            'parameters': parameters,
+            'output': os.path.relpath(output, self.dirpath),
+            'bytes': os.path.getsize(output),
+            'date': datetime.datetime.now().isoformat(),
+        }
+        self.save()
+
+    def save(self):
+        # Write to a temporary file first, a run stopped while saving never leaves a partly written manifest
+        tmp = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'entries': self.entries, 'hashes': self.hashes}, f, indent=2, default=str)
+        os.replace(tmp, self.path)
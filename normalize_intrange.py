@@ -6,14 +6,25 @@ This script corresponds to tools available in version 1.0b1, more recent impleme
 may be available within the iCLOTS software and in source code at github.com/iCLOTS
 
 Script function that normalizes the range of pixel intensity values to 0 (black) to 255 (white)
-of images (.jpg, .png, .tif) files within a selected directory
+of images (.jpg, .png, .tif) or videos (.avi) within a selected directory
 
-No input variables
+Input variables
+--mode: how videos are normalized
+----'global': one mapping computed from all frames is applied to every frame
+------Intensities remain comparable over time, requires reading the video twice
+----'frame': each frame is normalized independently, as images are
+--percentiles: lower and upper percentile mapped to 0 and 255
+----(0, 100) uses the true minimum and maximum
+----e.g. (1, 99) ignores a few very dark or very bright pixels, such as dead or saturated pixels
+----Values beyond the percentiles are saved as 0 or 255
+--sample_stride: for 'global' mode, every sample_stride-th frame is used to compute the mapping
+----1 uses every frame, larger values speed up the first pass on long videos
 
 Output files
---All images with 0 as the lowest value and 255 as the highest value
-----Normalization is applied to any number of layers
-----Not currently offered for video files
+--All images or videos with 0 as the lowest value and 255 as the highest value
+----Normalization is applied to each layer (channel) independently
+----Videos default to .avi save, but option for .mp4 is contained in commented code
+----iCLOTS analyzes only .avi files
 --Provided within a "Normalized" folder within the original directory
 
 Some tips from the iCLOTS team:
@@ -23,55 +34,242 @@ Some tips from the iCLOTS team:
 ----It's always most ideal to compare images taken during the same experiment
 --Ideally initial images are within (0, 255) range - "maxed out" pixel values cause loss of information
 ----A range of intensities may have existed beyond 255
---This script uses the following formula:
+--This script uses the following formula, for each layer:
 
-new = layer - min / (max - min) * 255
+new = (layer - min) / (max - min) * 255
+
+--Minimum and maximum are found from intensity histograms, memory use doesn't depend on video length
+--Very large images (e.g. stitched tile scans) are processed in tiles, memory use doesn't depend on image size
+----See tiles.py, .npy images are read from disk one tile at a time
 
 """
 
 # Import
 import cv2
 import numpy as np
-from tkinter import filedialog
 import os
 import glob
 import datetime
+import functools
+
+import frame_cache
+import frame_engine
+import image_io
+import instrument
+import tiff_stack
+import tiles
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Normalization of videos
+mode = 'global'  # ('global': same mapping for all frames, 'frame': each frame independently)
+# Percentiles mapped to 0 and 255
+percentiles = (0, 100)  # ((0, 100): minimum and maximum)
+# Frames used to compute a 'global' mapping
+sample_stride = 1  # (1: every frame, n: every nth frame)
+
+
+def histogram(frame):
+    """Function to count the pixels at each intensity value, for each layer of a frame
+    --Returns an array of (n intensity values, n layers), 256 values for 8-bit frames, 65536 for 16-bit"""
 
-# Select directory of files
-dirpath = filedialog.askdirectory()
+    layers = 1 if frame.ndim == 2 else frame.shape[2]
+    bins = np.iinfo(frame.dtype).max + 1
 
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-# Create strings to indicate operations performed
-output_folder = os.path.join(dirpath, 'Normalized, ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
+    hist = np.zeros((bins, layers), np.int64)
+    for i in range(layers):
+        hist[:, i] = cv2.calcHist([frame], [i], None, [bins], [0, bins]).ravel()
 
-# Create a list of all image files
-imglist_png = sorted(glob.glob(dirpath + "/*.png"))
-imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
-imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
-imglist = imglist_png + imglist_jpg + imglist_tif
+    return hist
 
-def normalize(image):
-    """Function to apply normalization operation to image"""
+def histlimits(hist, percentiles=(0, 100)):
+    """Function to find the intensity values at the lower and upper percentile of each layer of a histogram"""
 
-    h, w, l = image.shape  # Dimensions of frame
+    cumulative = np.cumsum(hist, axis=0)
+    total = cumulative[-1]
+    layers = hist.shape[1]
 
-    for i in range(l):  # For each layer
-        if l != 1:
-        # Normalize
-            image[l] = (image[l] - np.amin(image))/(np.amax(image) - np.amin(image)) * 255
+    low = np.zeros(layers)
+    high = np.zeros(layers)
+    for i in range(layers):
+        # First intensity at which the cumulative count exceeds the percentile
+        low[i] = np.searchsorted(cumulative[:, i], total[i] * percentiles[0] / 100, side='right')
+        high[i] = np.searchsorted(cumulative[:, i], total[i] * percentiles[1] / 100, side='left')
+        high[i] = min(high[i], hist.shape[0] - 1)
 
-    out_image = image
+    return low, high
+
+def normalize(image, low=None, high=None, percentiles=(0, 100)):
+    """Function to apply normalization operation to image
+    --low, high: intensity values of each layer mapped to 0 and 255
+    ----Computed from the image itself if not provided
+    --Returns a new 8-bit image, the original is left unchanged"""
+
+    if low is None or high is None:
+        low, high = histlimits(histogram(image), percentiles)
+
+    layers = 1 if image.ndim == 2 else image.shape[2]
+    low = np.asarray(low, np.float64)
+    high = np.asarray(high, np.float64)
+    # Layers with a single intensity value are saved as 0
+    scale = np.divide(255, high - low, out=np.zeros(layers), where=high > low)
+
+    if image.dtype == np.uint8:
+        # Normalize every layer at once with a lookup table, one lookup per pixel
+        lut = (np.arange(256)[:, None] - low) * scale
+        lut = np.clip(lut, 0, 255).astype(np.uint8)
+        out_image = cv2.LUT(image, lut.reshape(256, 1, layers) if layers > 1 else lut[:, 0])
+    else:
+        out_image = (image.astype(np.float32) - low.astype(np.float32)) * scale.astype(np.float32)
+        out_image = np.clip(out_image, 0, 255).astype(np.uint8)
 
     return out_image
 
-# Normalize all images, save
-for img in imglist:
-    image = cv2.imread(img)
+def normalizetiled(src, dst, percentiles=(0, 100)):
+    """Function to normalize a very large image tile by tile, written into dst, see tiles.py
+    --The histogram of the whole image is counted first, so every tile is normalized with the same mapping"""
+
+    blocks = tiles.blocks(*src.shape[:2])
+
+    hist = None
+    for y0, y1, x0, x1 in blocks:
+        block_hist = histogram(np.ascontiguousarray(src[y0:y1, x0:x1]))
+        hist = block_hist if hist is None else hist + block_hist
+    low, high = histlimits(hist, percentiles)
+
+    for y0, y1, x0, x1 in blocks:
+        dst[y0:y1, x0:x1] = normalize(np.ascontiguousarray(src[y0:y1, x0:x1]), low, high)
+
+def videolimits(video, percentiles=(0, 100), sample_stride=1, timer=None):
+    """Function to find the intensity values at the lower and upper percentile of each layer over all frames
+    of a video
+    --Only the histogram is kept, memory use doesn't depend on video length
+    --timer: optional instrument.FileTimer, time spent reading and counting is added to it"""
+
+    capture = instrument.wrapcapture(timer, frame_cache.VideoCapture(video))
+
+    hist = None
+    count = 0  # Count gives frame number
+    while True:
+        if count % sample_stride == 0:
+            ret, frame = capture.read()
+            if ret == True:
+                frame_hist = instrument.timed(timer, 'transform', histogram, frame)
+                hist = frame_hist if hist is None else hist + frame_hist
+        else:
+            ret = capture.grab()  # Skip frames without converting them
+        if ret == False:
+            break
+        count += 1
+
+    capture.release()
+    if hist is None:
+        raise IOError('No frames read from ' + video)
+
+    return histlimits(hist, percentiles)
+
+def normalizevideo(video, name, mode='global', percentiles=(0, 100), sample_stride=1, timer=None):
+    """Function to normalize each frame of a video and save it as name
+    --'global' mode applies the mapping found over all frames, 'frame' mode normalizes frames independently
+    --timer: optional instrument.FileTimer, time spent in each stage of both passes is added to it"""
+
+    low, high = None, None
+    if mode == 'global':
+        low, high = videolimits(video, percentiles, sample_stride, timer)
+
+    capture = frame_cache.VideoCapture(video)
+
+    # Dimensions, must be exact for videos
+    w = int(np.floor(capture.get(3)))  # float
+    h = int(np.floor(capture.get(4)))  # float
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+    # Set up video writer object
+    out = video_writer.VideoWriter(name, fps, (w, h), is_color=image_io.iscolor(capture))
+
+    # Normalize each frame, reading and writing in parallel with the transform
+    frame_engine.processframes(capture, out, functools.partial(normalize, low=low, high=high,
+                                                                percentiles=percentiles), timer=timer)
+
+    # Finish
+    capture.release()
+    out.release()
+
+def run(dirpath, mode=mode, percentiles=percentiles, sample_stride=sample_stride, imglist=None,
+        videolist=None):
+    """Function to normalize all images and videos, saved in a new "Normalized" folder within dirpath
+    --imglist, videolist: files to normalize, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create strings to indicate operations performed
+    output_folder = os.path.join(dirpath, 'Normalized, ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'normalize', {'mode': mode, 'percentiles': percentiles,
+                                                               'sample_stride': sample_stride})
+
+    # Very large images are normalized tile by tile instead, see tiles.py
+    tiledlist = [img for img in imglist if tiles.istiled(img)]
+    imglist = [img for img in imglist if img not in tiledlist]
+
+    # Normalize all images, save
+    # Images are read ahead and saved in the background, see image_io.py
+    timers = {img: report.file(img) for img in imglist}
+    with image_io.ImageWriter() as writer:
+        for img, image in image_io.readimages(imglist, timer=timers):
+            timer = timers[img]
+
+            out_image = instrument.timed(timer, 'transform', normalize, image, percentiles=percentiles)
+            name = os.path.basename(img).split(".")[0] + '_normalized.png'  # String to save image as
+
+            writer.write(os.path.join(output_folder, name), out_image, timer=timer,
+                         callback=functools.partial(report.done, timer, name, frames=1))
+
+    for img in tiledlist:
+        timer = report.file(img)
+        name = os.path.basename(img).split(".")[0] + '_normalized.png'  # String to save image as
+        name = tiles.processimage(img, os.path.join(output_folder, name),
+                                  functools.partial(normalizetiled, percentiles=percentiles), dtype=np.uint8,
+                                  timer=timer)
+        report.done(timer, os.path.basename(name), frames=1)
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+    videolist = videolist + stacklist
+
+    # Normalize all videos, save
+    for video in videolist:
+        # String to save video as, .avi (or .tif, see video_writer.py)
+        name = os.path.basename(video).split(".")[0] + '_normalized' + video_writer.videoextension()
+        # name = os.path.basename(video).split(".")[0] + '_normalized.mp4'  # String to save video as, .mp4
+        timer = report.file(video)
+        normalizevideo(video, os.path.join(output_folder, name), mode, percentiles, sample_stride, timer)
+        report.done(timer, name)
+
+    report.save()
+
+    return output_folder
+
 
-    out_image = normalize(image)
-    name = os.path.basename(img).split(".")[0] + '_normalized.png'  # String to save image as
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
 
-    cv2.imwrite(name, out_image)
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
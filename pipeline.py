@@ -0,0 +1,394 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that applies several operations in order to images (.jpg, .png, .tif, .npy) or videos (.avi)
+within a selected directory
+--Each video is read once and written once, no matter how many operations are applied
+----Running the individual scripts one after another re-encodes a video once per script
+
+Input variables
+--stages: ordered list of (operation, parameters) pairs applied to each frame
+----'roi': crop to a region of interest, parameters ROI_x, ROI_y, ROI_w, ROI_h (see choose_roi.py)
+----'rotate': rotate, parameter angle (see rotate.py)
+----'resize': resize, parameter r_f (see resize.py)
+----'contrast': edit contrast, parameters alpha, beta (see edit_contrast.py)
+----'normalize': normalize to [0, 255] pixel range, no parameters (see normalize_intrange.py)
+--start_frame: first video frame you would like to retain, None retains from the first frame
+--end_frame: last video frame you would like to retain, None retains to the end of the video
+----Frame range is ignored for images
+--resume: skip files already processed with the same stages and frame range, see manifest.py
+----Long videos are also written in parts so an interrupted video doesn't start over
+
+Output files
+--All images or videos with all operations applied, provided within a "Pipeline" folder within the original directory
+----Videos default to .avi save, but option for .mp4 is contained in commented code
+----iCLOTS analyzes only .avi files
+----.mp4 is better suited for viewing on Mac OS
+
+Some tips from the iCLOTS team:
+--Operations are applied in the order listed
+----Choosing an ROI before rotating or resizing reduces the number of pixels every later operation handles
+----ROI coordinates refer to the frame as it is when the 'roi' stage is reached
+--Applying all operations in one pass avoids compression artifacts building up between scripts
+--Each operation behaves exactly as in its individual script
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import glob
+import json
+import shutil
+import datetime
+
+import choose_roi
+import crop_video
+import edit_contrast
+import frame_cache
+import image_io
+import instrument
+import manifest
+import normalize_intrange
+import resize
+import rotate
+import tiff_stack
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Operations applied to each frame, in order
+stages = [
+    ('rotate', {'angle': 1}),
+    ('resize', {'r_f': 0.5}),
+    ('contrast', {'alpha': 1.2, 'beta': 0}),
+]
+# First and last frame to be retained (videos only)
+start_frame = None
+end_frame = None
+
+
+def roistage(frame, ROI_x, ROI_y, ROI_w, ROI_h):
+    """Pipeline stage, crop a frame to an ROI"""
+
+    return choose_roi.roiframe(frame, ROI_x, ROI_y, ROI_w, ROI_h)
+
+def rotatestage(frame, angle):
+    """Pipeline stage, rotate a frame keeping its dimensions"""
+
+    h, w = frame.shape[:2]  # Dimensions of frame
+
+    return rotate.rotateframe(frame, w, h, angle)
+
+def resizestage(frame, r_f):
+    """Pipeline stage, resize a frame by a resize factor"""
+
+    h, w = frame.shape[:2]  # Dimensions of frame
+    w_n = int(np.floor(w * r_f))  # New width, float
+    h_n = int(np.floor(h * r_f))  # New height, float
+
+    return resize.resizeframe(frame, w_n, h_n)
+
+def contraststage(frame, alpha, beta):
+    """Pipeline stage, edit contrast of a frame"""
+
+    h, w = frame.shape[:2]  # Dimensions of frame
+
+    return edit_contrast.editcontrast(frame, w, h, alpha, beta)
+
+def normalizestage(frame):
+    """Pipeline stage, normalize a frame to [0, 255] pixel range"""
+
+    return normalize_intrange.normalize(frame)
+
+# Operation names available to stages
+STAGES = {
+    'roi': roistage,
+    'rotate': rotatestage,
+    'resize': resizestage,
+    'contrast': contraststage,
+    'normalize': normalizestage,
+}
+
+def stagestring(stages):
+    """Function to create a string indicating all operations performed, used in file names"""
+
+    strings = []
+    for op, params in stages:
+        values = [str(v).replace('.', 'p').replace('-', 'n') for v in params.values()]
+        strings.append('_'.join([op] + values))
+
+    return '_'.join(strings)
+
+def applyframe(frame, stages):
+    """Function to apply every stage in order to a frame - can be an image file or a video frame"""
+
+    for op, params in stages:
+        frame = STAGES[op](frame, **params)
+
+    return frame
+
+def processimage(img, name, stages, timer=None):
+    """Function to apply every stage to an image file and save it as name
+    --timer: optional instrument.FileTimer, time spent in each stage is added to it"""
+
+    frame = image_io.readimage(img, timer=timer)  # Grayscale and 16-bit images are kept if set in image_io.py
+    out_frame = instrument.timed(timer, 'transform', applyframe, frame, stages)
+    instrument.timed(timer, 'encode', cv2.imwrite, name, out_frame)
+    if timer is not None:
+        timer.frame()
+
+def writeframes(capture, name, fps, stages, n_frames=None, timer=None):
+    """Function to apply every stage to the next n_frames frames read from capture and save them as name
+    --n_frames: None reads to the end of the video
+    --Nothing is saved if no frames are left, returns the number of frames written"""
+
+    # Dimensions of the output depend on the stages, writer is set up from the first transformed frame
+    out = None
+    written = 0
+    while n_frames is None or written < n_frames:
+        ret, frame = capture.read()
+        if ret == False:
+            break
+
+        out_frame = instrument.timed(timer, 'transform', applyframe, frame, stages)
+        if out is None:
+            h, w = out_frame.shape[:2]  # Dimensions, must be exact for videos
+            # Set up video writer object
+            out = instrument.wrapwriter(timer, video_writer.VideoWriter(name, fps, (w, h),
+                                                                         is_color=out_frame.ndim == 3))
+        out.write(out_frame)
+        written += 1
+
+    if out is not None:
+        out.release()
+
+    return written
+
+def joinparts(parts, name):
+    """Function to join videos written in parts into a single video, without re-encoding where possible
+    --Compressed frames are copied as in crop_video.py, parts are decoded and re-encoded if that isn't possible"""
+
+    if len(parts) == 1:
+        os.replace(parts[0], name)
+        return
+
+    out = None
+    for part in parts:
+        if part.lower().endswith(tiff_stack.stack_extensions):
+            break  # Stacks have no compressed frames to copy
+        capture = cv2.VideoCapture(part, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])  # Compressed packets
+        if out is None:
+            # Set up video writer object with the codec of the parts
+            w = int(np.floor(capture.get(3)))  # float
+            h = int(np.floor(capture.get(4)))  # float
+            fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+            fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+            out = cv2.VideoWriter(name, cv2.CAP_FFMPEG, fourcc, fps, (w, h), [cv2.VIDEOWRITER_PROP_RAW_VIDEO, 1])
+            if not capture.isOpened() or not out.isOpened():
+                capture.release()
+                out.release()
+                break
+        while True:
+            ret, packet = capture.read()
+            if ret == False:
+                break
+            out.write(packet)
+        capture.release()
+    else:
+        out.release()
+        # Some codecs (e.g. FFV1) need headers packet copying doesn't keep, check the first frame can be read
+        check = cv2.VideoCapture(name)
+        ret = check.read()[0]
+        check.release()
+        if ret:
+            return
+
+    # Compressed frames can't be copied with this OpenCV build or codec, decode and re-encode instead
+    out = None
+    for part in parts:
+        capture = image_io.graycapture(tiff_stack.VideoCapture(part), part)
+        if out is None:
+            w = int(np.floor(capture.get(3)))  # float
+            h = int(np.floor(capture.get(4)))  # float
+            fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+            out = video_writer.VideoWriter(name, fps, (w, h), is_color=image_io.iscolor(capture))
+        while True:
+            ret, frame = capture.read()
+            if ret == False:
+                break
+            out.write(frame)
+        capture.release()
+    out.release()
+
+def finishedparts(checkpoint_dir):
+    """Function to find the number of frames in each part finished by an earlier call of checkpointvideo"""
+
+    progress_file = os.path.join(checkpoint_dir, 'progress.json')
+    if not os.path.exists(progress_file):
+        return []
+    with open(progress_file) as f:
+        return json.load(f)
+
+def checkpointvideo(capture, name, fps, stages, n_frames, checkpoint_dir, timer=None):
+    """Function to apply every stage to the next n_frames frames of capture, writing them in parts
+    --Each finished part is recorded in checkpoint_dir, parts finished by an earlier, interrupted call are kept
+    ----capture must already be positioned after the frames of the finished parts
+    --Parts are joined and saved as name once all frames are written, checkpoint_dir is then removed
+    --Returns the number of frames written, including earlier parts"""
+
+    progress_file = os.path.join(checkpoint_dir, 'progress.json')
+    parts = finishedparts(checkpoint_dir)
+    if n_frames is not None:
+        n_frames -= sum(parts)
+
+    while n_frames is None or n_frames > 0:
+        n = manifest.checkpoint_frames if n_frames is None else min(manifest.checkpoint_frames, n_frames)
+        part = os.path.join(checkpoint_dir, 'part_' + str(len(parts)).zfill(5) + video_writer.videoextension())
+        # Renamed once finished, a stopped part is never kept
+        tmp = os.path.splitext(part)[0] + '_unfinished' + video_writer.videoextension()
+        written = writeframes(capture, tmp, fps, stages, n, timer)
+        if written == 0:
+            break
+        os.replace(tmp, part)
+        parts.append(written)
+        with open(progress_file, 'w') as f:
+            json.dump(parts, f)
+        if written < n:  # End of video
+            break
+        if n_frames is not None:
+            n_frames -= written
+
+    part_names = [os.path.join(checkpoint_dir, 'part_' + str(i).zfill(5) + video_writer.videoextension())
+                  for i in range(len(parts))]
+    if part_names:
+        instrument.timed(timer, 'encode', joinparts, part_names, name)
+    shutil.rmtree(checkpoint_dir)
+
+    return sum(parts)
+
+def processvideo(video, name, stages, start_frame=None, end_frame=None, checkpoint_dir=None, timer=None):
+    """Function to apply every stage to each frame of a video, reading and writing it once
+    --Frames outside of [start_frame, end_frame] are skipped without being read, as in crop_video.py
+    --checkpoint_dir: optional folder the video is written to in parts, see manifest.py
+    ----An interrupted video restarts from the last finished part when called again with the same folder
+    --timer: optional instrument.FileTimer, time spent in each stage is added to it
+    --Returns the number of frames written"""
+
+    capture = frame_cache.VideoCapture(video)
+    if not capture.isOpened():
+        raise IOError('Could not open video ' + video)
+    capture = instrument.wrapcapture(timer, capture)
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+    count = 0 if start_frame is None else start_frame  # Count gives frame number
+    n_frames = None if end_frame is None else max(end_frame - count + 1, 0)
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        count += sum(finishedparts(checkpoint_dir))
+
+    # Seek rather than reading frames that are not retained
+    positioned = crop_video.seekframe(capture, count)
+    if checkpoint_dir is not None:
+        # Parts are joined even if all frames were written before an interruption
+        written = checkpointvideo(capture, name, fps, stages, n_frames, checkpoint_dir, timer)
+    elif positioned:
+        written = writeframes(capture, name, fps, stages, n_frames, timer)
+    else:
+        written = 0
+
+    # Finish
+    capture.release()
+
+    return written
+
+def run(dirpath, stages=stages, start_frame=start_frame, end_frame=end_frame, imglist=None, videolist=None,
+        resume=manifest.resume):
+    """Function to apply all stages to all images and videos, saved in a new "Pipeline" folder within dirpath
+    --imglist, videolist: files to process, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --resume: skip files already processed with the same stages, see manifest.py
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create a string to indicate operations performed
+    str_stages = stagestring(stages)
+    output_folder = os.path.join(dirpath, 'Pipeline, ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'pipeline', {'stages': stages, 'start_frame': start_frame,
+                                                              'end_frame': end_frame})
+
+    # Files processed by earlier runs, if resuming
+    previous = manifest.Manifest(dirpath) if resume else None
+    image_parameters = {'stages': stages, 'color_mode': image_io.color_mode}
+    video_parameters = {'stages': stages, 'start_frame': start_frame, 'end_frame': end_frame,
+                        'codec': video_writer.codec, 'color_mode': image_io.color_mode}
+
+    # Apply all stages to all images, save
+    for img in imglist:
+        name = os.path.basename(img).split(".")[0] + '_' + str_stages + '.png'  # String to save image as
+        output = os.path.join(output_folder, name)
+        if previous is not None:
+            key = previous.key(img, 'pipeline', image_parameters)
+            if previous.reuseoutput(key, output):
+                continue
+
+        timer = report.file(img)
+        processimage(img, output, stages, timer)
+        report.done(timer, name)
+        if previous is not None:
+            previous.record(key, img, 'pipeline', image_parameters, output)
+
+    # Apply all stages to all videos, save
+    for video in videolist:
+        # String to save video as, .avi (or .tif, see video_writer.py)
+        name = os.path.basename(video).split(".")[0] + '_' + str_stages + video_writer.videoextension()
+        # name = os.path.basename(video).split(".")[0] + '_' + str_stages + '.mp4'  # String to save video as, .mp4
+        output = os.path.join(output_folder, name)
+        checkpoint_dir = None
+        if previous is not None:
+            key = previous.key(video, 'pipeline', video_parameters)
+            if previous.reuseoutput(key, output):
+                continue
+            checkpoint_dir = previous.checkpointdir(key)
+
+        timer = report.file(video)
+        processvideo(video, output, stages, start_frame, end_frame, checkpoint_dir, timer)
+        report.done(timer, name)
+        if previous is not None and os.path.exists(output):
+            previous.record(key, video, 'pipeline', video_parameters, output)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
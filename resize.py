@@ -10,6 +10,8 @@ Script function that resizes images (.jpg, .png, .tif) or videos (.avi) within a
 Input variables
 --r_f (resize factor): the factor a frame's dimensions are multiplied by during the resize process
 ---- < 1 indicates reducing resolution, > 1 increases resolution
+--scales: list of resize factors, each file is saved once at every factor, e.g. [1, 0.5, 0.25]
+----None saves each file at r_f only
 
 Output files
 --All images or videos resized, provided within a "Resize" folder within the original directory
@@ -24,87 +26,188 @@ Some tips from the iCLOTS team:
 --Artificially increasing resolution in post-processing oftentimes isn't useful
 ----It is not possible to add information that the microscope did not provide
 ----It may lead to bias in morphological results by exponentially increasing changes in dimension
+--Saving several scales at once reads each file only once
+----Each smaller scale is made from the next larger one, so 0.25 is made from 0.5 rather than the full frame
+----Reducing resolution averages neighboring pixels (area interpolation), increasing it uses cubic interpolation
+--Very large images (e.g. stitched tile scans) are processed in tiles, memory use doesn't depend on image size
+----See tiles.py, .npy images are read from disk one tile at a time
+----Each scale of a very large image is made from the original image rather than the next larger scale
 
 """
 
 # Import
 import cv2
 import numpy as np
-from tkinter import filedialog
 import os
 import glob
 import datetime
+import functools
+
+import frame_cache
+import frame_engine
+import image_io
+import instrument
+import tiff_stack
+import tiles
+import video_writer
 
 # IMPORTANT: PARAMETERS TO EDIT
 # Resize factor frame dimensions are multiplied by
 r_f = 0.5  # (<1: reduce size >1: increase size)
-
-# Select directory of files
-dirpath = filedialog.askdirectory()
-
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-str_r_f = str(r_f).replace('.', 'p') # Create a string to indicate resize factor in outputs
-output_folder = os.path.join(dirpath, 'Resize ' + str_r_f + ', ' + now.strftime("%m:%d:%Y, %H.%M.%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
-
-# Create a list of all image files
-imglist_png = sorted(glob.glob(dirpath + "/*.png"))
-imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
-imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
-imglist = imglist_png + imglist_jpg + imglist_tif
-
-# Create a list of all video files
-videolist = glob.glob(dirpath + '/*.avi')  # .avi
-# videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+# Several resize factors saved from one read of each file
+scales = None  # (None: r_f only, e.g. [1, 0.5, 0.25])
 
 def resizeframe(frame, w_n, h_n):
     """Function to resize a frame - can be an image file or a video frame"""
 
-    # Resize
-    out_frame = cv2.resize(frame, (w_n, h_n), fx=0, fy=0, interpolation=cv2.INTER_CUBIC)
+    # Resize, area interpolation avoids aliasing when reducing size
+    h, w = frame.shape[:2]
+    interpolation = cv2.INTER_AREA if w_n <= w and h_n <= h else cv2.INTER_CUBIC
+    out_frame = cv2.resize(frame, (w_n, h_n), fx=0, fy=0, interpolation=interpolation)
 
     return out_frame
 
-# Resize all images, save
-for img in imglist:
-    frame = cv2.imread(img)
+def scalesizes(w, h, factors):
+    """Function to find the dimensions of a w x h frame multiplied by each resize factor"""
 
-    h, w, l = frame.shape  # Dimensions of frame
-    w_n = int(np.floor(w * r_f))  # New width, float
-    h_n = int(np.floor(h * r_f))  # New height, float
+    return [(int(np.floor(w * f)), int(np.floor(h * f))) for f in factors]
 
-    out_frame = resizeframe(frame, w_n, h_n)  # Apply function
-    name = os.path.basename(img).split(".")[0] + '_rs_' + str_r_f + '.png'  # String to save image as
-    cv2.imwrite(name, out_frame)
+def pyramidframe(frame, sizes):
+    """Function to resize a frame to each of several sizes, largest first
+    --Each size is made from the previous one as long as that one wasn't enlarged, pyramid-style
+    --Returns a list of frames, one per size"""
 
-# Resize all videos, save
-for video in videolist:
-    capture = cv2.VideoCapture(video)
-
-    # Dimensions, must be exact for videos
-    w_n = int(np.floor(capture.get(3) * r_f)) # float
-    h_n = int(np.floor(capture.get(4) * r_f))  # float
-    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
-
-    name = os.path.basename(video).split(".")[0] + '_rs_' + str_r_f + '.avi'  # String to save image as, avi
-    # name = os.path.basename(video).split(".")[0] + '_rs_' + str_r_f + '.mp4'  # String to save image as, mp4
-
-    # Set up video writer object
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
-    # fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
-    out = cv2.VideoWriter(name, fourcc, fps, (w_n, h_n))
-
-    # Resize each frame
-    while True:
-        ret, frame = capture.read()
-        out_frame = resizeframe(frame, w_n, h_n)
-        out.write(out_frame)
+    h, w = frame.shape[:2]
+    out_frames = []
+    source = frame
+    for w_n, h_n in sizes:
+        if w_n == w and h_n == h:
+            out_frame = frame
         else:
-            break
-
-    # Finish
-    capture.release()
-    out.release()
-    cv2.destroyAllWindows()
+            out_frame = resizeframe(source, w_n, h_n)
+        out_frames.append(out_frame)
+        if w_n <= w and h_n <= h:
+            source = out_frame  # Next, smaller size is made from this one
+
+    return out_frames
+
+def resizetiled(src, dst):
+    """Function to resize a very large image tile by tile, written into dst, see tiles.py
+    --The output dimensions are those of dst, interpolation is chosen as in resizeframe"""
+
+    h, w = src.shape[:2]
+    h_n, w_n = dst.shape[:2]
+    interpolation = cv2.INTER_AREA if w_n <= w and h_n <= h else cv2.INTER_CUBIC
+
+    size_y, size_x, aligned = tiles.resizesteps(w, h, w_n, h_n)
+    for y0, y1, x0, x1 in tiles.blocks(h_n, w_n, size_y, size_x):
+        dst[y0:y1, x0:x1] = tiles.resizeblock(src, w_n, h_n, y0, y1, x0, x1, aligned, interpolation)
+
+def run(dirpath, r_f=r_f, scales=scales, imglist=None, videolist=None):
+    """Function to resize all images and videos, saved in a new "Resize" folder within dirpath
+    --scales: several resize factors, each file is read once and saved at every factor, None uses r_f
+    --imglist, videolist: files to resize, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    factors = [r_f] if scales is None else sorted(scales, reverse=True)  # Largest first
+    str_r_fs = [str(f).replace('.', 'p') for f in factors]  # Create strings to indicate resize factors in outputs
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    output_folder = os.path.join(dirpath, 'Resize ' + '_'.join(str_r_fs) + ', ' + now.strftime("%m:%d:%Y, %H.%M.%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'resize', {'r_f': r_f, 'scales': scales})
+
+    # Very large images are resized tile by tile instead, see tiles.py
+    tiledlist = [img for img in imglist if tiles.istiled(img)]
+    imglist = [img for img in imglist if img not in tiledlist]
+
+    # Resize all images, save
+    # Images are read ahead and saved in the background, see image_io.py
+    timers = {img: report.file(img) for img in imglist}
+    with image_io.ImageWriter() as writer:
+        for img, frame in image_io.readimages(imglist, timer=timers):
+            timer = timers[img]
+
+            h, w = frame.shape[:2]  # Dimensions of frame, grayscale images have no third dimension
+            sizes = scalesizes(w, h, factors)  # New dimensions, float
+
+            out_frames = instrument.timed(timer, 'transform', pyramidframe, frame, sizes)  # Apply function
+            names = [os.path.basename(img).split(".")[0] + '_rs_' + str_r_f + '.png'
+                     for str_r_f in str_r_fs]  # Strings to save images as
+            for i, (out_frame, name) in enumerate(zip(out_frames, names)):
+                done = functools.partial(report.done, timer, names, frames=1) if i == len(names) - 1 else None
+                writer.write(os.path.join(output_folder, name), out_frame, timer=timer, callback=done)
+
+    for img in tiledlist:
+        timer = report.file(img)
+        src = instrument.timed(timer, 'decode', tiles.readsource, img)  # Read once for all resize factors
+
+        h, w = src.shape[:2]  # Dimensions of image
+        names = []
+        for size, str_r_f in zip(scalesizes(w, h, factors), str_r_fs):
+            name = os.path.basename(img).split(".")[0] + '_rs_' + str_r_f + '.png'  # String to save image as
+            name = tiles.processimage(img, os.path.join(output_folder, name), resizetiled, size=size, timer=timer,
+                                      src=src)
+            names.append(os.path.basename(name))
+        report.done(timer, names, frames=1)
+
+    # Resize all videos, save
+    for video in videolist:
+        timer = report.file(video)
+        capture = frame_cache.VideoCapture(video)
+
+        # Dimensions, must be exact for videos
+        sizes = scalesizes(capture.get(3), capture.get(4), factors)  # float
+        fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+        # Set up a video writer object for each resize factor
+        names = []
+        outs = []
+        for (w_n, h_n), str_r_f in zip(sizes, str_r_fs):
+            # String to save video as, .avi (or .tif, see video_writer.py)
+            name = os.path.basename(video).split(".")[0] + '_rs_' + str_r_f + video_writer.videoextension()
+            # name = os.path.basename(video).split(".")[0] + '_rs_' + str_r_f + '.mp4'  # String to save image as, mp4
+            outs.append(video_writer.VideoWriter(os.path.join(output_folder, name), fps, (w_n, h_n),
+                                                 is_color=image_io.iscolor(capture)))
+            names.append(name)
+        out = frame_engine.WriterList(outs)
+
+        # Resize each frame, reading and writing in parallel with the transform
+        frame_engine.processframes(capture, out, functools.partial(pyramidframe, sizes=sizes), timer=timer)
+
+        # Finish
+        capture.release()
+        out.release()
+        report.done(timer, names)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
@@ -28,46 +28,45 @@ Some tips from the iCLOTS team:
 --Rotating videos or images such that microfluidic channels are horizontal is suggested for:
 ----One-directional movement quantification, such as deformability or velocity applications
 --Rotating images has no affect on morphology measurements
+--The rotation is computed once per frame size and applied with a single interpolation
+----Rotated frames aren't blurred by a second resize step
+--Very large images (e.g. stitched tile scans) are processed in tiles, memory use doesn't depend on image size
+----See tiles.py, .npy images are read from disk one tile at a time
 
 """
 
 # Import
 import cv2
 import numpy as np
-from tkinter import filedialog
 import os
 import glob
 import datetime
+import functools
+
+import frame_cache
+import frame_engine
+import image_io
+import instrument
+import tiff_stack
+import tiles
+import video_writer
 
 # IMPORTANT: PARAMETERS TO EDIT
 # Resize factor frame dimensions are multiplied by
 angle = 1  # (<0: clockwise, >0: counterclockwise)
 
-# Select directory of files
-dirpath = filedialog.askdirectory()
-
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-# Create a string to indicate degrees rotated in outputs
-str_angle = str(angle).replace('.', 'p').replace('-', 'n')
-output_folder = os.path.join(dirpath, 'Rotate ' + str_angle + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
+# Rotation matrices already computed, by (frame width, frame height, output width, output height, angle)
+rotation_mats = {}
 
-# Create a list of all image files
-imglist_png = sorted(glob.glob(dirpath + "/*.png"))
-imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
-imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
-imglist = imglist_png + imglist_jpg + imglist_tif
+def rotationmatrix(w_n, h_n, w, h, angle):
+    """Function to compute the single affine matrix that rotates a w_n x h_n frame by angle
+    and fits the whole rotated frame within a w x h output
+    --Computed once per set of dimensions and angle, then reused for every frame"""
 
-# Create a list of all video files
-videolist = glob.glob(dirpath + '/*.avi')  # .avi
-# videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+    key = (w_n, h_n, w, h, angle)
+    if key in rotation_mats:
+        return rotation_mats[key]
 
-def rotateframe(frame, w, h):
-    """Function to rotate a frame - can be an image file or a video frame"""
-
-    h_n, w_n = frame.shape[:2]  # Image shape has 3 dimensions
     image_center = (
         w / 2,
         h / 2)  # getRotationMatrix2D needs coordinates in reverse order (width, height) compared to shape
@@ -86,51 +85,128 @@ def rotateframe(frame, w, h):
     rotation_mat[0, 2] += bound_w / 2 - image_center[0]
     rotation_mat[1, 2] += bound_h / 2 - image_center[1]
 
-    # rotate image with the new bounds and translated rotation matrix
-    out_frame = cv2.warpAffine(frame, rotation_mat, (bound_w, bound_h))
+    # Scale the rotated bounds back to the output dimensions within the same matrix
+    # Equivalent to warping to (bound_w, bound_h) then resizing to (w, h), with one interpolation instead of two
+    rotation_mat[0, :] *= w / bound_w
+    rotation_mat[1, :] *= h / bound_h
+
+    rotation_mats[key] = rotation_mat
+
+    return rotation_mat
+
+def rotateframe(frame, w, h, angle=angle):
+    """Function to rotate a frame - can be an image file or a video frame
+    --angle defaults to the parameter above, pipelines may pass their own"""
+
+    h_n, w_n = frame.shape[:2]  # Color images have a third dimension, grayscale images don't
+
+    rotation_mat = rotationmatrix(w_n, h_n, w, h, angle)
 
-    # Ensure dimensions are correct, important for videos
-    out_frame = cv2.resize(out_frame, (w, h), fx=0, fy=0, interpolation=cv2.INTER_CUBIC)
+    # Rotate image straight to the output dimensions, important for videos
+    out_frame = cv2.warpAffine(frame, rotation_mat, (w, h))
 
     return out_frame
 
-# Rotate all images, save
-for img in imglist:
-    frame = cv2.imread(img)
-
-    h, w, l = frame.shape  # Dimensions of frame
-
-    out_frame = rotateframe(frame, w, h)  # Apply function
-    name = os.path.basename(img).split(".")[0] + '_rot_' + str_angle + '.png'  # String to save image as
-    cv2.imwrite(name, out_frame)
-
-# Rotate all videos, save
-for video in videolist:
-    capture = cv2.VideoCapture(video)
-
-    # Dimensions, must be exact for videos
-    w = int(np.floor(capture.get(3))) # float
-    h = int(np.floor(capture.get(4))) # float
-    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
-
-    name = os.path.basename(video).split(".")[0] + '_rot_' + str_angle + '.avi'  # String to save image as, .avi
-    # name = os.path.basename(video).split(".")[0] + '_rot_' + str_angle + '.mp4'  # String to save image as, .mp4
-
-    # Set up video writer object
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # .avi
-    # fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # .mp4
-    out = cv2.VideoWriter(name, fourcc, fps, (w, h))
-
-    # Rotate each frame
-    while True:
-        ret, frame = capture.read()
-        if ret == True:
-            out_frame = rotateframe(frame, w, h)
-            out.write(out_frame)
-        else:
-            break
-
-    # Finish
-    capture.release()
-    out.release()
-    cv2.destroyAllWindows()
+def rotatetiled(src, dst, angle=angle):
+    """Function to rotate a very large image tile by tile, written into dst, see tiles.py"""
+
+    h, w = src.shape[:2]
+    rotation_mat = rotationmatrix(w, h, w, h, angle)
+    for y0, y1, x0, x1 in tiles.blocks(h, w):
+        dst[y0:y1, x0:x1] = tiles.warpblock(src, rotation_mat, y0, y1, x0, x1)
+
+def run(dirpath, angle=angle, imglist=None, videolist=None):
+    """Function to rotate all images and videos, saved in a new "Rotate" folder within dirpath
+    --imglist, videolist: files to rotate, all .png, .jpg, .tif, .npy and .avi files within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create a string to indicate degrees rotated in outputs
+    str_angle = str(angle).replace('.', 'p').replace('-', 'n')
+    output_folder = os.path.join(dirpath, 'Rotate ' + str_angle + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if imglist is None:
+        # Create a list of all image files
+        imglist_png = sorted(glob.glob(dirpath + "/*.png"))
+        imglist_jpg = sorted(glob.glob(dirpath + "/*.jpg"))
+        imglist_tif = sorted(glob.glob(dirpath + "/*.tif"))
+        imglist_npy = sorted(glob.glob(dirpath + "/*.npy"))
+        imglist = imglist_png + imglist_jpg + imglist_tif + imglist_npy
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'rotate', {'angle': angle})
+
+    # Very large images are rotated tile by tile instead, see tiles.py
+    tiledlist = [img for img in imglist if tiles.istiled(img)]
+    imglist = [img for img in imglist if img not in tiledlist]
+
+    # Rotate all images, save
+    # Images are read ahead and saved in the background, see image_io.py
+    timers = {img: report.file(img) for img in imglist}
+    with image_io.ImageWriter() as writer:
+        for img, frame in image_io.readimages(imglist, timer=timers):
+            timer = timers[img]
+
+            h, w = frame.shape[:2]  # Dimensions of frame, grayscale images have no third dimension
+
+            out_frame = instrument.timed(timer, 'transform', rotateframe, frame, w, h, angle)  # Apply function
+            name = os.path.basename(img).split(".")[0] + '_rot_' + str_angle + '.png'  # String to save image as
+            writer.write(os.path.join(output_folder, name), out_frame, timer=timer,
+                         callback=functools.partial(report.done, timer, name, frames=1))
+
+    for img in tiledlist:
+        timer = report.file(img)
+        name = os.path.basename(img).split(".")[0] + '_rot_' + str_angle + '.png'  # String to save image as
+        name = tiles.processimage(img, os.path.join(output_folder, name), functools.partial(rotatetiled, angle=angle),
+                                  timer=timer)
+        report.done(timer, os.path.basename(name), frames=1)
+
+    # Rotate all videos, save
+    for video in videolist:
+        timer = report.file(video)
+        capture = frame_cache.VideoCapture(video)
+
+        # Dimensions, must be exact for videos
+        w = int(np.floor(capture.get(3))) # float
+        h = int(np.floor(capture.get(4))) # float
+        fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+        # String to save video as, .avi (or .tif, see video_writer.py)
+        name = os.path.basename(video).split(".")[0] + '_rot_' + str_angle + video_writer.videoextension()
+        # name = os.path.basename(video).split(".")[0] + '_rot_' + str_angle + '.mp4'  # String to save image as, .mp4
+
+        # Set up video writer object
+        out = video_writer.VideoWriter(os.path.join(output_folder, name), fps, (w, h),
+                                       is_color=image_io.iscolor(capture))
+
+        # Rotate each frame, reading and writing in parallel with the transform
+        frame_engine.processframes(capture, out, functools.partial(rotateframe, w=w, h=h, angle=angle),
+                                   timer=timer)
+
+        # Finish
+        capture.release()
+        out.release()
+        report.done(timer, name)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
@@ -0,0 +1,193 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that subtracts the background from videos (.avi) within a selected directory
+--The background is everything that doesn't move, e.g. channel walls, debris and uneven illumination
+--A running estimate of the background is updated with each frame, then subtracted from the next frame
+
+Input variables
+--method: how the background is estimated
+----'mean': exponential running mean, each frame is added to the background with weight learning_rate
+----'median': approximate running median, the background moves median_step intensity values towards each frame
+--learning_rate: for 'mean', weight of each new frame in the background
+----Higher values adapt faster to changes in illumination, but absorb slowly moving or adhered cells
+--median_step: for 'median', largest change of the background per frame, in 8-bit intensity values
+--polarity: which differences from the background are kept
+----'absolute': both brighter and darker pixels, e.g. cells in brightfield with bright edges and dark centers
+----'brighter': brighter pixels only, e.g. fluorescent cells, 'darker': darker pixels only
+
+Output files
+--All videos with the background subtracted, provided within a "Background" folder within the original directory
+----Pixels matching the background are black (value 0), cells are bright
+----Videos default to .avi save, but option for .mp4 is contained in commented code
+----iCLOTS analyzes only .avi files
+----.mp4 is better suited for viewing on Mac OS
+
+Some tips from the iCLOTS team:
+--Useful before velocity and adhesion analyses, static channel features are no longer mistaken for cells
+----Mostly black videos are also smaller to save and quicker to analyze
+--Only the background is kept between frames, memory use doesn't depend on video length
+----Each frame is compared to the background estimated from earlier frames only
+--The first frame is the initial background, it is saved as a black frame
+----'mean' averages the first 1 / learning_rate frames equally, cells in the first frame fade quickly
+----'median' is more robust to cells that stop or pass slowly, but takes longer to settle at the start
+--Adhered cells become part of the background over time, lower learning_rate or median_step to keep them longer
+--Edit contrast afterwards (edit_contrast.py) to make faint differences easier to see
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import glob
+import datetime
+
+import frame_cache
+import frame_engine
+import image_io
+import instrument
+import tiff_stack
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Background estimate
+method = 'mean'  # ('mean': exponential running mean, 'median': approximate running median)
+# Weight of each new frame, 'mean' only
+learning_rate = 0.02  # (higher: adapts faster, lower: keeps stationary cells visible longer)
+# Change of the background per frame in intensity values, 'median' only
+median_step = 1
+# Differences kept
+polarity = 'absolute'  # ('absolute': brighter and darker, 'brighter': brighter only, 'darker': darker only)
+
+
+class RunningBackground:
+    """Running estimate of the background of one video, updated with each frame in constant time and memory"""
+
+    def __init__(self, method=method, learning_rate=learning_rate, median_step=median_step, polarity=polarity):
+        self.method = method
+        self.learning_rate = learning_rate
+        self.median_step = median_step
+        self.polarity = polarity
+        self.background = None  # float32 for 'mean', int32 for 'median'
+        self.n = 0  # Frames added to the background
+
+    def subtract(self, frame):
+        """Subtract the background from a frame, then add the frame to the background
+        --Returns a new frame with the same dimensions and bit depth"""
+
+        if self.background is None:
+            self.background = frame.astype(np.float32 if self.method == 'mean' else np.int32)
+            self.n = 1
+            return np.zeros_like(frame)
+
+        # Difference from the background estimated from earlier frames
+        if self.method == 'mean':
+            background = (self.background + 0.5).astype(frame.dtype)  # Rounded
+        else:
+            background = self.background.astype(frame.dtype)
+        if self.polarity == 'brighter':
+            out_frame = cv2.subtract(frame, background)  # Negative values are saved as 0
+        elif self.polarity == 'darker':
+            out_frame = cv2.subtract(background, frame)
+        else:
+            out_frame = cv2.absdiff(frame, background)
+
+        self.update(frame)
+
+        return out_frame
+
+    def update(self, frame):
+        """Add a frame to the background"""
+
+        self.n += 1
+        if self.method == 'mean':
+            # Plain average of the first frames, so the first frame doesn't linger in the background
+            cv2.accumulateWeighted(frame, self.background, max(self.learning_rate, 1 / self.n))
+        else:
+            # Move each pixel of the background towards the frame, by at most one step
+            step = self.median_step * (np.iinfo(frame.dtype).max + 1) // 256  # In 16-bit values for 16-bit frames
+            difference = frame.astype(np.int32)
+            difference -= self.background
+            np.clip(difference, -step, step, out=difference)
+            self.background += difference
+
+def backgroundvideo(video, name, method=method, learning_rate=learning_rate, median_step=median_step,
+                    polarity=polarity, timer=None):
+    """Function to subtract the running background from each frame of a video and save it as name
+    --Frames are subtracted in order, reading and writing run in parallel with the subtraction
+    --timer: optional instrument.FileTimer, time spent in each stage is added to it"""
+
+    capture = frame_cache.VideoCapture(video)
+    if not capture.isOpened():
+        raise IOError('Could not open video ' + video)
+
+    # Dimensions, must be exact for videos
+    w = int(np.floor(capture.get(3)))  # float
+    h = int(np.floor(capture.get(4)))  # float
+    fps = capture.get(cv2.CAP_PROP_FPS)  # frames per second
+
+    # Set up video writer object
+    out = video_writer.VideoWriter(name, fps, (w, h), is_color=image_io.iscolor(capture))
+
+    # A single transform thread, each frame depends on the background left by the frame before
+    background = RunningBackground(method, learning_rate, median_step, polarity)
+    frame_engine.processframes(capture, out, background.subtract, workers=1, timer=timer)
+
+    # Finish
+    capture.release()
+    out.release()
+
+def run(dirpath, method=method, learning_rate=learning_rate, median_step=median_step, polarity=polarity,
+        videolist=None):
+    """Function to subtract the background from all videos, saved in a new "Background" folder within dirpath
+    --videolist: videos to process, all .avi files and stacks within dirpath if not provided
+    --Returns the path of the new folder"""
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create a string to indicate operations performed
+    str_rate = str(learning_rate if method == 'mean' else median_step).replace('.', 'p')
+    str_background = method + '_' + str_rate + ('' if polarity == 'absolute' else '_' + polarity)
+    output_folder = os.path.join(dirpath, 'Background ' + str_background.replace('_', ' ') + ', ' + \
+                    now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    if videolist is None:
+        # Create a list of all video files
+        videolist = glob.glob(dirpath + '/*.avi')  # Script only applies to video files, .avi
+        # videolist = glob.glob(dirpath + '/*.mp4')  # .mp4 (Mac OS)
+        # Multi-page .tif files (stacks) are processed as videos, see tiff_stack.py
+        videolist += tiff_stack.splitstacks(sorted(glob.glob(dirpath + '/*.tif')))[1]
+
+    # Time each file if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'subtract_background', {'method': method,
+                                                                         'learning_rate': learning_rate,
+                                                                         'median_step': median_step,
+                                                                         'polarity': polarity})
+
+    # Subtract the background from all videos, save
+    for video in videolist:
+        # String to save video as, .avi (or .tif, see video_writer.py)
+        name = os.path.basename(video).split(".")[0] + '_bg_' + str_background + video_writer.videoextension()
+        # name = os.path.basename(video).split(".")[0] + '_bg_' + str_background + '.mp4'  # .mp4
+
+        timer = report.file(video)
+        backgroundvideo(video, os.path.join(output_folder, name), method, learning_rate, median_step, polarity, timer)
+        report.done(timer, name)
+
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)
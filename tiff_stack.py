@@ -0,0 +1,301 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that read and save multi-page .tif files (stacks) as if they were videos
+--Not a standalone script, used by all scripts that process videos
+--Stacks are read one page at a time, the whole stack is never held in memory
+--Stacks are saved one page at a time as frames are written, set codec to 'tiff' in video_writer.py
+
+Input variables
+--stack_fps: frame rate reported for stacks, .tif files don't record one
+--stack_chunk: number of compressed pages decoded at once
+
+Output files
+--With codec 'tiff', videos are saved as uncompressed multi-page .tif files instead of .avi files
+----Grayscale and 16-bit frames are saved as they are, see color_mode in image_io.py
+
+Some tips from the iCLOTS team:
+--Stacks from confocal and high-speed cameras can be processed directly, no need to convert them to images or videos
+----A .tif file with a single page is treated as an image, a .tif file with several pages as a video
+--Saved stacks are uncompressed, they are larger than .avi files but lossless
+----Stacks are limited to 4 GB, save larger outputs as .avi files
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import struct
+
+import image_io
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Frame rate reported for stacks
+stack_fps = 30
+# Compressed pages decoded at once
+stack_chunk = 16
+
+# File types stacks are saved as and read from
+stack_extensions = ('.tif', '.tiff')
+# Tags read from each page: dimensions, bits, compression, color, strip positions and sizes, layout
+page_tags = {256, 257, 258, 259, 262, 273, 277, 279, 284}
+# struct formats of tag value types: BYTE, SHORT, LONG, LONG8
+tag_types = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}
+
+
+def pagecount(path):
+    """Function to count the pages of a .tif file, 0 if it can't be read"""
+
+    try:
+        return cv2.imcount(path)
+    except cv2.error:
+        return 0
+
+def isstack(path):
+    """Function to check whether a file is a stack, a .tif file with more than one page"""
+
+    return path.lower().endswith(stack_extensions) and pagecount(path) > 1
+
+def splitstacks(imglist):
+    """Function to separate stacks from single images, stacks are processed as videos
+    --Returns the list of images and the list of stacks"""
+
+    stacklist = [img for img in imglist if isstack(img)]
+
+    return [img for img in imglist if img not in stacklist], stacklist
+
+def readpages(path):
+    """Function to read the tags of every page of a .tif file, without reading any pixels
+    --Only tags needed to find and read the pixels are kept
+    --Returns the byte order and a list of dictionaries of tag values by tag number, one per page"""
+
+    pages = []
+    with open(path, 'rb') as f:
+        header = f.read(16)
+        order = '<' if header[:2] == b'II' else '>'
+        if struct.unpack(order + 'H', header[2:4])[0] == 43:  # BigTIFF, 8-byte offsets
+            offset_format, n_format = 'Q', 'Q'
+            offset = struct.unpack(order + 'Q', header[8:16])[0]
+        else:
+            offset_format, n_format = 'I', 'H'
+            offset = struct.unpack(order + 'I', header[4:8])[0]
+        value_size = struct.calcsize(offset_format)
+        entry_size = 4 + 2 * value_size  # Tag, type, count and value or offset of value
+
+        seen = set()
+        while offset and offset not in seen:
+            seen.add(offset)
+            f.seek(offset)
+            n = struct.unpack(order + n_format, f.read(struct.calcsize(n_format)))[0]
+            entries = f.read(n * entry_size)
+            next_offset = struct.unpack(order + offset_format, f.read(value_size))[0]
+
+            tags = {}
+            for i in range(n):
+                entry = entries[i * entry_size:(i + 1) * entry_size]
+                tag, kind = struct.unpack(order + 'HH', entry[:4])
+                if tag not in page_tags or kind not in tag_types:
+                    continue
+                count = struct.unpack(order + offset_format, entry[4:4 + value_size])[0]
+                size = struct.calcsize(tag_types[kind]) * count
+                value = entry[4 + value_size:]
+                if size > value_size:  # Values stored elsewhere in the file
+                    f.seek(struct.unpack(order + offset_format, value)[0])
+                    value = f.read(size)
+                tags[tag] = struct.unpack(order + tag_types[kind] * count, value[:size])
+            pages.append(tags)
+            offset = next_offset
+
+    return order, pages
+
+def israw(tags):
+    """Function to check whether the pixels of a page can be read straight from the file
+    --Uncompressed 8-bit or 16-bit grayscale or RGB pages, as saved by cameras, ImageJ and StackWriter"""
+
+    samples = tags.get(277, (1,))[0]
+    bits = set(tags.get(258, (1,)))
+
+    return (tags.get(259, (1,))[0] == 1 and tags.get(262, (None,))[0] in (1, 2) and samples in (1, 3) and
+            (samples == 1 or tags.get(284, (1,))[0] == 1) and len(bits) == 1 and bits <= {8, 16} and
+            273 in tags and 279 in tags)
+
+class StackCapture:
+    """Reads the pages of a stack in order, used the same way as cv2.VideoCapture
+    --Uncompressed pages are read straight from the file, only the page being read is held in memory
+    --Compressed pages are decoded by OpenCV, stack_chunk at a time"""
+
+    def __init__(self, path, flags=None):
+        self.path = path
+        self.flags = image_io.imreadflags() if flags is None else flags
+        self.pos = 0  # Number of the next page returned by read
+        self.pages = []  # Compressed pages decoded but not yet returned, starting at pos
+
+        try:
+            self.order, self.tags = readpages(path)
+        except (OSError, struct.error):
+            self.order, self.tags = '<', []
+        self.count = len(self.tags)
+        self.raw = self.count > 0 and all(israw(tags) for tags in self.tags)
+        self.file = open(path, 'rb') if self.raw else None
+
+        # Dimensions of the stack, from the first page
+        ret, first = self.read()
+        self.opened = ret
+        self.h, self.w = first.shape[:2] if ret else (0, 0)
+        self.gray = ret and first.ndim == 2  # Single-channel frames, see image_io.iscolor
+        self.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def readraw(self, tags):
+        # Pixels of each strip of the page, in order
+        data = bytearray()
+        for offset, size in zip(tags[273], tags[279]):
+            self.file.seek(offset)
+            data += self.file.read(size)
+
+        w, h, samples = tags[256][0], tags[257][0], tags.get(277, (1,))[0]
+        dtype = np.dtype(self.order + ('u1' if tags[258][0] == 8 else 'u2'))
+        frame = np.frombuffer(data, dtype, w * h * samples).reshape((h, w, samples) if samples > 1 else (h, w))
+        frame = frame.astype(dtype.newbyteorder('='))  # Native byte order, and a frame that can be edited
+        if samples == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)  # OpenCV stores blue, green, red
+
+        # Same channels and bit depth as cv2.imread with the same flags
+        if self.flags == cv2.IMREAD_COLOR:
+            frame = image_io.to8bit(frame)
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+        return frame
+
+    def read(self):
+        if self.pos >= self.count:
+            return False, None
+
+        if self.raw:
+            try:
+                frame = self.readraw(self.tags[self.pos])
+            except (OSError, ValueError):
+                return False, None
+        else:
+            if not self.pages:
+                ret, pages = cv2.imreadmulti(self.path, self.pos, min(stack_chunk, self.count - self.pos),
+                                             flags=self.flags)
+                if not ret or not pages:
+                    return False, None
+                self.pages = list(pages)
+            frame = self.pages.pop(0)
+        self.pos += 1
+
+        return True, frame
+
+    def grab(self):
+        if self.pos >= self.count:
+            return False
+        if self.pages:
+            self.pages.pop(0)
+        self.pos += 1
+
+        return True
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FRAME_WIDTH: self.w,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.h,
+            cv2.CAP_PROP_FPS: stack_fps,
+            cv2.CAP_PROP_FRAME_COUNT: self.count,
+            cv2.CAP_PROP_POS_FRAMES: self.pos,
+        }.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.pos = min(max(int(value), 0), self.count)
+        self.pages = []
+
+        return True
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        self.pages = []
+        if self.file is not None:
+            self.file.close()
+
+def VideoCapture(video):
+    """Function to open a video or a stack for reading, returns an object used the same way as cv2.VideoCapture"""
+
+    if video.lower().endswith(stack_extensions):
+        return StackCapture(video)
+
+    return cv2.VideoCapture(video)
+
+class StackWriter:
+    """Saves frames as the pages of an uncompressed .tif stack, used the same way as cv2.VideoWriter
+    --Each frame is appended to the file as it is written, the whole stack is never held in memory"""
+
+    def __init__(self, name, size, is_color=True):
+        self.name = name
+        self.size = size  # (width, height) of frames
+        self.is_color = is_color
+        self.file = open(name, 'wb')
+        self.file.write(b'II' + struct.pack('<HI', 42, 0))  # Little-endian TIFF, first page offset filled in later
+        self.next_offset = 4  # Position of the offset of the next page, in the header or the last page written
+
+    def write(self, frame):
+        # Every page has the channels the stack was opened with, TIFF stores red, green, blue
+        if self.is_color:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB if frame.ndim == 3 else cv2.COLOR_GRAY2RGB)
+        elif frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frame = np.ascontiguousarray(frame, frame.dtype.newbyteorder('<'))
+        h, w = frame.shape[:2]
+        samples = 1 if frame.ndim == 2 else frame.shape[2]
+        bits = frame.dtype.itemsize * 8
+
+        # Pixels, then the bits of each sample if they don't fit within a tag, then the page's tags
+        data_offset = self.file.seek(0, 2)
+        if data_offset + frame.nbytes + 200 >= 2 ** 32:
+            raise IOError('Stack ' + self.name + ' would be larger than 4 GB, save as .avi instead')
+        self.file.write(frame.tobytes())
+        if samples > 2:
+            bits_offset = self.file.tell()
+            self.file.write(struct.pack('<' + 'H' * samples, *[bits] * samples))
+            bits_value = struct.pack('<I', bits_offset)
+        else:
+            bits_value = struct.pack('<HH', bits, 0)
+        if self.file.tell() % 2:
+            self.file.write(b'\0')  # Pages start on an even position
+
+        tags = [
+            (256, 4, 1, struct.pack('<I', w)),  # ImageWidth
+            (257, 4, 1, struct.pack('<I', h)),  # ImageLength
+            (258, 3, samples, bits_value),  # BitsPerSample
+            (259, 3, 1, struct.pack('<HH', 1, 0)),  # Compression: none
+            (262, 3, 1, struct.pack('<HH', 2 if samples > 1 else 1, 0)),  # Photometric: RGB or grayscale
+            (273, 4, 1, struct.pack('<I', data_offset)),  # StripOffsets
+            (277, 3, 1, struct.pack('<HH', samples, 0)),  # SamplesPerPixel
+            (278, 4, 1, struct.pack('<I', h)),  # RowsPerStrip: whole page in one strip
+            (279, 4, 1, struct.pack('<I', frame.nbytes)),  # StripByteCounts
+            (284, 3, 1, struct.pack('<HH', 1, 0)),  # PlanarConfiguration: samples together
+        ]
+        page_offset = self.file.tell()
+        self.file.write(struct.pack('<H', len(tags)))
+        for tag in tags:
+            self.file.write(struct.pack('<HHI', *tag[:3]) + tag[3])
+        self.file.write(struct.pack('<I', 0))  # No next page yet
+
+        # Link the previous page, or the header, to this page
+        self.file.seek(self.next_offset)
+        self.file.write(struct.pack('<I', page_offset))
+        self.next_offset = page_offset + 2 + 12 * len(tags)
+
+    def isOpened(self):
+        return not self.file.closed
+
+    def release(self):
+        self.file.close()
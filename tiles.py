@@ -0,0 +1,283 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that process very large images (e.g. stitched tile scans) in tiles
+--Not a standalone script, used by rotate.py, resize.py, edit_contrast.py and normalize_intrange.py
+--The output image is computed one tile at a time and written to disk as it is computed
+--Each tile reads only the part of the input it needs, plus a small margin for interpolation
+
+Input variables
+--tile_mode: which images are processed in tiles
+----'auto': .npy images, and other images with at least tile_min_pixels pixels
+----'always': every image, 'off': no image, as in earlier versions
+--tile_min_pixels: images at least this large are processed in tiles in 'auto' mode
+--tile_size: width and height of each tile, in pixels of the output image
+
+Output files
+--The same outputs as the script used
+----.npy images are saved as .npy, other images are saved as .png, as usual
+----A temporary .npy file holds the output while it is computed, it is removed once the output is saved
+
+Some tips from the iCLOTS team:
+--Memory use depends on tile_size, not on image size
+----OpenCV reads .png, .jpg and .tif files whole, save very large images as .npy (numpy.save) to avoid this
+----.npy images are read from disk one tile at a time, the whole image is never held in memory
+--Rotated and resized tiles match the whole image processed at once
+----Rotated pixels may differ by 1 intensity value at most
+----Resized pixels are identical when the resize factor divides the image evenly, e.g. 0.5 of an even width
+----Otherwise reduced pixels are computed from the same weights as cv2.resize, pixels may differ by 1 value at most
+----Increased pixels may differ by 1 intensity value at most
+--Contrast and normalization are applied tile by tile, normalization reads the image twice
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import struct
+import fractions
+
+import image_io
+import instrument
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Which images are processed in tiles
+tile_mode = 'auto'  # ('auto': .npy and very large images, 'always': every image, 'off': no image)
+# Images processed in tiles in 'auto' mode, at least this many pixels
+tile_min_pixels = 10000 * 10000
+# Width and height of each tile, in pixels
+tile_size = 2048
+
+# Margin read around each tile, in pixels, enough for cubic interpolation
+halo = 4
+# Output rows reduced at a time within a tile, by area interpolation when tiles can't be aligned
+band = 64
+
+
+def imagesize(path):
+    """Function to find the (width, height) of an image from its file header, without reading the image
+    --.npy, .png and .tif files are supported, returns None for other files"""
+
+    lower = path.lower()
+    try:
+        if lower.endswith('.npy'):
+            h, w = np.load(path, mmap_mode='r').shape[:2]
+            return w, h
+
+        with open(path, 'rb') as f:
+            header = f.read(24)
+            if lower.endswith('.png') and header[:8] == b'\x89PNG\r\n\x1a\n':
+                return struct.unpack('>II', header[16:24])
+
+            if lower.endswith(('.tif', '.tiff')) and header[:2] in (b'II', b'MM'):
+                order = '<' if header[:2] == b'II' else '>'
+                if struct.unpack(order + 'H', header[2:4])[0] != 42:
+                    return None  # BigTIFF, dimensions not read
+                f.seek(struct.unpack(order + 'I', header[4:8])[0])
+                n_tags = struct.unpack(order + 'H', f.read(2))[0]
+                size = {}
+                for i in range(n_tags):
+                    tag, kind, count, value = struct.unpack(order + 'HHI4s', f.read(12))
+                    if tag in (256, 257):  # ImageWidth, ImageLength, SHORT (3) or LONG values
+                        short = kind == 3
+                        size[tag] = struct.unpack(order + ('H' if short else 'I'), value[:2 if short else 4])[0]
+                if len(size) == 2:
+                    return size[256], size[257]
+    except (OSError, ValueError, struct.error):
+        return None
+
+    return None
+
+def istiled(path):
+    """Function to check whether an image is processed in tiles, from tile_mode
+    --.npy images are always processed in tiles unless tile_mode is 'off', tiles are read from disk as needed"""
+
+    if tile_mode == 'off':
+        return False
+    if tile_mode == 'always' or path.lower().endswith('.npy'):
+        return True
+
+    size = imagesize(path)
+
+    return size is not None and size[0] * size[1] >= tile_min_pixels
+
+def readsource(path):
+    """Function to open an image for reading tiles, .npy images are read from disk as tiles are used"""
+
+    if path.lower().endswith('.npy'):
+        return image_io.loadnpy(path, mmap_mode='r')
+
+    return image_io.readimage(path)
+
+def blocks(h, w, size_y=None, size_x=None):
+    """Function to list the (y0, y1, x0, x1) bounds of the tiles of an h x w image, in rows"""
+
+    size_y = tile_size if size_y is None else size_y
+    size_x = tile_size if size_x is None else size_x
+
+    return [(y0, min(y0 + size_y, h), x0, min(x0 + size_x, w)) for y0 in range(0, h, size_y)
+            for x0 in range(0, w, size_x)]
+
+def warpblock(src, matrix, y0, y1, x0, x1, flags=cv2.INTER_LINEAR):
+    """Function to compute one tile of cv2.warpAffine(src, matrix), reading only the source region it maps from
+    --Returns the (y1 - y0) x (x1 - x0) tile of the output"""
+
+    h, w = src.shape[:2]
+
+    # Source region the corners of the tile map from, with a margin for interpolation
+    inverse = cv2.invertAffineTransform(matrix)
+    corners = np.array([[x0, y0, 1], [x1, y0, 1], [x0, y1, 1], [x1, y1, 1]], np.float64) @ inverse.T
+    sx0 = max(int(np.floor(corners[:, 0].min())) - halo, 0)
+    sx1 = min(int(np.ceil(corners[:, 0].max())) + halo, w)
+    sy0 = max(int(np.floor(corners[:, 1].min())) - halo, 0)
+    sy1 = min(int(np.ceil(corners[:, 1].max())) + halo, h)
+    if sx0 >= sx1 or sy0 >= sy1:
+        return np.zeros((y1 - y0, x1 - x0) + src.shape[2:], src.dtype)  # Tile is entirely outside the source
+
+    # Same matrix, moved to the origin of the source region and of the tile
+    tile_matrix = matrix.copy()
+    tile_matrix[:, 2] += matrix[:, :2] @ [sx0, sy0] - [x0, y0]
+
+    return cv2.warpAffine(np.ascontiguousarray(src[sy0:sy1, sx0:sx1]), tile_matrix, (x1 - x0, y1 - y0), flags=flags)
+
+def resizesteps(w, h, w_n, h_n):
+    """Function to find tile dimensions for resizing a w x h image to w_n x h_n
+    --Tiles are aligned with whole source pixels where the resize factor allows, so each tile is resized exactly
+    --Returns (tile height, tile width, aligned)"""
+
+    fx = fractions.Fraction(w_n, w)
+    fy = fractions.Fraction(h_n, h)
+    if fx.numerator > tile_size or fy.numerator > tile_size:
+        return tile_size, tile_size, False
+
+    return tile_size // fy.numerator * fy.numerator, tile_size // fx.numerator * fx.numerator, True
+
+def resizeblock(src, w_n, h_n, y0, y1, x0, x1, aligned=True, interpolation=cv2.INTER_AREA):
+    """Function to compute one tile of cv2.resize(src, (w_n, h_n)), reading only the source region it maps from
+    --aligned: tile bounds are multiples of the numerator of the resize factor, see resizesteps
+    --Unaligned tiles are computed from the same weights (area) or source positions (other interpolation) as cv2.resize
+    --Returns the (y1 - y0) x (x1 - x0) tile of the output"""
+
+    h, w = src.shape[:2]
+    fx = fractions.Fraction(w_n, w)
+    fy = fractions.Fraction(h_n, h)
+
+    if aligned:
+        # Tile starts on a whole source pixel, resizing the source region gives exactly the pixels of the tile
+        sx0 = x0 * fx.denominator // fx.numerator
+        sy0 = y0 * fy.denominator // fy.numerator
+        mx = fx.denominator * -(-halo // fx.denominator)  # Margin, whole multiples of the denominator
+        my = fy.denominator * -(-halo // fy.denominator)
+        rx0 = max(sx0 - mx, 0)
+        ry0 = max(sy0 - my, 0)
+        rx1 = min(-(-x1 * fx.denominator // fx.numerator) + mx, w)
+        ry1 = min(-(-y1 * fy.denominator // fy.numerator) + my, h)
+        region = cv2.resize(np.ascontiguousarray(src[ry0:ry1, rx0:rx1]), (0, 0), fx=float(fx), fy=float(fy),
+                            interpolation=interpolation)
+        ox = (sx0 - rx0) * fx.numerator // fx.denominator
+        oy = (sy0 - ry0) * fy.numerator // fy.denominator
+        return region[oy:oy + y1 - y0, ox:ox + x1 - x0]
+
+    if interpolation == cv2.INTER_AREA and fx <= 1 and fy <= 1:
+        # Otherwise weigh each source pixel by its overlap with each output pixel, as cv2.resize does
+        sx0, ix, wx = areaweights(w, w_n, x0, x1)
+        sy0, iy, wy = areaweights(h, h_n, y0, y1)
+        layers = (1,) * (src.ndim - 2)
+        out_tile = np.empty((y1 - y0, x1 - x0) + src.shape[2:], src.dtype)
+        for b0 in range(0, y1 - y0, band):
+            # A band of output rows at a time, only its source rows are held as floats
+            r0 = iy[b0:b0 + band].min()
+            r1 = iy[b0:b0 + band].max() + 1
+            rows = np.asarray(src[sy0 + r0:sy0 + r1, sx0:sx0 + ix.max() + 1], np.float32)
+            across = sum(rows[:, ix[:, t]] * wx[:, t].reshape((1, -1) + layers) for t in range(ix.shape[1]))
+            down = sum(across[iy[b0:b0 + band, t] - r0] * wy[b0:b0 + band, t].reshape((-1, 1) + layers)
+                       for t in range(iy.shape[1]))
+            if np.issubdtype(src.dtype, np.integer):
+                limits = np.iinfo(src.dtype)
+                down = np.clip(np.rint(down), limits.min, limits.max)
+            out_tile[b0:b0 + band] = down
+        return out_tile
+
+    # Position within the source of each output pixel, as cv2.resize maps output to source pixels
+    sx0 = max(int((x0 + 0.5) / fx - 0.5) - halo, 0)
+    sy0 = max(int((y0 + 0.5) / fy - 0.5) - halo, 0)
+    sx1 = min(int(np.ceil((x1 + 0.5) / fx)) + halo, w)
+    sy1 = min(int(np.ceil((y1 + 0.5) / fy)) + halo, h)
+    region = np.ascontiguousarray(src[sy0:sy1, sx0:sx1])
+    inverse_matrix = np.array([[1 / float(fx), 0, (x0 + 0.5) / float(fx) - 0.5 - sx0],
+                               [0, 1 / float(fy), (y0 + 0.5) / float(fy) - 0.5 - sy0]])
+
+    return cv2.warpAffine(region, inverse_matrix, (x1 - x0, y1 - y0), flags=interpolation | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def areaweights(n, n_n, i0, i1):
+    """Function to find the source pixels and weights of output pixels [i0, i1) of an area resize from n to n_n
+    --Same weights as cv2.resize with INTER_AREA, each output pixel averages the source pixels it covers
+    --Returns the first source pixel used, and (i1 - i0) x (source pixels per output pixel) arrays of source
+    pixels, counted from the first, and of their weights"""
+
+    scale = n / n_n
+    first = int(i0 * scale)
+    pixels = []
+    for i in range(i0, i1):
+        # Source interval [start, end) covered by output pixel i, partly covered pixels at either end
+        start = i * scale
+        end = start + scale
+        width = min(scale, n - start)
+        s1 = min(int(np.ceil(start)), n - 1)
+        s2 = min(int(np.floor(end)), n - 1)
+        s1 = min(s1, s2)
+        covered = [(s, 1 / width) for s in range(s1, s2)]
+        if s1 - start > 1e-3:
+            covered.insert(0, (s1 - 1, (s1 - start) / width))
+        if end - s2 > 1e-3:
+            covered.append((s2, min(min(end - s2, 1), width) / width))
+        pixels.append(covered)
+
+    # Same number of source pixels for every output pixel, unused ones have no weight
+    k = max(len(covered) for covered in pixels)
+    index = np.array([[s - first for s, weight in covered] + [covered[0][0] - first] * (k - len(covered))
+                      for covered in pixels])
+    weights = np.array([[weight for s, weight in covered] + [0] * (k - len(covered)) for covered in pixels],
+                       np.float32)
+
+    return first, index, weights
+
+def processimage(img, name, function, size=None, dtype=None, timer=None, src=None):
+    """Function to apply function(src, dst) to a very large image, dst is written to disk as it is filled
+    --size: (width, height) of the output, None keeps the size of img
+    --dtype: bit depth of the output, None keeps the bit depth of img
+    --.npy images are saved as .npy in place of name's extension, other images as name
+    --timer: optional instrument.FileTimer, time spent reading, transforming and saving is added to it
+    --src: img already opened with readsource, e.g. to save several outputs from one read
+    --Returns the path the output was saved to"""
+
+    if src is None:
+        src = instrument.timed(timer, 'decode', readsource, img)
+    w, h = (src.shape[1], src.shape[0]) if size is None else size
+    dtype = src.dtype if dtype is None else dtype
+
+    if img.lower().endswith('.npy'):
+        name = os.path.splitext(name)[0] + '.npy'
+        scratch = name  # Output is written in place
+    else:
+        scratch = name + '.tiles.npy'
+
+    dst = np.lib.format.open_memmap(scratch, mode='w+', dtype=dtype, shape=(h, w) + src.shape[2:])
+    try:
+        instrument.timed(timer, 'transform', function, src, dst)
+        dst.flush()
+        if scratch != name:
+            if not instrument.timed(timer, 'encode', cv2.imwrite, name, dst):
+                raise IOError('Could not save image ' + name)
+    finally:
+        del dst
+        if scratch != name and os.path.exists(scratch):
+            os.remove(scratch)
+
+    return name
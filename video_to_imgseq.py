@@ -9,7 +9,14 @@ Script function that converts a single video to a sequence of images
 --No other changes are made to the video frames
 ----Videos defaults to .avi input, but option for .mp4 is contained within commented code
 
-No input variables
+Input variables
+--image_format: format frames are saved as
+----'png': compressed without loss, smallest files
+----'tif': uncompressed, much faster to save than .png but larger files
+----'npy': raw numpy array, fastest to save and load in Python, not viewable as an image
+--png_compression: .png compression level, 0 (fastest, largest files) to 9 (slowest, smallest files)
+--start_frame, end_frame: first and last frame saved, None saves from the first or to the last frame
+--frame_stride: every frame_stride-th frame is saved, 1 saves every frame
 
 Output files
 --A series of images within a directory titled with the original video name
@@ -18,38 +25,122 @@ Some tips from the iCLOTS team:
 --This script is useful for .avi files that must be presented to iCLOTS as time series
 --Images are returned named with the video name plus frame number
 ----Up to 5 preceding zeros are used to number frames sequentially
-------Code will not work as-is on >99,999 frames, but iCLOTS cannot handle that many images anyways
---Images are saved as .png files to avoid unnecessary compression
+------Videos with >99,999 frames use more digits, but iCLOTS cannot handle that many images anyways
+--Images are saved as .png files by default to avoid unnecessary compression
+----Saving .png files is oftentimes much slower than reading the video, frames are saved by several threads
+----Low png_compression values or the 'tif' format speed up saving at the cost of disk space
 
 """
 
 # Import
 import cv2
-from tkinter import filedialog
+import numpy as np
 import os
 import datetime
 
-# Select single file, .avi only
-# videoname = filedialog.askopenfilename(filetypes=[(".avi files", "*.avi")])  # .avi
-videoname = filedialog.askopenfilename(filetypes=[(".mp4 files", "*.mp4")])  # .mp4
-dirpath = os.path.dirname(videoname)
-name = os.path.basename(videoname).split(".")[0]
-
-# Create a directory for saved results including time at which operation was performed
-now = datetime.datetime.now()
-# Create strings to indicate operations performed
-output_folder = os.path.join(dirpath, name + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
-os.mkdir(output_folder)
-os.chdir(output_folder)
-
-capture = cv2.VideoCapture(videoname)  # Read the video
-length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
-
-# Save frames
-success, frame = capture.read()
-count = 0
-while success and count < length-1:  # Length - 1 prevents "empty frame" error at end of video
-    image_name = name + '_frame_' + str(count).zfill(5) + '.png'
-    success, image = capture.read()
-    cv2.imwrite(image_name, image)  # save frame as .png file
-    count += 1
+import crop_video
+import frame_cache
+import image_io
+import instrument
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Format frames are saved as
+image_format = 'png'  # ('png', 'tif': uncompressed, 'npy': numpy array)
+png_compression = 3  # (0: fastest, 9: smallest files)
+# Frames saved
+start_frame = None  # (None: from the first frame)
+end_frame = None  # (None: to the last frame)
+frame_stride = 1  # (1: every frame, n: every nth frame)
+
+# Threads saving frames
+workers = None  # (None: one per CPU core)
+
+
+def saveframe(image_name, image, image_format='png', png_compression=png_compression):
+    """Function to save a single frame in the chosen format"""
+
+    if image_format == 'npy':
+        np.save(image_name, image)
+    elif image_format == 'tif':
+        cv2.imwrite(image_name, image, [cv2.IMWRITE_TIFF_COMPRESSION, 1])  # 1: no compression
+    else:
+        cv2.imwrite(image_name, image, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+
+def videotoimgseq(videoname, name, image_format='png', png_compression=png_compression, start_frame=None,
+                  end_frame=None, frame_stride=1, workers=None, timer=None):
+    """Function to save frames of a video as a series of images in the current directory
+    --Frames are read in order and saved by a pool of threads
+    --timer: optional instrument.FileTimer, time spent reading and saving is added to it
+    --Returns the number of frames saved"""
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    capture = instrument.wrapcapture(timer, frame_cache.VideoCapture(videoname))  # Read the video
+    length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    digits = max(5, len(str(length)))  # Preceding zeros, frames sort in order
+
+    count = 0  # Count gives frame number
+    if start_frame is not None and crop_video.seekframe(capture, start_frame):
+        count = start_frame
+
+    saved = 0
+    with image_io.ImageWriter(workers, saveframe) as writer:  # At most a few frames per thread held in memory
+        while end_frame is None or count <= end_frame:
+            if (count - (start_frame or 0)) % frame_stride != 0:
+                if capture.grab() == False:  # Skip frames without converting them
+                    break
+                count += 1
+                continue
+
+            success, image = capture.read()
+            if success == False:
+                break
+
+            image_name = name + '_frame_' + str(count).zfill(digits) + '.' + image_format
+            writer.write(image_name, image, image_format, png_compression, timer=timer)
+            saved += 1
+            count += 1
+
+    capture.release()
+
+    return saved
+
+def run(videoname, image_format=image_format, png_compression=png_compression, start_frame=start_frame,
+        end_frame=end_frame, frame_stride=frame_stride, workers=workers, output_dir=None):
+    """Function to save the frames of a video, in a new folder titled with the video name
+    --output_dir: directory the new folder is created in, the directory of the video if not provided
+    --Returns the path of the new folder"""
+
+    dirpath = os.path.dirname(videoname) if output_dir is None else output_dir
+    name = os.path.basename(videoname).split(".")[0]
+
+    # Create a directory for saved results including time at which operation was performed
+    now = datetime.datetime.now()
+    # Create strings to indicate operations performed
+    output_folder = os.path.join(dirpath, name + ', ' + now.strftime("%m_%d_%Y, %H_%M_%S"))
+    os.mkdir(output_folder)
+
+    # Time the export if instrument.py is enabled
+    report = instrument.RunReport(output_folder, 'video_to_imgseq', {
+        'image_format': image_format, 'png_compression': png_compression, 'start_frame': start_frame,
+        'end_frame': end_frame, 'frame_stride': frame_stride})
+    timer = report.file(videoname)
+
+    # Save frames
+    saved = videotoimgseq(videoname, os.path.join(output_folder, name), image_format, png_compression, start_frame,
+                          end_frame, frame_stride, workers, timer)
+
+    report.done(timer, sorted(os.listdir(output_folder)), frames=saved)
+    report.save()
+
+    return output_folder
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a file interactively
+
+    # Select single file, .avi only
+    # videoname = filedialog.askopenfilename(filetypes=[(".avi files", "*.avi")])  # .avi
+    videoname = filedialog.askopenfilename(filetypes=[(".mp4 files", "*.mp4")])  # .mp4
+    run(videoname)
@@ -0,0 +1,198 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Helper functions that open video writers with a chosen codec
+--Not a standalone script, used by all scripts that save videos
+--Checks the codec is supported by the installed OpenCV, and uses a similar codec if it isn't
+
+Input variables
+--codec: codec videos are saved with
+----'XVID': lossy, small files (default, as in earlier versions)
+----'MJPG': lossy, similar size to XVID, faster to save
+----'FFV1': lossless, larger files, slowest to save
+----'HFYU': lossless (HuffYUV), larger files than FFV1, much faster to save
+----'raw': uncompressed, largest files, fastest to save, color detail is halved (YUV 4:2:0)
+----'mp4v': lossy, for .mp4 files (see commented code in each script)
+----'tiff': lossless, uncompressed multi-page .tif files (stacks) instead of .avi files, see tiff_stack.py
+------Grayscale and 16-bit frames are kept, other codecs save 8-bit frames
+
+Some tips from the iCLOTS team:
+--Lossless codecs are best for intermediate files, e.g. when one script's output is another script's input
+----Each lossy save adds compression artifacts that may be mistaken for cells
+--Check the codecs supported on your computer and their speed with benchmark.py (codecs parameter)
+--Files saved with any of these codecs are .avi files iCLOTS can analyze
+----Lossless and raw files can be several GB, check available disk space
+--Grayscale videos are saved single-channel, FFV1 and raw keep grayscale frames exactly
+
+"""
+
+# Import
+import cv2
+import numpy as np
+import os
+import time
+import shutil
+import tempfile
+
+import image_io
+import tiff_stack
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Codec videos are saved with
+codec = 'XVID'  # ('XVID', 'MJPG', 'FFV1': lossless, 'HFYU': lossless, 'raw': uncompressed, 'tiff': .tif stacks)
+
+# Four character code of each codec, 0 saves uncompressed frames
+CODECS = {
+    'XVID': 'XVID',
+    'MJPG': 'MJPG',
+    'FFV1': 'FFV1',
+    'HFYU': 'HFYU',
+    'raw': 0,
+    'mp4v': 'mp4v',
+    'tiff': None,  # Saved by tiff_stack.py, not OpenCV
+}
+# Codecs tried, in order, if a codec isn't supported, lossless codecs fall back to other lossless codecs
+FALLBACKS = {
+    'XVID': ['MJPG', 'raw'],
+    'MJPG': ['XVID', 'raw'],
+    'FFV1': ['HFYU', 'raw'],
+    'HFYU': ['FFV1', 'raw'],
+    'raw': ['HFYU', 'FFV1'],
+    'mp4v': ['XVID', 'MJPG', 'raw'],
+    'tiff': [],
+}
+
+# Codecs already checked, True if supported
+supported_codecs = {}
+
+
+def fourcc(video_codec):
+    """Function to find the four character code OpenCV uses for video_codec"""
+
+    code = CODECS[video_codec]
+
+    return 0 if code == 0 else cv2.VideoWriter_fourcc(*code)
+
+def supported(video_codec):
+    """Function to check whether the installed OpenCV can save videos with video_codec, by saving a short test video"""
+
+    if video_codec == 'tiff':
+        return True  # Doesn't depend on OpenCV
+    if video_codec not in supported_codecs:
+        folder = tempfile.mkdtemp(prefix='iclots_codec_')
+        name = os.path.join(folder, 'test.mp4' if video_codec == 'mp4v' else 'test.avi')
+        try:
+            out = cv2.VideoWriter(name, fourcc(video_codec), 10, (64, 64))
+            ok = out.isOpened()
+            if ok:
+                out.write(np.zeros((64, 64, 3), np.uint8))
+            out.release()
+            supported_codecs[video_codec] = ok and os.path.getsize(name) > 0
+        except cv2.error:
+            supported_codecs[video_codec] = False
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return supported_codecs[video_codec]
+
+def choosecodec(video_codec=None):
+    """Function to find video_codec, or the first supported fallback if it isn't supported
+    --video_codec: None uses codec, set at the top of this file"""
+
+    if video_codec is None:
+        video_codec = codec
+
+    for candidate in [video_codec] + FALLBACKS[video_codec]:
+        if supported(candidate):
+            if candidate != video_codec:
+                print('Codec ' + video_codec + ' is not supported by this OpenCV, saving videos with ' + candidate)
+            return candidate
+
+    raise IOError('No codec similar to ' + video_codec + ' is supported by this OpenCV')
+
+def videoextension(video_codec=None):
+    """Function to find the file extension videos saved with video_codec need, '.tif' for stacks, '.avi' otherwise
+    --video_codec: None uses codec, set at the top of this file"""
+
+    if video_codec is None:
+        video_codec = codec
+
+    return '.tif' if video_codec == 'tiff' else '.avi'
+
+class EightBitWriter:
+    """cv2.VideoWriter that converts 16-bit frames (e.g. from 16-bit stacks) to 8-bit before saving them"""
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, frame):
+        self.out.write(image_io.to8bit(frame))
+
+    def __getattr__(self, attr):
+        return getattr(self.out, attr)
+
+def VideoWriter(name, fps, size, video_codec=None, is_color=True):
+    """Function to open a video writer saving name with video_codec, or a similar codec if it isn't supported
+    --size: (width, height) of frames, video_codec: None uses codec, set at the top of this file
+    --is_color: False saves single-channel (grayscale) frames, see image_io.py
+    --Returns an opened writer used the same way as cv2.VideoWriter"""
+
+    video_codec = choosecodec(video_codec)
+    if video_codec == 'tiff':
+        return tiff_stack.StackWriter(name, size, is_color)
+
+    out = cv2.VideoWriter(name, fourcc(video_codec), fps, size, is_color)
+    if not out.isOpened():
+        raise IOError('Could not open ' + name + ' for writing')
+
+    return EightBitWriter(out)
+
+def benchmarkcodecs(frames, fps=30, codecs=None):
+    """Function to measure how fast each codec saves frames, and how large and how exact the saved video is
+    --frames: list of frames of a sample clip
+    --codecs: codecs compared, None compares all supported codecs
+    --Returns a dictionary of results by codec"""
+
+    if codecs is None:
+        codecs = [c for c in CODECS if c != 'mp4v']
+
+    h, w = frames[0].shape[:2]
+    results = {}
+    folder = tempfile.mkdtemp(prefix='iclots_codec_')
+    try:
+        for c in codecs:
+            if not supported(c):
+                results[c] = None
+                continue
+            name = os.path.join(folder, c + videoextension(c))
+
+            start = time.perf_counter()
+            out = VideoWriter(name, fps, (w, h), c)
+            for frame in frames:
+                out.write(frame)
+            out.release()
+            seconds = time.perf_counter() - start
+
+            # Largest difference between a saved frame and the original, 0 for lossless codecs
+            capture = tiff_stack.VideoCapture(name)
+            max_error = 0
+            for frame in frames:
+                ret, saved = capture.read()
+                if ret == False:
+                    break
+                max_error = max(max_error, int(cv2.absdiff(saved, frame).max()))
+            capture.release()
+
+            results[c] = {
+                'fps': len(frames) / seconds,
+                'mb': os.path.getsize(name) / 1024 ** 2,
+                'max_error': max_error,
+            }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return results
@@ -0,0 +1,451 @@
+"""iCLOTS is a free software created for the analysis of common hematology workflow image data
+
+Author: Meredith Fay, Lam Lab, Georgia Institute of Technology and Emory University
+Last updated: 2022-07-12
+This script corresponds to tools available in version 1.0b1, more recent implementations of tools
+may be available within the iCLOTS software and in source code at github.com/iCLOTS
+
+Script function that applies the pipeline.py operations to all images (.jpg, .png, .tif, .npy) and videos (.avi)
+within a selected directory and its subfolders, shared between any number of processes and computers
+--Each file is a task, workers claim tasks through lock files kept on the shared drive
+--Every computer runs the same command on the same directory, all of them join the same queue
+--No server is needed, only a drive every computer can read and write (e.g. NFS or SMB)
+
+Input variables
+--workers: number of worker processes started on this computer, None uses one per CPU core
+--stages, start_frame, end_frame: operations applied to each file, see pipeline.py
+--lease_seconds: a task whose worker hasn't sent a heartbeat for this long is taken over by another worker
+--heartbeat_seconds: how often each worker confirms it is still processing its task
+--max_attempts: a task taken over this many times (e.g. it crashes every computer) is marked as failed
+
+Output files
+--All images or videos with all operations applied, provided within a "Queue" folder within the original directory
+----Files within subfolders are saved within the same subfolders of the "Queue" folder
+----Videos default to .avi save
+----iCLOTS analyzes only .avi files
+--A hidden ".iclots_queue" folder within the original directory holds the queue
+----queue.json: stages and settings used by every worker, tasks.json: every file to process
+----leases: a lock file for each task being processed, done and failed: a record of each finished task
+--A summary of files processed successfully and files that failed is printed once every task is finished
+
+Some tips from the iCLOTS team:
+--e.g. on each computer: python cli.py queue "/mnt/shared/experiment 1" --stages stages.json
+----The first computer lists the files and creates the queue, the others join it
+----Computers can join or stop at any time, tasks of a stopped computer are taken over after lease_seconds
+----Workers with nothing left to claim wait for the last tasks of other computers, ready to take them over
+--Running the same command again once every task is finished only prints the summary
+----Files added to the directory after the queue was created are not included
+----Delete the ".iclots_queue" folder to process the directory again
+--Codec, color_mode and tile_mode are chosen by the computer that creates the queue, every worker uses them
+--Computer clocks don't need to agree, leases are timed with the clock of the shared drive
+--Outputs are saved under a hidden name and renamed once finished, a stopped worker never leaves a partial output
+--Try several workers on one computer and a local folder first, e.g. workers=4
+
+"""
+
+# Import
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import socket
+import datetime
+import threading
+import concurrent.futures
+
+import batch
+import image_io
+import instrument
+import manifest
+import pipeline
+import tiff_stack
+import tiles
+import video_writer
+
+# IMPORTANT: PARAMETERS TO EDIT
+# Number of worker processes on this computer
+workers = None  # (None: one per CPU core)
+# Operations applied to each frame, in order, see pipeline.py
+stages = pipeline.stages
+# First and last frame to be retained (videos only)
+start_frame = pipeline.start_frame
+end_frame = pipeline.end_frame
+# Seconds without a heartbeat before a task is taken over, and seconds between heartbeats
+lease_seconds = 300
+heartbeat_seconds = 30
+# Times a task is attempted before it is marked as failed
+max_attempts = 3
+
+# Name of the folder queues are kept in, within the selected directory
+queue_name = '.iclots_queue'
+# Seconds between checks for tasks of stopped workers, once every task has been claimed
+poll_seconds = 10
+# Output folders of earlier runs end with a time stamp, their files are not inputs
+output_pattern = re.compile(r', \d\d_\d\d_\d{4}, \d\d_\d\d_\d\d$')
+
+
+def findfiles(dirpath):
+    """Function to list all images (.png, .jpg, .tif, .npy) and videos (.avi) within dirpath and its subfolders
+    --Hidden folders and output folders of earlier runs are skipped
+    --Returns the list of images and the list of videos"""
+
+    imglist = []
+    videolist = []
+    for root, dirs, files in os.walk(dirpath):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and not output_pattern.search(d))
+        for f in sorted(files):
+            if f.lower().endswith(('.png', '.jpg', '.tif', '.npy')):
+                imglist.append(os.path.join(root, f))
+            elif f.lower().endswith('.avi'):
+                videolist.append(os.path.join(root, f))
+
+    return imglist, videolist
+
+def savejson(path, data):
+    """Function to save data as a .json file, other workers never see a partly written file"""
+
+    tmp = path + '.' + uuid.uuid4().hex + '.tmp'  # Unique across computers, process ids are not
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+def loadjson(path):
+    """Function to read a .json file, None if it doesn't exist or is still being written"""
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def queuedir(dirpath, settings):
+    """Function to find the folder the queue of dirpath is kept in
+    --Every computer running the same stages and settings on the same directory finds the same folder"""
+
+    return os.path.join(dirpath, queue_name, manifest.taskkey(None, 'queue', settings))
+
+def createqueue(dirpath, queue_dir, settings, imglist, videolist):
+    """Function to create the queue of dirpath, one task per file, unless another worker already did
+    --The queue is written to a temporary folder then renamed, workers never see a partly written queue"""
+
+    # Create a directory for saved results including time at which the queue was created
+    now = datetime.datetime.now()
+    # Create a string to indicate operations performed
+    str_stages = pipeline.stagestring(settings['stages'])
+    output_folder = 'Queue, ' + now.strftime("%m_%d_%Y, %H_%M_%S")
+
+    # Multi-page .tif files (stacks) are processed frame by frame, as videos, see tiff_stack.py
+    imglist, stacklist = tiff_stack.splitstacks(imglist)
+    videolist = videolist + stacklist
+
+    # Paths are relative to dirpath, computers may reach the shared drive through different paths
+    tasks = []
+    for kind, paths, extension in [('image', imglist, '.png'), ('video', videolist, video_writer.videoextension())]:
+        for path in paths:
+            folder = os.path.dirname(os.path.relpath(path, dirpath))
+            if folder.startswith('..'):
+                folder = ''  # Files outside dirpath are saved at the top of the output folder
+            name = os.path.basename(path).split(".")[0] + '_' + str_stages + extension
+            tasks.append({'id': str(len(tasks)).zfill(6), 'kind': kind, 'size': batch.filesize(path),
+                          'file': os.path.relpath(path, dirpath), 'output': os.path.join(output_folder, folder, name)})
+
+    tmp = queue_dir + '.' + workertoken() + '.tmp'
+    for folder in ['leases', 'done', 'failed', 'clock']:
+        os.makedirs(os.path.join(tmp, folder))
+    savejson(os.path.join(tmp, 'tasks.json'), tasks)
+    savejson(os.path.join(tmp, 'queue.json'), dict(settings, output_folder=output_folder,
+                                                   date=now.isoformat()))
+    try:
+        os.rename(tmp, queue_dir)
+    except OSError:
+        shutil.rmtree(tmp)  # Another worker created the queue first, its queue is used
+        return
+    os.makedirs(os.path.join(dirpath, output_folder), exist_ok=True)
+
+def workertoken():
+    """Function to create a name unique to this worker, on any computer"""
+
+    return socket.gethostname() + '_' + str(os.getpid()) + '_' + uuid.uuid4().hex[:8]
+
+def servertime(queue_dir, token):
+    """Function to read the current time of the shared drive, from a file whose modification time is set to now
+    --Lease ages are measured with this clock, computers whose clocks disagree still agree on stale leases"""
+
+    path = os.path.join(queue_dir, 'clock', token)
+    if not os.path.exists(path):
+        open(path, 'w').close()
+    os.utime(path)  # Set by the shared drive to its own time
+
+    return os.stat(path).st_mtime
+
+def leasepath(queue_dir, task_id):
+    """Function to find the lock file of a task"""
+
+    return os.path.join(queue_dir, 'leases', task_id + '.lock')
+
+def claim(queue_dir, task_id, token, attempt=1):
+    """Function to try to claim a task, returns True if this worker now holds its lease
+    --Lock files are created exclusively, only one worker can create each lock file"""
+
+    try:
+        fd = os.open(leasepath(queue_dir, task_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'worker': token, 'attempt': attempt}, f)
+
+    return True
+
+def reclaim(queue_dir, task_id, token, now):
+    """Function to remove the lease of a task whose worker stopped sending heartbeats
+    --The lock file is renamed first, only one worker can rename it
+    --now: current time of the shared drive, see servertime
+    --Returns the number of attempts already made at the task, None if the lease isn't stale"""
+
+    lock = leasepath(queue_dir, task_id)
+    try:
+        if now - os.stat(lock).st_mtime < lease_seconds:
+            return None
+    except FileNotFoundError:
+        return 0
+    stale = lock + '.' + token + '.stale'
+    try:
+        os.rename(lock, stale)
+    except FileNotFoundError:
+        return None  # Another worker took it over first
+
+    # Another worker may have taken the task over and claimed it again since the lease was checked, if so give it back
+    if now - os.stat(stale).st_mtime < lease_seconds:
+        try:
+            os.link(stale, lock)
+        except OSError:
+            pass
+        os.remove(stale)
+        return None
+    lease = loadjson(stale)
+    os.remove(stale)
+
+    return 1 if lease is None else lease['attempt']
+
+class Lease:
+    """Lease of a task held by this worker, kept alive by a heartbeat thread until released"""
+
+    def __init__(self, queue_dir, task_id, token):
+        self.lock = leasepath(queue_dir, task_id)
+        self.token = token
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.thread.start()
+
+    def held(self):
+        """True if this worker still holds the lease, False if another worker took the task over"""
+
+        lease = loadjson(self.lock)
+
+        return lease is not None and lease['worker'] == self.token
+
+    def heartbeat(self):
+        while not self.stopped.wait(heartbeat_seconds):
+            if not self.held():
+                return
+            try:
+                os.utime(self.lock)
+            except OSError:
+                pass  # Shared drive briefly unavailable, the next heartbeat tries again
+
+    def release(self):
+        self.stopped.set()
+        self.thread.join()
+        if self.held():
+            os.remove(self.lock)
+
+def applysettings(settings):
+    """Function to use the codec, color mode and tile mode of the queue in this process"""
+
+    video_writer.codec = settings['codec']
+    image_io.color_mode = settings['color_mode']
+    tiles.tile_mode = settings['tile_mode']
+
+def processtask(dirpath, queue_dir, settings, task, lease, timing=False):
+    """Function to apply every stage to the file of a task and record it as done or failed
+    --The output is saved under a hidden name first, and renamed only if this worker still holds the lease"""
+
+    path = os.path.join(dirpath, task['file'])
+    output = os.path.join(dirpath, task['output'])
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    partial = os.path.join(os.path.dirname(output), '.' + lease.token + '_' + os.path.basename(output))
+
+    start = time.perf_counter()
+    timer = instrument.FileTimer(path) if timing else None
+    try:
+        if task['kind'] == 'image':
+            pipeline.processimage(path, partial, settings['stages'], timer)
+        else:
+            pipeline.processvideo(path, partial, settings['stages'], settings['start_frame'], settings['end_frame'],
+                                  timer=timer)
+        error = None
+    except Exception as e:  # A failed file is recorded, the worker moves on to the next task
+        error = type(e).__name__ + ': ' + str(e)
+
+    try:
+        if not lease.held():
+            return  # Another worker took the task over, its output is kept
+        if error is None and os.path.exists(partial):
+            os.replace(partial, output)
+        record = {'file': task['file'], 'output': task['output'], 'success': error is None, 'error': error,
+                  'seconds': time.perf_counter() - start, 'frames': None if timer is None else timer.frames,
+                  'stage_seconds': None if timer is None else timer.seconds, 'worker': lease.token}
+        savejson(os.path.join(queue_dir, 'done' if error is None else 'failed', task['id'] + '.json'), record)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def finishedtasks(queue_dir):
+    """Function to find the ids of every task recorded as done or failed"""
+
+    return {f[:-len('.json')] for folder in ['done', 'failed'] for f in os.listdir(os.path.join(queue_dir, folder))
+            if f.endswith('.json')}
+
+def isfinished(queue_dir, task_id):
+    """Function to check whether a single task is recorded as done or failed, without listing every task"""
+
+    return any(os.path.exists(os.path.join(queue_dir, folder, task_id + '.json')) for folder in ['done', 'failed'])
+
+def work(dirpath, queue_dir, timing=False):
+    """Function run by each worker, claims and processes tasks until every task of the queue is finished
+    --Largest tasks are claimed first, as in batch.py
+    --Tasks held by other workers are taken over once their lease is stale
+    --timing: also time each stage of each file, see instrument.py
+    --Returns the number of tasks this worker finished"""
+
+    settings = loadjson(os.path.join(queue_dir, 'queue.json'))
+    applysettings(settings)
+    tasks = sorted(loadjson(os.path.join(queue_dir, 'tasks.json')), key=lambda task: task['size'], reverse=True)
+    token = workertoken()
+
+    n_finished = 0
+    finished = finishedtasks(queue_dir)  # Listed again only when no task can be claimed, not for every claim
+    try:
+        while True:
+            pending = [task for task in tasks if task['id'] not in finished]
+            if not pending:
+                break
+
+            # Claim a task no other worker holds, otherwise take over a task whose worker stopped
+            leased = {f[:-len('.lock')] for f in os.listdir(os.path.join(queue_dir, 'leases')) if f.endswith('.lock')}
+            claimed = None
+            for task in pending:
+                if task['id'] not in leased and claim(queue_dir, task['id'], token):
+                    claimed = task
+                    break
+            if claimed is None:
+                # Tasks still held may have been finished by other workers since the last listing
+                finished = finishedtasks(queue_dir)
+                pending = [task for task in pending if task['id'] not in finished]
+                if not pending:
+                    break
+                now = servertime(queue_dir, token)
+                for task in pending:
+                    attempts = reclaim(queue_dir, task['id'], token, now)
+                    if attempts is None:
+                        continue
+                    if attempts >= max_attempts:
+                        savejson(os.path.join(queue_dir, 'failed', task['id'] + '.json'),
+                                 {'file': task['file'], 'output': task['output'], 'success': False,
+                                  'error': 'Worker stopped ' + str(attempts) + ' times while processing file',
+                                  'seconds': None, 'frames': None, 'stage_seconds': None, 'worker': None})
+                        finished.add(task['id'])
+                        continue
+                    if claim(queue_dir, task['id'], token, attempts + 1):
+                        claimed = task
+                        break
+            if claimed is None:
+                time.sleep(poll_seconds)  # Every task is held by a running worker
+                continue
+
+            # A task may have finished between listing finished tasks and claiming it
+            lease = Lease(queue_dir, claimed['id'], token)
+            try:
+                if not isfinished(queue_dir, claimed['id']):
+                    processtask(dirpath, queue_dir, settings, claimed, lease, timing)
+                    n_finished += 1
+            finally:
+                lease.release()
+            if isfinished(queue_dir, claimed['id']):  # Not if the lease was lost, the task is still someone's
+                finished.add(claimed['id'])
+    finally:
+        clock = os.path.join(queue_dir, 'clock', token)
+        if os.path.exists(clock):
+            os.remove(clock)
+
+    return n_finished
+
+def queuesummary(dirpath, queue_dir):
+    """Function to collect the record of every finished task, in the format of batch.py summaries
+    --Returns the list of records, in the order of tasks.json"""
+
+    summary = []
+    for task in loadjson(os.path.join(queue_dir, 'tasks.json')):
+        record = None
+        for folder in ['done', 'failed']:
+            record = record or loadjson(os.path.join(queue_dir, folder, task['id'] + '.json'))
+        if record is not None:
+            summary.append(dict(record, file=os.path.join(dirpath, record['file']),
+                                output=os.path.join(dirpath, record['output']), result=None))
+
+    return summary
+
+
+def run(dirpath, workers=workers, stages=stages, start_frame=start_frame, end_frame=end_frame, imglist=None,
+        videolist=None):
+    """Function to create or join the queue of dirpath and process its tasks with worker processes on this computer
+    --imglist, videolist: files to process, all .png, .jpg, .tif, .npy and .avi files within dirpath and its subfolders
+    if not provided, only used by the computer creating the queue
+    --Returns the path of the "Queue" folder and the summary of the queue"""
+
+    settings = {'stages': stages, 'start_frame': start_frame, 'end_frame': end_frame, 'codec': video_writer.codec,
+                'color_mode': image_io.color_mode, 'tile_mode': tiles.tile_mode}
+    settings = json.loads(json.dumps(settings))  # Same values as read back from queue.json, e.g. lists for tuples
+    queue_dir = queuedir(dirpath, settings)
+    os.makedirs(os.path.dirname(queue_dir), exist_ok=True)
+
+    if not os.path.exists(os.path.join(queue_dir, 'queue.json')):
+        if imglist is None and videolist is None:
+            imglist, videolist = findfiles(dirpath)
+        createqueue(dirpath, queue_dir, settings, imglist or [], videolist or [])
+
+    queue = loadjson(os.path.join(queue_dir, 'queue.json'))
+    output_folder = os.path.join(dirpath, queue['output_folder'])
+
+    # Time each file if instrument.py is enabled, the run is timed from before the first worker starts
+    report = instrument.RunReport(output_folder, 'queue', settings)
+
+    # Each worker process claims tasks until none are left
+    workers = os.cpu_count() if workers is None else workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=batch.initworker,
+                                                initargs=(batch.mainsettings(),)) as executor:
+        futures = [executor.submit(work, dirpath, queue_dir, instrument.enabled) for i in range(workers)]
+        for future in futures:
+            future.result()
+
+    summary = queuesummary(dirpath, queue_dir)
+    batch.printsummary(summary)
+
+    # Save timing of each file
+    for entry in summary:
+        if entry['success'] and entry['stage_seconds'] is not None:
+            report.record(entry['file'], os.path.relpath(entry['output'], output_folder), entry['frames'],
+                          entry['seconds'], entry['stage_seconds'])
+    report.save()
+
+    return output_folder, summary
+
+
+if __name__ == '__main__':
+    from tkinter import filedialog  # Only needed to choose a directory interactively
+
+    # Select directory of files
+    dirpath = filedialog.askdirectory()
+    run(dirpath)